@@ -1,5 +1,11 @@
+import csv
 from copy import deepcopy
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.shortcuts import get_object_or_404, redirect
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from unfold.decorators import action
+from .code_import import generate_codes, import_codes, read_codes
 from .utils import FakeQuerySet, getLocationFromCoordinates, save_location_information
 from unfold.admin import ModelAdmin
 from import_export.admin import ImportExportModelAdmin
@@ -15,7 +21,7 @@ from unfold.widgets import UnfoldAdminSingleTimeWidget, UnfoldBooleanSwitchWidge
 from django.contrib.admin.widgets import AutocompleteSelect
 from django.contrib.admin import DateFieldListFilter
 from django.contrib.gis.geos import Point
-from .forms import CarWashForm, CarWashFormInline, CarWashImageForm, CarWashOperatingHoursForm, CarWashPackageForm, CarWashUpdateRequestForm, OfferForm
+from .forms import CarWashForm, CarWashFormInline, CarWashImageForm, CarWashOperatingHoursForm, CarWashPackageForm, CarWashUpdateRequestForm, CodeImportForm, OfferForm
 from unfold.contrib.inlines.admin import NonrelatedStackedInline
 from django.contrib.gis.db import models
 from mapwidgets import widgets
@@ -31,6 +37,7 @@ from .models import (
     Offer,
     CarWashCode,
     Payment,
+    StripeEvent,
     CarWashUpdateRequest
 )
 
@@ -254,19 +261,62 @@ class CarWashPackageAdmin(ModelAdmin):
 @admin.register(Offer)
 class OfferAdmin(ModelAdmin):
     form = OfferForm
+    actions_detail = ('bulk_import_codes',)
     search_fields = ('name', 'package__name', 'package__car_wash__car_wash_name')
     list_display = ('name', 'package', 'package_car_wash', 'offer_type', 'codes_count', 'offer_price', 'created_by', 'updated_by')
     list_filter = ('offer_type', 'package__name', 'package__car_wash')
 
     def codes_count(self, obj):
-        return obj.codes.count()
-    codes_count.short_description = 'Codes'
+        return f"{obj.available_codes} / {obj.total_codes}"
+    codes_count.short_description = 'Available Codes'
+    codes_count.admin_order_field = 'available_codes'
 
     def package_car_wash(self, obj):
         return obj.package.car_wash.car_wash_name if obj.package and obj.package.car_wash else ''
     package_car_wash.short_description = 'Car Wash'
     package_car_wash.admin_order_field = 'package__car_wash__car_wash_name'
 
+    @action(description='Import codes', url_path='import-codes', permissions=['import_codes'])
+    def bulk_import_codes(self, request, object_id):
+        """
+        Bulk loads the codes of an uploaded CSV file, or random ones, with
+        COPY instead of the row by row CarWashCode import.
+        """
+        offer = get_object_or_404(Offer, pk=object_id)
+        form = CodeImportForm(request.POST or None, request.FILES or None)
+
+        if request.method == 'POST' and form.is_valid():
+            if form.cleaned_data['file']:
+                codes = read_codes(form.cleaned_data['file'])
+            else:
+                codes = generate_codes(
+                    form.cleaned_data['generate'],
+                    length=form.cleaned_data['length'],
+                    prefix=form.cleaned_data['prefix'],
+                )
+            try:
+                counts = import_codes(offer, codes, user=request.user)
+            except (ValueError, UnicodeDecodeError, csv.Error) as e:
+                form.add_error(None, str(e))
+            else:
+                messages.success(
+                    request,
+                    f'Created {counts["created"]} of {counts["read"]} codes: {counts["duplicate"]} duplicates, '
+                    f'{counts["existing"]} already in the offer, {counts["invalid"]} blank or too long.',
+                )
+                return redirect(reverse('admin:carwash_offer_change', args=[offer.pk]))
+
+        return TemplateResponse(request, 'admin/carwash/offer/import_codes.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'original': offer,
+            'title': f'Import codes into {offer.name}',
+            'form': form,
+        })
+
+    def has_import_codes_permission(self, request, obj=None):
+        return request.user.has_perm('carwash.add_carwashcode')
+
     class Media:
         js = ('admin/js/offer_dynamic.js',)  
 
@@ -285,7 +335,10 @@ class CarWashCodeResource(resources.ModelResource):
         offer = kwargs.get('offer')
 
         if offer:
-            row['offer'] = Offer.objects.get(id=offer)
+            # Fetched once per import rather than once per row
+            if getattr(self, '_offer', None) is None or str(self._offer.pk) != str(offer):
+                self._offer = Offer.objects.get(id=offer)
+            row['offer'] = self._offer
 
         row['created_by'] = kwargs.get('user')
         row['updated_by'] = kwargs.get('user')
@@ -354,10 +407,10 @@ class CustomImportForm(ImportExportForm):
 class CarWashCodeAdmin(ImportExportModelAdmin, ModelAdmin):
     import_form_class = CustomImportForm
     resource_class = CarWashCodeResource
-    list_display = ('code', 'offer', 'used_at', 'created_by', 'updated_by')
+    list_display = ('code', 'offer', 'used_at', 'reserved_until', 'created_by', 'updated_by')
     list_filter = ('offer__offer_type',)
     search_fields = ('code', 'offer__name')
-    readonly_fields = ('created_by', 'updated_by')
+    readonly_fields = ('reserved_by', 'created_by', 'updated_by')
     autocomplete_fields = ('offer',)
     offer_global = None
 
@@ -407,6 +460,22 @@ class PaymentAdmin(ModelAdmin):
             'updated_by'
         )
 
+@admin.register(StripeEvent)
+class StripeEventAdmin(ModelAdmin):
+    list_display = ('event_id', 'event_type', 'status', 'attempts', 'next_attempt_at', 'processed_at', 'created_at')
+    list_filter = ('status', 'event_type', 'created_at')
+    search_fields = ('event_id', 'payload__data__object__id')
+    readonly_fields = ('event_id', 'event_type', 'payload', 'attempts', 'processed_at', 'last_error', 'created_at', 'updated_at')
+    actions = ('replay_events',)
+
+    @admin.action(description='Replay selected events')
+    def replay_events(self, request, queryset):
+        events_count = StripeEvent.replay(queryset)
+        messages.success(request, f'Queued {events_count} events to be processed again.')
+
+    def has_add_permission(self, request):
+        return False
+
 class ProposedCarWashInline(NonrelatedStackedInline):
     model = CarWash
     collapsible = True
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CarwashConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'carwash'
+
+    def ready(self):
+        import carwash.signals
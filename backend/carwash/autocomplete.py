@@ -0,0 +1,320 @@
+import math
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from heapq import heapify, heappop, nlargest, nsmallest
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import FloatField, Func
+
+from .models import AsGeometry, CarWash
+
+EARTH_RADIUS_MILES = 3958.7613
+
+
+def normalize(text):
+    """
+    Lowercase ASCII form of a text with punctuation collapsed to single
+    spaces, so "Saint-Étienne" and "saint etienne" share a prefix.
+    """
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+
+def distance_miles(lat1, lng1, lat2, lng2):
+    half_dlat = math.sin(math.radians(lat2 - lat1) / 2)
+    half_dlng = math.sin(math.radians(lng2 - lng1) / 2)
+    a = half_dlat**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * half_dlng**2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(min(a, 1)))
+
+
+class AutocompleteSnapshot:
+    """
+    Immutable state of an AutocompleteIndex, swapped as a whole so queries
+    never see a half built index.
+    """
+
+    CELL_SIZE = 1.0  # degrees
+
+    def __init__(self, suggestions, popularity, entries):
+        self.suggestions = suggestions
+        self.popularity = popularity
+        # Sorted word start keys and the suggestion position of each
+        self.keys = [key for key, _ in entries]
+        self.positions = [position for _, position in entries]
+        # Word start keys of each suggestion
+        self.suggestion_keys = [[] for _ in suggestions]
+        for key, position in entries:
+            self.suggestion_keys[position].append(key)
+        # Positions of the located suggestions by grid cell
+        self.cells = {}
+        for position, suggestion in enumerate(suggestions):
+            if suggestion["latitude"] is not None:
+                cell = self.cell_of(suggestion["latitude"], suggestion["longitude"])
+                self.cells.setdefault(cell, []).append(position)
+        # Candidates of broad prefixes, see AutocompleteIndex._candidates
+        self.broad_prefixes = {}
+
+    def cell_of(self, lat, lng):
+        return math.floor(lat / self.CELL_SIZE), math.floor(lng / self.CELL_SIZE)
+
+    def matches(self, position, prefix):
+        return any(key.startswith(prefix) for key in self.suggestion_keys[position])
+
+
+class AutocompleteIndex:
+    """
+    Per-process prefix index of the active car wash names, cities, states
+    and postal codes.
+
+    Every suggestion is stored under each of its word starts ("Sparkle Car
+    Wash" under "sparkle car wash", "car wash" and "wash") in one sorted
+    list, so the suggestions matching a prefix are a contiguous range found
+    by bisection. Places are aggregated from their car washes: their
+    popularity is the number of car washes plus their reviews.
+
+    Broad prefixes ("c", "car w") match thousands of suggestions; only the
+    CANDIDATES most popular of them are ranked by popularity, and those are
+    remembered per prefix (and precomputed for one and two letter
+    prefixes). Searches near a location rank the matches by distance
+    instead, walking a grid of the suggestions outwards from it for broad
+    prefixes, so the nearest matches are found whatever their popularity.
+
+    The index is built on the first query. Afterwards it is rebuilt in a
+    background thread after a car wash changed in this process (see
+    mark_stale()) or every AUTOCOMPLETE_INDEX_REFRESH seconds, while
+    queries keep using the previous one.
+    """
+
+    CANDIDATES = 200
+    NEAREST_SCAN = 5000
+
+    def __init__(self):
+        self.index = None
+        self.built_at = None
+        self.stale = False
+        self._building = False
+        self._lock = threading.Lock()
+
+    def mark_stale(self):
+        self.stale = True
+
+    def get(self):
+        if self.index is None:
+            with self._lock:
+                if self.index is None:
+                    self.build()
+        elif self.stale or time.monotonic() - self.built_at >= settings.AUTOCOMPLETE_INDEX_REFRESH:
+            self._rebuild_in_background()
+        return self.index
+
+    def _rebuild_in_background(self):
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        threading.Thread(target=self._rebuild, name="autocomplete-index", daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            self.build()
+        except Exception as e:
+            print(f"Error rebuilding the autocomplete index: {e}", flush=True)
+        finally:
+            self._building = False
+            # The thread's own database connection
+            connection.close()
+
+    @staticmethod
+    def _rows():
+        geometry = AsGeometry("location")
+        return CarWash.active_objects.values_list(
+            "id",
+            "car_wash_name",
+            "city",
+            "state",
+            "state_code",
+            "postal_code",
+            "reviews_count",
+            Func(geometry, function="ST_Y", output_field=FloatField()),
+            Func(geometry, function="ST_X", output_field=FloatField()),
+        )
+
+    def build(self):
+        self.stale = False
+        suggestions = []
+        places = {}
+
+        def add_to_place(place_type, key, text, popularity, lat, lng):
+            place = places.setdefault((place_type, key), {
+                "type": place_type,
+                "text": text,
+                "car_wash_id": None,
+                "count": 0,
+                "popularity": 0,
+                "latitude": 0,
+                "longitude": 0,
+                "located": 0,
+            })
+            place["count"] += 1
+            place["popularity"] += popularity
+            if lat is not None:
+                place["latitude"] += lat
+                place["longitude"] += lng
+                place["located"] += 1
+
+        for car_wash_id, name, city, state, state_code, postal_code, reviews_count, lat, lng in self._rows():
+            popularity = 1 + (reviews_count or 0)
+            suggestions.append({
+                "type": "car_wash",
+                "text": name,
+                "car_wash_id": car_wash_id,
+                "count": 1,
+                "popularity": popularity,
+                "latitude": lat,
+                "longitude": lng,
+            })
+            if normalize(city):
+                text = f"{city}, {state_code}" if state_code else city
+                add_to_place("city", normalize(text), text, popularity, lat, lng)
+            if normalize(state):
+                add_to_place("state", normalize(state), state, popularity, lat, lng)
+            if normalize(postal_code):
+                add_to_place("postal_code", normalize(postal_code), postal_code, popularity, lat, lng)
+
+        for place in places.values():
+            located = place.pop("located")
+            place["latitude"] = place["latitude"] / located if located else None
+            place["longitude"] = place["longitude"] / located if located else None
+            suggestions.append(place)
+
+        entries = []
+        for position, suggestion in enumerate(suggestions):
+            words = normalize(suggestion["text"]).split(" ")
+            entries += [(" ".join(words[start:]), position) for start in range(len(words)) if words[start]]
+        entries.sort()
+
+        popularity = [suggestion.pop("popularity") for suggestion in suggestions]
+        index = AutocompleteSnapshot(suggestions, popularity, entries)
+        for prefix in sorted({key[:length] for key, _ in entries for length in (1, 2)}):
+            self._candidates(index, prefix)
+
+        self.index = index
+        self.built_at = time.monotonic()
+
+    @staticmethod
+    def _range(index, prefix):
+        """
+        Bounds of the entries of the keys starting with a prefix.
+        """
+        start = bisect_left(index.keys, prefix)
+        return start, bisect_left(index.keys, prefix + "\x7f", lo=start)
+
+    def _candidates(self, index, prefix):
+        """
+        Positions of the suggestions matching a prefix, limited to the most
+        popular CANDIDATES.
+        """
+        if prefix in index.broad_prefixes:
+            return index.broad_prefixes[prefix]
+
+        start, end = self._range(index, prefix)
+        matches = set(index.positions[start:end])
+        if len(matches) > self.CANDIDATES:
+            matches = nlargest(self.CANDIDATES, matches, key=index.popularity.__getitem__)
+            index.broad_prefixes[prefix] = matches
+        return matches
+
+    def _nearest(self, index, prefix, limit, lat, lng):
+        """
+        The limit located suggestions matching a prefix nearest to a
+        location, as (distance, -popularity, position).
+
+        Narrow prefixes are ranked over all their matches. Broad ones visit
+        the occupied grid cells from the nearest until the next cell cannot
+        hold a nearer match, which ends after a few cells as their matches
+        are everywhere.
+        """
+        start, end = self._range(index, prefix)
+        if end - start <= self.NEAREST_SCAN:
+            nearest = []
+            for position in set(index.positions[start:end]):
+                suggestion = index.suggestions[position]
+                if suggestion["latitude"] is not None:
+                    distance = distance_miles(lat, lng, suggestion["latitude"], suggestion["longitude"])
+                    nearest.append((distance, -index.popularity[position], position))
+            return nsmallest(limit, nearest)
+
+        # Occupied cells from the nearest, visited until the next one is
+        # farther than the limit-th nearest match
+        cells = [(self._cell_distance(index, lat, lng, cell), cell) for cell in index.cells]
+        heapify(cells)
+        nearest = []
+        while cells:
+            cell_distance, cell = heappop(cells)
+            if len(nearest) >= limit and nearest[-1][0] <= cell_distance:
+                break
+            for position in index.cells[cell]:
+                if index.matches(position, prefix):
+                    suggestion = index.suggestions[position]
+                    distance = distance_miles(lat, lng, suggestion["latitude"], suggestion["longitude"])
+                    nearest.append((distance, -index.popularity[position], position))
+            nearest = nsmallest(limit, nearest)
+        return nearest
+
+    @staticmethod
+    def _cell_distance(index, lat, lng, cell):
+        """
+        Distance in miles from a location to the nearest point of a grid
+        cell.
+        """
+        south, west = cell[0] * index.CELL_SIZE, cell[1] * index.CELL_SIZE
+        north, east = south + index.CELL_SIZE, west + index.CELL_SIZE
+        # Longitude of the location relative to the cell, in [west, west + 360)
+        lng = west + (lng - west) % 360
+        if lng <= east:
+            return distance_miles(lat, 0, min(max(lat, south), north), 0)
+
+        # Nearest point on the nearer of the west and east edges
+        edge = east if lng - east <= west + 360 - lng else west + 360
+        d_lng = math.radians(lng - edge)
+        edge_lats = [south, north]
+        if math.cos(d_lng) > 0:
+            nearest_lat = math.degrees(math.atan(math.tan(math.radians(lat)) / math.cos(d_lng)))
+            edge_lats.append(min(max(nearest_lat, south), north))
+        return min(distance_miles(lat, lng, edge_lat, edge) for edge_lat in edge_lats)
+
+    def search(self, query, limit=10, lat=None, lng=None):
+        """
+        Suggestions with a word starting with the query, the most popular
+        first, or the nearest first when a location is given.
+        """
+        index = self.get()
+        prefix = normalize(query)
+        if not prefix:
+            return []
+
+        if lat is not None and lng is not None:
+            nearest = self._nearest(index, prefix, limit, lat, lng)
+            positions = [position for _, _, position in nearest]
+            if len(positions) < limit:
+                # Suggestions without a location come last
+                located = set(positions)
+                unlocated = [
+                    position
+                    for position in self._candidates(index, prefix)
+                    if position not in located and index.suggestions[position]["latitude"] is None
+                ]
+                positions += nsmallest(limit - len(positions), unlocated, key=lambda position: -index.popularity[position])
+            return [index.suggestions[position] for position in positions]
+
+        def rank(position):
+            return -index.popularity[position], index.suggestions[position]["text"]
+
+        return [index.suggestions[position] for position in nsmallest(limit, self._candidates(index, prefix), key=rank)]
+
+
+autocomplete_index = AutocompleteIndex()
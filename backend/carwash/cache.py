@@ -0,0 +1,288 @@
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+from utilities import geohash
+
+
+class SearchResponseCache:
+    """
+    Response cache for anonymous car wash searches.
+
+    userLat/userLng are snapped to the center of their geohash tile, so every
+    search from inside a tile shares one entry. Each entry remembers the
+    version of the tiles it depends on: the few geohash cells (of the
+    finest precision keeping them under MAX_COVERING_TILES) covering the
+    search radius, plus the tiles of the car washes it returned. A change to
+    a car wash bumps its tile and every enclosing coarser cell, which turns
+    the dependent entries into misses. Searches without a radius can return
+    car washes from anywhere and depend on the global version.
+    """
+
+    GLOBAL_TILE = "*"
+    LOCATION_PARAMS = ("userLat", "userLng")
+    MAX_COVERING_TILES = 16
+    # Margin over the miles per degree of latitude, which vary with it
+    MILES_PER_DEGREE = 69.0 * 0.99
+
+    @property
+    def cache(self):
+        return caches["search"]
+
+    @property
+    def precision(self):
+        return settings.SEARCH_CACHE_GEOHASH_PRECISION
+
+    def snap_location(self, lat, lng):
+        """
+        Returns the geohash tile of a location and the tile's center.
+        """
+        tile = geohash.encode(float(lat), float(lng), self.precision)
+        snapped_lat, snapped_lng = geohash.decode(tile)
+        return tile, snapped_lat, snapped_lng
+
+    def tile_of(self, location):
+        return geohash.encode(location.y, location.x, self.precision)
+
+    def covering_tiles(self, lat, lng, miles):
+        """
+        Geohash cells covering the bounding box of a circle, at the finest
+        precision needing at most MAX_COVERING_TILES of them, or the global
+        tile when the circle crosses a pole or the antimeridian.
+        """
+        delta_lat = miles / self.MILES_PER_DEGREE
+        if abs(lat) + delta_lat >= 90:
+            return {self.GLOBAL_TILE}
+        delta_lng = delta_lat / math.cos(math.radians(lat))
+        if lng - delta_lng < -180 or lng + delta_lng > 180:
+            return {self.GLOBAL_TILE}
+
+        for precision in range(self.precision, 0, -1):
+            # Geohash characters alternate 5 bits between longitude and latitude
+            width = 360 / 2 ** ((5 * precision + 1) // 2)
+            height = 180 / 2 ** (5 * precision // 2)
+            columns = range(math.floor((lng - delta_lng + 180) / width), math.floor((lng + delta_lng + 180) / width) + 1)
+            rows = range(math.floor((lat - delta_lat + 90) / height), math.floor((lat + delta_lat + 90) / height) + 1)
+            if len(columns) * len(rows) <= self.MAX_COVERING_TILES:
+                return {
+                    geohash.encode(
+                        min((row + 0.5) * height - 90, 90), min((column + 0.5) * width - 180, 180), precision
+                    )
+                    for row in rows
+                    for column in columns
+                }
+        return {self.GLOBAL_TILE}
+
+    def get_key(self, query_params, tile=None, namespace="response"):
+        """
+        Cache key of a search: the query string with parameters and values
+        sorted and the user location replaced by its tile.
+        """
+        items = sorted(
+            (key, sorted(query_params.getlist(key)))
+            for key in query_params
+            if key not in self.LOCATION_PARAMS
+        )
+        canonical = "&".join(f"{key}={','.join(values)}" for key, values in items)
+        digest = hashlib.md5(f"{tile or ''}?{canonical}".encode()).hexdigest()
+        return f"search:{namespace}:{digest}"
+
+    def _version_key(self, tile):
+        return f"search:tile:{tile}"
+
+    def get_versions(self, tiles):
+        """
+        Current version of each tile. Missing versions (never bumped or
+        evicted) are seeded with the current time, see seeded_incr, so they
+        never match a version stored with an older entry.
+        """
+        keys = {self._version_key(tile): tile for tile in tiles}
+        found = self.cache.get_many(list(keys))
+        missing = [key for key in keys if key not in found]
+        if missing:
+            seed = version_seed()
+            for key in missing:
+                self.cache.add(key, seed, timeout=None)
+            found.update(self.cache.get_many(missing))
+        return {tile: found.get(key) for key, tile in keys.items()}
+
+    def get(self, key):
+        """
+        Returns the cached response data, or None when it is missing or one
+        of the tiles it depends on changed since it was stored.
+        """
+        entry = self.cache.get(key)
+        if entry is not None and self.get_versions(entry["versions"]) == entry["versions"]:
+            self._count("hits")
+            return entry["data"]
+        self._count("misses")
+        return None
+
+    def set(self, key, data, tile, locations, radius=None):
+        """
+        Stores the response data of a search made from `tile` (None for
+        searches without a location) within `radius` miles (None without a
+        radius) that returned car washes at `locations`.
+        """
+        tiles = {self.tile_of(location) for location in locations if location}
+        try:
+            radius = float(radius) if radius is not None else None
+        except ValueError:
+            radius = None
+        if tile and radius is not None and radius >= 0:
+            tiles |= self.covering_tiles(*geohash.decode(tile), radius)
+        else:
+            tiles.add(self.GLOBAL_TILE)
+        self.cache.set(key, {"data": data, "versions": self.get_versions(tiles)})
+
+    def invalidate(self, *locations):
+        """
+        Bumps the version of the tiles containing the given locations, at
+        every precision. Searches without a radius depend on every tile, so
+        the global version is bumped as well.
+        """
+        tiles = {self.tile_of(location) for location in locations if location}
+        prefixes = {tile[:length] for tile in tiles for length in range(1, len(tile) + 1)}
+        for tile in prefixes | {self.GLOBAL_TILE}:
+            seeded_incr(self.cache, self._version_key(tile))
+
+    def _count(self, counter):
+        self._incr(f"search:stats:{counter}")
+
+    def _incr(self, key):
+        self.cache.add(key, 0, timeout=None)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, 1, timeout=None)
+
+    def stats(self):
+        counters = self.cache.get_many(["search:stats:hits", "search:stats:misses"])
+        hits = counters.get("search:stats:hits", 0)
+        misses = counters.get("search:stats:misses", 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0,
+            "backend": settings.CACHES["search"]["BACKEND"],
+            "geohash_precision": self.precision,
+        }
+
+
+class VectorTileCache:
+    """
+    Cache of rendered car wash vector tiles. When a car wash changes, the
+    tiles containing it at every zoom level are dropped.
+    """
+
+    MAX_ZOOM = 22
+
+    @property
+    def cache(self):
+        return caches["search"]
+
+    def _key(self, z, x, y):
+        return f"tiles:{z}/{x}/{y}"
+
+    def get(self, z, x, y):
+        return self.cache.get(self._key(z, x, y))
+
+    def set(self, z, x, y, tile):
+        self.cache.set(self._key(z, x, y), tile)
+
+    def invalidate(self, *locations):
+        keys = []
+        for location in locations:
+            if location:
+                keys += [
+                    self._key(z, *tile_coordinates(location.y, location.x, z))
+                    for z in range(self.MAX_ZOOM + 1)
+                ]
+        if keys:
+            self.cache.delete_many(keys)
+
+
+class CarWashFragmentCache:
+    """
+    Cache of the request independent CarWashListSerializer output of each
+    car wash. Entries are dropped when the car wash or one of its related
+    rows changes; changes to shared rows (wash types, amenities) move every
+    entry to a new generation instead.
+    """
+
+    @property
+    def cache(self):
+        return caches["fragments"]
+
+    def _generation(self):
+        return self.cache.get_or_set("carwash:fragment:generation", version_seed, timeout=None)
+
+    def _key(self, car_wash_id, generation):
+        return f"carwash:fragment:{generation}:{car_wash_id}"
+
+    def get_many(self, car_wash_ids):
+        generation = self._generation()
+        keys = {self._key(car_wash_id, generation): car_wash_id for car_wash_id in car_wash_ids}
+        return {keys[key]: fragment for key, fragment in self.cache.get_many(list(keys)).items()}
+
+    def set_many(self, fragments):
+        generation = self._generation()
+        self.cache.set_many(
+            {self._key(car_wash_id, generation): fragment for car_wash_id, fragment in fragments.items()},
+            timeout=settings.CAR_WASH_FRAGMENT_CACHE_TIMEOUT,
+        )
+
+    def invalidate(self, *car_wash_ids):
+        generation = self._generation()
+        self.cache.delete_many([self._key(car_wash_id, generation) for car_wash_id in car_wash_ids])
+
+    def invalidate_all(self):
+        seeded_incr(self.cache, "carwash:fragment:generation")
+
+
+def version_seed():
+    # Microseconds: versions are bumped by one, far slower than the clock
+    return time.time_ns() // 1_000
+
+
+def seeded_incr(cache, key):
+    """
+    Increments a version counter that starts at the current time rather
+    than at zero, so a counter lost to eviction never comes back with a
+    value handed out before (see utilities/versions.py).
+    """
+    cache.add(key, version_seed(), timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, version_seed(), timeout=None)
+
+
+def tile_coordinates(lat, lng, zoom):
+    """
+    x/y of the web mercator tile containing a coordinate at a zoom level.
+    """
+    lat = max(min(lat, 85.0511), -85.0511)
+    n = 2**zoom
+    x = int((lng + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def process_local_caches():
+    """
+    Aliases of the caches changed on commit of car wash and offer updates
+    that only live in the current process, so updates made by another
+    process (e.g. the Stripe worker) never reach them.
+    """
+    aliases = {"search", "fragments", settings.CHANGE_VERSIONS_CACHE}
+    return sorted(alias for alias in aliases if isinstance(caches[alias], LocMemCache))
+
+
+search_cache = SearchResponseCache()
+tile_cache = VectorTileCache()
+fragment_cache = CarWashFragmentCache()
@@ -0,0 +1,121 @@
+import codecs
+import csv
+import io
+import secrets
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import CarWashCode, Offer
+
+# Uppercase letters and digits without the easily confused 0/O and 1/I/L
+CODE_ALPHABET = "23456789ABCDEFGHJKMNPQRSTUVWXYZ"
+CODE_MAX_LENGTH = CarWashCode._meta.get_field("code").max_length
+
+
+def generate_codes(count, length=10, prefix=""):
+    """
+    Yields count distinct random codes made of prefix and length characters
+    of CODE_ALPHABET.
+    """
+    if len(CODE_ALPHABET) ** length < count:
+        raise ValueError(f"{length} characters are too few for {count} distinct codes")
+
+    generated = set()
+    while len(generated) < count:
+        code = prefix + "".join(secrets.choice(CODE_ALPHABET) for _ in range(length))
+        if code not in generated:
+            generated.add(code)
+            yield code
+
+
+def read_codes(file, encoding="utf-8-sig"):
+    """
+    Streams the codes of a CSV file (binary or text), read from its "code"
+    column or from the first column when it has no such header.
+    """
+    if isinstance(file.read(0), bytes):
+        file = codecs.getreader(encoding)(file)
+
+    rows = csv.reader(file)
+    header = next(rows, None)
+    if header is None:
+        return
+    columns = [column.strip().lower() for column in header]
+    if "code" in columns:
+        column = columns.index("code")
+    else:
+        column = 0
+        yield header[0] if header else ""
+
+    for row in rows:
+        if row:
+            yield row[column] if len(row) > column else ""
+
+
+def import_codes(offer, codes, user=None, batch_size=10000):
+    """
+    Loads codes into an offer and returns the counts of the read, created,
+    blank or too long (invalid), repeated (duplicate) and already present
+    (existing) codes.
+
+    The codes of the offer are deduplicated in memory, streamed in batches
+    into a temporary table with COPY and inserted with a single
+    INSERT ... SELECT, which skips the codes another import added in the
+    meantime. Bulk inserts bypass the CarWashCode signals, so the offer
+    counters are updated here.
+    """
+    counts = {"read": 0, "created": 0, "invalid": 0, "duplicate": 0, "existing": 0}
+    existing = set(CarWashCode.objects.filter(offer=offer).values_list("code", flat=True).iterator())
+    imported = set()
+    user_id = user.pk if user else None
+    table = CarWashCode._meta.db_table
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMPORARY TABLE IF NOT EXISTS carwashcode_import (code varchar(%s)) ON COMMIT DROP",
+            [CODE_MAX_LENGTH],
+        )
+        cursor.execute("TRUNCATE carwashcode_import")
+
+        batch = []
+        for code in codes:
+            counts["read"] += 1
+            code = code.strip()
+            if not code or len(code) > CODE_MAX_LENGTH:
+                counts["invalid"] += 1
+            elif code in existing:
+                counts["existing"] += 1
+            elif code in imported:
+                counts["duplicate"] += 1
+            else:
+                imported.add(code)
+                batch.append(code)
+                if len(batch) >= batch_size:
+                    _copy(cursor, batch)
+                    batch = []
+        if batch:
+            _copy(cursor, batch)
+
+        now = timezone.now()
+        cursor.execute(
+            f"""
+            INSERT INTO {table} (offer_id, code, created_by_id, updated_by_id, created_at, updated_at, status)
+            SELECT %s, code, %s, %s, %s, %s, 'ACTIVE' FROM carwashcode_import
+            ON CONFLICT DO NOTHING
+            """,
+            [offer.pk, user_id, user_id, now, now],
+        )
+        counts["created"] = cursor.rowcount
+        # Codes inserted by a concurrent import since existing was read
+        counts["existing"] += len(imported) - counts["created"]
+
+        Offer.update_code_counts(offer.pk, total=counts["created"], available=counts["created"])
+    return counts
+
+
+def _copy(cursor, codes):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([code] for code in codes)
+    buffer.seek(0)
+    cursor.copy_expert("COPY carwashcode_import (code) FROM STDIN WITH (FORMAT csv)", buffer)
@@ -1,19 +1,173 @@
 from rest_framework import filters
 import django_filters
-from .models import CarWash, CarWashReview, CarWashCode, Offer
+from django_filters.constants import EMPTY_VALUES
+from django_filters.rest_framework import DjangoFilterBackend
+from .models import (
+    minute_of_week,
+    CarWash,
+    CarWashReview,
+    CarWashCode,
+    Offer,
+    AmenityCarWashMapping,
+    CarWashPackage,
+)
 from django.db.models import (
-    Value,
-    DecimalField,
-    FloatField,
-    Q,
+    CharField,
+    Count,
     Exists,
+    FloatField,
     OuterRef,
-    Case,
-    When,
-    Min,
+    Q,
+    F,
+    Value,
 )
-from django.db.models.functions import Coalesce
+from django.db.models.functions import Cast
 from django.utils import timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError, available_timezones
+from django.core.exceptions import ValidationError
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    TrigramWordSimilarity,
+)
+
+
+def search_car_washes(queryset, terms):
+    """
+    Match car washes against their search document, using the full-text
+    index for whole words and the trigram index for partial words, and
+    annotate search_rank for relevance ordering.
+    """
+    if "search_rank" in queryset.query.annotations:
+        return queryset
+
+    query = SearchQuery(terms, search_type="websearch", config="simple")
+    return queryset.filter(
+        Q(search_vector=query) | Q(search_document__icontains=terms)
+    ).annotate(
+        search_rank=SearchRank(F("search_vector"), query)
+        + TrigramWordSimilarity(terms, "search_document")
+    )
+
+
+def without_ordering(data):
+    """
+    Search query parameters without sortBy, for the endpoints aggregating
+    the results of a search: its orderings may rely on annotations (e.g.
+    knn_distance) those endpoints do not make.
+    """
+    data = data.copy()
+    data.pop("sortBy", None)
+    return data
+
+
+def get_min_price_field(data):
+    """
+    CarWash minimum price column matching the package category filter,
+    the same way CarWashListSerializer.get_packages picks packages.
+    """
+    if data.get("selfServiceCarWash") == "true":
+        return "min_price_selfservice"
+    if data.get("automaticCarWash") == "true":
+        return "min_price_automatic"
+    return "min_price"
+
+
+@lru_cache(maxsize=1)
+def get_time_zone_names():
+    # available_timezones() walks the tz database on every call
+    return frozenset(available_timezones())
+
+
+def validate_time_zone(value):
+    """
+    Rejects names ZoneInfo cannot load, such as "America" (a directory of
+    the tz database) or paths.
+    """
+    if value and value not in get_time_zone_names():
+        raise ValidationError(f"Unknown time zone: {value}")
+
+
+# ListCarWashFilter parameter -> (model, lookup of the value, lookup of the car wash)
+CAR_WASH_FACETS = {
+    "washTypeName": (CarWashPackage.wash_types.through, "washtype__name", "carwashpackage__car_wash_id"),
+    "washTypeCategory": (CarWashPackage, "category", "car_wash_id"),
+    "amenityName": (AmenityCarWashMapping, "amenity__name", "car_wash_id"),
+    "amenityCategory": (AmenityCarWashMapping, "amenity__category", "car_wash_id"),
+    "offers": (Offer, "offer_type", "package__car_wash_id"),
+    "verified": (CarWash, "verified", "id"),
+    "open24Hours": (CarWash, "open_24_hours", "id"),
+    "active_bounty": (CarWash, "active_bounty", "id"),
+}
+
+
+def get_facet_counts(queryset):
+    """
+    Number of car washes of the queryset per value of every facet in
+    CAR_WASH_FACETS, computed in one UNION ALL of grouped counts.
+    """
+    car_wash_ids = queryset.order_by().values("id")
+    facet_querysets = [
+        model.objects.filter(**{f"{car_wash_lookup}__in": car_wash_ids})
+        .values(facet=Value(facet), value=Cast(value_lookup, CharField()))
+        .annotate(count=Count(car_wash_lookup, distinct=True))
+        .order_by()
+        for facet, (model, value_lookup, car_wash_lookup) in CAR_WASH_FACETS.items()
+    ]
+    totals = CarWash.objects.filter(id__in=car_wash_ids).values(
+        facet=Value("total"), value=Value("", output_field=CharField())
+    ).annotate(count=Count("id")).order_by()
+
+    facets = {"total": 0, **{facet: {} for facet in CAR_WASH_FACETS}}
+    for row in totals.union(*facet_querysets, all=True):
+        if row["facet"] == "total":
+            facets["total"] = row["count"]
+        elif row["value"] is not None:
+            facets[row["facet"]][row["value"]] = row["count"]
+    return facets
+
+
+class ExistsInFilter(django_filters.BaseInFilter):
+    """
+    `in` filter across a multi-valued relation, applied as an EXISTS semi-join
+    on related_model instead of a join, so matching rows are not multiplied
+    and the queryset never needs DISTINCT.
+
+    related_field is the field of related_model pointing back at outer_field
+    of the filtered model; field_name is looked up on related_model.
+    """
+
+    def __init__(self, *args, related_model, related_field, outer_field="pk", **kwargs):
+        self.related_model = related_model
+        self.related_field = related_field
+        self.outer_field = outer_field
+        super().__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        return qs.filter(
+            Exists(
+                self.related_model.objects.filter(
+                    **{
+                        self.related_field: OuterRef(self.outer_field),
+                        f"{self.field_name}__{self.lookup_expr}": value,
+                    }
+                )
+            )
+        )
+
+
+class UnorderedFilterBackend(DjangoFilterBackend):
+    """
+    DjangoFilterBackend ignoring sortBy, see without_ordering.
+    """
+
+    def get_filterset_kwargs(self, request, queryset, view):
+        kwargs = super().get_filterset_kwargs(request, queryset, view)
+        kwargs["data"] = without_ordering(kwargs["data"])
+        return kwargs
 
 
 class DynamicSearchFilter(filters.SearchFilter):
@@ -24,66 +178,55 @@ class DynamicSearchFilter(filters.SearchFilter):
         else:
             return search_fields
 
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+
+        # Car washes are searched through their indexed search document
+        # whenever the requested fields are all part of it
+        if (
+            search_terms
+            and queryset.model is CarWash
+            and set(search_fields or []) <= set(CarWash.SEARCH_DOCUMENT_FIELDS)
+        ):
+            return search_car_washes(queryset, " ".join(search_terms))
+
+        return super().filter_queryset(request, queryset, view)
+
 
 class CustomOrderingCarWashFilter(django_filters.OrderingFilter):
     def filter(self, qs, value):
         if not value:
             return qs
 
+        # Sort on the minimum price of the package category being shown
+        min_price_field = get_min_price_field(self.parent.data)
+
         custom_ordering = {
-            "price_high_to_low": ["-min_price", "car_wash_name"],
-            "price_low_to_high": ["min_price", "car_wash_name"],
+            "price_high_to_low": [f"-{min_price_field}", "car_wash_name"],
+            "price_low_to_high": [min_price_field, "car_wash_name"],
             "recommended": [
-                "-has_offer_or_bounty",
+                "-offer_now",
                 "-reviews_average",
-                "distance",
+                "knn_distance",
             ],
-            "distance_near_to_far": ["distance"],
+            "distance_near_to_far": ["knn_distance", "id"],
+            "relevance": ["-search_rank", "id"],
         }
 
-        if value[0] in ["price_high_to_low", "price_low_to_high"]:
-            qs = qs.annotate(
-                min_price=Coalesce(
-                    Min("packages__price"), Value(0, output_field=DecimalField())
-                )
-            )
-        elif value[0] == "recommended":
-            # Annotate with whether carwash has active offers (TIME_DEPENDENT or ONE_TIME) or active bounty
-            # This will prioritize carwashes with offers at the top
-            # First, annotate if carwash has active offers (excluding GEOGRAPHICAL)
-            now = timezone.now().time()
-            qs = qs.annotate(
-                has_active_offer=Exists(
-                    Offer.objects.filter(
-                        package__car_wash=OuterRef("pk"),
-                        status="ACTIVE",
-                    ).filter(
-                        # ONE_TIME offers are always valid if status is ACTIVE
-                        Q(offer_type="ONE_TIME")
-                        # TIME_DEPENDENT offers must be within their time window
-                        | Q(
-                            offer_type="TIME_DEPENDENT",
-                            start_time__lte=now,
-                            end_time__gte=now,
-                        )
-                    )
-                )
-            )
-
-            # Combine offer and bounty into a single boolean field for sorting
-            qs = qs.annotate(
-                has_offer_or_bounty=Case(
-                    When(
-                        has_active_offer=True,
-                        then=Value(1, output_field=DecimalField()),
-                    ),
-                    When(
-                        active_bounty=True, then=Value(1, output_field=DecimalField())
-                    ),
-                    default=Value(0, output_field=DecimalField()),
-                    output_field=DecimalField(),
-                )
+        if value[0] == "recommended":
+            # Annotated rather than aliased: cursor pagination reads the sort
+            # key from the instances (and has_offer_now is a model method)
+            qs = qs.annotate(offer_now=CarWash.has_offer_now())
+        elif value[0] == "relevance":
+            # sortBy is applied before searchLocations, so rank here
+            terms = self.parent.data.get("searchLocations") or self.parent.data.get(
+                "search"
             )
+            if terms:
+                qs = search_car_washes(qs, " ".join(terms.split(",")))
+            elif "search_rank" not in qs.query.annotations:
+                return qs.order_by("id")
 
         ordering = custom_ordering.get(value[0], value)
         return qs.order_by(*ordering)
@@ -113,20 +256,28 @@ class ListCarWashFilter(django_filters.FilterSet):
     )
     open24Hours = django_filters.BooleanFilter(field_name="open_24_hours")
     verified = django_filters.BooleanFilter(field_name="verified")
-    washTypeName = django_filters.BaseInFilter(
-        field_name="packages__wash_types__name", lookup_expr="in"
+    washTypeName = ExistsInFilter(
+        related_model=CarWashPackage,
+        related_field="car_wash",
+        field_name="wash_types__name",
     )
-    washTypeSubClass = django_filters.BaseInFilter(
-        field_name="packages__wash_types__subclass", lookup_expr="in"
+    washTypeSubClass = ExistsInFilter(
+        related_model=CarWashPackage,
+        related_field="car_wash",
+        field_name="wash_types__subclass",
     )
-    washTypeCategory = django_filters.BaseInFilter(
-        field_name="packages__category", lookup_expr="in"
+    washTypeCategory = ExistsInFilter(
+        related_model=CarWashPackage, related_field="car_wash", field_name="category"
     )
-    amenityName = django_filters.BaseInFilter(
-        field_name="amenities__name", lookup_expr="in"
+    amenityName = ExistsInFilter(
+        related_model=AmenityCarWashMapping,
+        related_field="car_wash",
+        field_name="amenity__name",
     )
-    amenityCategory = django_filters.BaseInFilter(
-        field_name="amenities__category", lookup_expr="in"
+    amenityCategory = ExistsInFilter(
+        related_model=AmenityCarWashMapping,
+        related_field="car_wash",
+        field_name="amenity__category",
     )
     sortBy = CustomOrderingCarWashFilter(
         fields=(
@@ -137,6 +288,7 @@ class ListCarWashFilter(django_filters.FilterSet):
             ("price_low_to_high", "price_low_to_high"),
             ("recommended", "recommended"),
             ("distance_near_to_far", "distance_near_to_far"),
+            ("relevance", "relevance"),
         )
     )
     searchLocations = django_filters.BaseInFilter(
@@ -152,12 +304,19 @@ class ListCarWashFilter(django_filters.FilterSet):
     distance = django_filters.NumberFilter(
         method="get_nearest_shops", label="Distance in miles of radius"
     )
-    offers = django_filters.BaseInFilter(
-        field_name="packages__offer__offer_type", lookup_expr="in"
+    offers = ExistsInFilter(
+        related_model=Offer, related_field="package__car_wash", field_name="offer_type"
     )
     active_bounty = django_filters.BooleanFilter(
         field_name="active_bounty", label="Active Bounty"
     )
+    openNow = django_filters.BooleanFilter(method="filter_open_now", label="Open Now")
+    openAt = django_filters.IsoDateTimeFilter(method="filter_open_at", label="Open At")
+    timeZone = django_filters.CharFilter(
+        method="filter_time_zone",
+        label="Time zone of openNow",
+        validators=[validate_time_zone],
+    )
 
     class Meta:
         model = CarWash
@@ -182,37 +341,52 @@ class ListCarWashFilter(django_filters.FilterSet):
             "sortBy",
             "offers",
             "active_bounty",
+            "openNow",
+            "openAt",
+            "timeZone",
         )
 
     def filter_user_location(self, queryset, name, value):
         return queryset
 
-    def get_nearest_shops(self, queryset, name, value):
+    def filter_time_zone(self, queryset, name, value):
+        return queryset
+
+    def get_time_zone(self):
+        try:
+            return ZoneInfo(self.data.get("timeZone") or "")
+        except (ZoneInfoNotFoundError, ValueError, OSError):
+            return timezone.get_current_timezone()
+
+    def filter_open_now(self, queryset, name, value):
         if value:
-            return queryset.filter(distance__lte=float(value))
+            now = timezone.localtime(timezone.now(), self.get_time_zone())
+            return self.filter_open_at(queryset, name, now)
+        return queryset
+
+    def filter_open_at(self, queryset, name, value):
+        """
+        Car washes open at the weekday and wall clock time of the given moment.
+        """
+        if not value:
+            return queryset
+        return queryset.filter(opening_schedule__contains=minute_of_week(value))
+
+    def get_nearest_shops(self, queryset, name, value):
+        # The radius is applied as an index-backed prefilter by
+        # CarWash.get_nearest in ListCarWashAPIView.get_queryset
         return queryset
 
     def price(self, queryset, name, value):
-        queryset = queryset.annotate(
-            min_price=Coalesce(
-                Min("packages__price"), Value(0, output_field=DecimalField())
-            )
-        )
         if value:
-            return queryset.filter(min_price__lte=float(value[0]))
+            min_price_field = get_min_price_field(self.data)
+            return queryset.filter(**{f"{min_price_field}__lte": float(value[0])})
         return queryset
 
     def filter_search(self, queryset, name, value):
-        return queryset.filter(
-            Q(street__icontains=value)
-            | Q(city__icontains=value)
-            | Q(state__icontains=value)
-            | Q(state_code__icontains=value)
-            | Q(postal_code__icontains=value)
-            | Q(country__icontains=value)
-            | Q(country_code__icontains=value)
-            | Q(formatted_address__icontains=value)
-        )
+        if not value:
+            return queryset
+        return search_car_washes(queryset, " ".join(value))
 
     def filter_automatic_car_wash(self, queryset, name, value):
         """
@@ -220,7 +394,13 @@ class ListCarWashFilter(django_filters.FilterSet):
         with category="automatic"
         """
         if value:
-            return queryset.filter(packages__category="automatic").distinct()
+            return queryset.filter(
+                Exists(
+                    CarWashPackage.objects.filter(
+                        car_wash=OuterRef("pk"), category="automatic"
+                    )
+                )
+            )
         return queryset
 
     def filter_self_service_car_wash(self, queryset, name, value):
@@ -229,7 +409,13 @@ class ListCarWashFilter(django_filters.FilterSet):
         with category="selfservice"
         """
         if value:
-            return queryset.filter(packages__category="selfservice").distinct()
+            return queryset.filter(
+                Exists(
+                    CarWashPackage.objects.filter(
+                        car_wash=OuterRef("pk"), category="selfservice"
+                    )
+                )
+            )
         return queryset
 
 
@@ -339,20 +525,32 @@ class ListOfferFilter(django_filters.FilterSet):
         field_name="package__car_wash__open_24_hours"
     )
     verified = django_filters.BooleanFilter(field_name="package__car_wash__verified")
-    washTypeName = django_filters.BaseInFilter(
-        field_name="package__wash_types__name", lookup_expr="in"
-    )
-    washTypeSubClass = django_filters.BaseInFilter(
-        field_name="package__wash_types__subclass", lookup_expr="in"
+    washTypeName = ExistsInFilter(
+        related_model=CarWashPackage,
+        related_field="pk",
+        outer_field="package",
+        field_name="wash_types__name",
+    )
+    washTypeSubClass = ExistsInFilter(
+        related_model=CarWashPackage,
+        related_field="pk",
+        outer_field="package",
+        field_name="wash_types__subclass",
     )
     washTypeCategory = django_filters.BaseInFilter(
         field_name="package__category", lookup_expr="in"
     )
-    amenityName = django_filters.BaseInFilter(
-        field_name="package__car_wash__amenities__name", lookup_expr="in"
+    amenityName = ExistsInFilter(
+        related_model=AmenityCarWashMapping,
+        related_field="car_wash",
+        outer_field="package__car_wash",
+        field_name="amenity__name",
     )
-    amenityCategory = django_filters.BaseInFilter(
-        field_name="package__car_wash__amenities__category", lookup_expr="in"
+    amenityCategory = ExistsInFilter(
+        related_model=AmenityCarWashMapping,
+        related_field="car_wash",
+        outer_field="package__car_wash",
+        field_name="amenity__category",
     )
     active_bounty = django_filters.BooleanFilter(
         field_name="package__car_wash__active_bounty", label="Active Bounty"
@@ -370,7 +568,7 @@ class ListOfferFilter(django_filters.FilterSet):
         with category="automatic"
         """
         if value:
-            return queryset.filter(package__category="automatic").distinct()
+            return queryset.filter(package__category="automatic")
         return queryset
 
     def filter_self_service_car_wash(self, queryset, name, value):
@@ -379,7 +577,7 @@ class ListOfferFilter(django_filters.FilterSet):
         with category="selfservice"
         """
         if value:
-            return queryset.filter(package__category="selfservice").distinct()
+            return queryset.filter(package__category="selfservice")
         return queryset
 
     def filter_offer_filter(self, queryset, name, value):
@@ -1,6 +1,6 @@
 from django import forms
 from .models import CarWashImage, CarWashOperatingHours, CarWashPackage, CarWash, CarWashUpdateRequest, Offer
-from unfold.widgets import UnfoldAdminDecimalFieldWidget
+from unfold.widgets import UnfoldAdminDecimalFieldWidget, UnfoldAdminFileFieldWidget, UnfoldAdminIntegerFieldWidget, UnfoldAdminTextInputWidget
 from django.contrib.gis.geos import Point
 from django_select2.forms import ModelSelect2Widget
 
@@ -108,4 +108,27 @@ class CarWashForm(forms.ModelForm):
 
     class Meta:
         model = CarWash
-        exclude = ["street", "city", "state", "state_code", "postal_code", "country", "country_code", "formatted_address"]
\ No newline at end of file
+        exclude = ["street", "city", "state", "state_code", "postal_code", "country", "country_code", "formatted_address"]
+
+class CodeImportForm(forms.Form):
+    file = forms.FileField(
+        required=False,
+        label='CSV file',
+        help_text='A "code" column, or the codes in the first column',
+        widget=UnfoldAdminFileFieldWidget(),
+    )
+    generate = forms.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=1000000,
+        label='Or generate random codes',
+        widget=UnfoldAdminIntegerFieldWidget(),
+    )
+    length = forms.IntegerField(min_value=4, max_value=40, initial=10, widget=UnfoldAdminIntegerFieldWidget())
+    prefix = forms.CharField(required=False, max_length=10, widget=UnfoldAdminTextInputWidget())
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if bool(cleaned_data.get('file')) == bool(cleaned_data.get('generate')):
+            raise forms.ValidationError('Upload a CSV file or enter a number of codes to generate.')
+        return cleaned_data
@@ -0,0 +1,49 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.http import QueryDict
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from carwash.views import ListCarWashAPIView, ListOfferAPIView
+from utilities.renderers import FastJSONRenderer, MessagePackRenderer, msgpack
+
+
+class Command(BaseCommand):
+    help = 'Compare the response renderers on real unpaginated search and offer payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument(
+            '--params',
+            default='',
+            help='Extra search query string, e.g. "userLat=40.7&userLng=-74.0"',
+        )
+
+    def handle(self, *args, **options):
+        renderers = [('DRF JSONRenderer', JSONRenderer()), ('FastJSONRenderer', FastJSONRenderer())]
+        if msgpack is not None:
+            renderers.append(('MessagePackRenderer', MessagePackRenderer()))
+
+        params = QueryDict(options['params'], mutable=True)
+        params['pagination'] = 'false'
+        factory = APIRequestFactory()
+
+        payloads = [
+            ('search', ListCarWashAPIView, '/api/v1/carwash/search/'),
+            ('offers', ListOfferAPIView, '/api/v1/carwash/offers/search/'),
+        ]
+        for name, view_class, path in payloads:
+            response = view_class.as_view()(factory.get(path, params))
+            data = response.data
+
+            self.stdout.write(f'{name}: {len(data.get("data") or [])} results')
+            for renderer_name, renderer in renderers:
+                body = renderer.render(data)
+                seconds = timeit.timeit(lambda: renderer.render(data), number=options['iterations'])
+                self.stdout.write(
+                    f'  {renderer_name:<20} {seconds / options["iterations"] * 1000:8.2f} ms'
+                    f'  {len(body) / 1024:10.1f} KB'
+                )
+
+        self.stdout.write(self.style.SUCCESS('Successfully benchmarked renderers'))
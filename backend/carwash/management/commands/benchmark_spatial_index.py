@@ -0,0 +1,93 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from carwash.spatial_index import SpatialIndex, np
+
+# Continental US, where the generated points are spread
+BOUNDS = (-125.0, 25.0, -67.0, 49.0)
+METERS_PER_MILE = 1609.34
+
+
+class Command(BaseCommand):
+    help = 'Compare the in-process spatial index with PostGIS on generated points'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000')
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--radius', type=float, default=10, help='Radius in miles')
+        parser.add_argument('--k', type=int, default=10, help='Neighbours of the nearest queries')
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError('numpy is not installed')
+
+        rng = random.Random(0)
+        min_lng, min_lat, max_lng, max_lat = BOUNDS
+        queries = [
+            (rng.uniform(min_lat, max_lat), rng.uniform(min_lng, max_lng))
+            for _ in range(options['queries'])
+        ]
+
+        for size in (int(size) for size in options['sizes'].split(',')):
+            with transaction.atomic(), connection.cursor() as cursor:
+                rows = self.create_points(cursor, size)
+
+                started = time.perf_counter()
+                index = SpatialIndex.from_rows(rows)
+                build_ms = (time.perf_counter() - started) * 1000
+
+                self.stdout.write(f'{size} points (index built in {build_ms:.0f} ms)')
+                self.report('index radius', queries, lambda lat, lng: index.within(lat, lng, options['radius']))
+                self.report('postgis radius', queries, lambda lat, lng: self.postgis_within(cursor, lat, lng, options['radius']))
+                self.report('index nearest', queries, lambda lat, lng: index.nearest(lat, lng, options['k']))
+                self.report('postgis nearest', queries, lambda lat, lng: self.postgis_nearest(cursor, lat, lng, options['k']))
+
+                transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS('Successfully benchmarked the spatial index'))
+
+    def report(self, name, queries, query):
+        started = time.perf_counter()
+        for lat, lng in queries:
+            query(lat, lng)
+        elapsed = (time.perf_counter() - started) / len(queries)
+        self.stdout.write(f'  {name:<16} {elapsed * 1_000_000:10.1f} us/query')
+
+    def create_points(self, cursor, size):
+        min_lng, min_lat, max_lng, max_lat = BOUNDS
+        cursor.execute(
+            'CREATE TEMPORARY TABLE benchmark_points (id serial PRIMARY KEY, location geography(Point, 4326)) '
+            'ON COMMIT DROP'
+        )
+        cursor.execute('SELECT setseed(0)')
+        cursor.execute(
+            'INSERT INTO benchmark_points (location) '
+            'SELECT ST_SetSRID(ST_MakePoint(%s + random() * %s, %s + random() * %s), 4326)::geography '
+            'FROM generate_series(1, %s)',
+            [min_lng, max_lng - min_lng, min_lat, max_lat - min_lat, size],
+        )
+        cursor.execute('CREATE INDEX ON benchmark_points USING GIST (location)')
+        cursor.execute('ANALYZE benchmark_points')
+        cursor.execute('SELECT id, ST_Y(location::geometry), ST_X(location::geometry) FROM benchmark_points')
+        return cursor.fetchall()
+
+    def postgis_within(self, cursor, lat, lng, miles):
+        cursor.execute(
+            'SELECT id, ST_Distance(location, point) FROM benchmark_points, '
+            '(SELECT ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography AS point) AS origin '
+            'WHERE ST_DWithin(location, point, %s) ORDER BY location <-> point',
+            [lng, lat, miles * METERS_PER_MILE],
+        )
+        return cursor.fetchall()
+
+    def postgis_nearest(self, cursor, lat, lng, k):
+        cursor.execute(
+            'SELECT id, ST_Distance(location, point) FROM benchmark_points, '
+            '(SELECT ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography AS point) AS origin '
+            'ORDER BY location <-> point LIMIT %s',
+            [lng, lat, k],
+        )
+        return cursor.fetchall()
@@ -0,0 +1,47 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from carwash.code_import import CODE_MAX_LENGTH, generate_codes, import_codes, read_codes
+from carwash.models import Offer
+
+class Command(BaseCommand):
+    help = 'Bulk load car wash codes into an offer from a CSV file or generate random ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('offer_id', type=int)
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--file', help='CSV file with a "code" column, or the codes in its first column')
+        source.add_argument('--generate', type=int, help='Number of random codes to generate')
+        parser.add_argument('--length', type=int, default=10, help='Length of the generated codes')
+        parser.add_argument('--prefix', default='', help='Prefix of the generated codes')
+        parser.add_argument('--user', help='Username recorded as the creator of the codes')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        try:
+            offer = Offer.objects.get(id=options['offer_id'])
+        except Offer.DoesNotExist:
+            raise CommandError(f'Offer {options["offer_id"]} does not exist')
+
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f'User {options["user"]} does not exist')
+
+        if options['file']:
+            with open(options['file'], newline='', encoding='utf-8-sig') as file:
+                counts = import_codes(offer, read_codes(file), user=user, batch_size=options['batch_size'])
+        else:
+            try:
+                codes = generate_codes(options['generate'], length=options['length'], prefix=options['prefix'])
+                counts = import_codes(offer, codes, user=user, batch_size=options['batch_size'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        self.stdout.write(
+            f'{counts["read"]} codes read: {counts["duplicate"]} duplicates, {counts["existing"]} already '
+            f'in the offer, {counts["invalid"]} blank or longer than {CODE_MAX_LENGTH} characters'
+        )
+        self.stdout.write(self.style.SUCCESS(f'Successfully created {counts["created"]} codes for {offer.name}'))
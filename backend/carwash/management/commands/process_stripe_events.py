@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from carwash.cache import process_local_caches
+from carwash.webhook import process_pending_events
+
+class Command(BaseCommand):
+    help = 'Process the Stripe webhook events waiting in the inbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--forever', action='store_true', help='Keep polling the inbox once it is drained')
+        parser.add_argument('--interval', type=float, default=2, help='Seconds between polls with --forever')
+
+    def handle(self, *args, **options):
+        local_caches = process_local_caches()
+        if options['forever'] and local_caches:
+            # A separate worker process would only invalidate its own copy
+            raise CommandError(
+                f'The {", ".join(local_caches)} caches are local to each process; '
+                'set SEARCH_CACHE_BACKEND to a shared backend (e.g. database) before running --forever'
+            )
+        total_processed = total_failed = 0
+        while True:
+            close_old_connections()
+            processed, failed = process_pending_events(options['batch_size'])
+            total_processed += processed
+            total_failed += failed
+            if processed or failed:
+                self.stdout.write(f'{processed} events processed, {failed} failed')
+            elif not options['forever']:
+                break
+            else:
+                time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully processed {total_processed} events ({total_failed} failed attempts)'
+        ))
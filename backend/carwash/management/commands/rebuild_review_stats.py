@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from carwash.cache import fragment_cache
+from carwash.models import CarWash, CarWashReviewStats
+from utilities.versions import change_versions
+
+class Command(BaseCommand):
+    help = 'Rebuild the precomputed review statistics of every car wash'
+
+    def handle(self, *args, **kwargs):
+        car_washes_count = CarWashReviewStats.rebuild()
+        fragment_cache.invalidate_all()
+        change_versions.bump(CarWash)
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt review statistics for {car_washes_count} car washes'))
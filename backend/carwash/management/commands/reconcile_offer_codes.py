@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from carwash.models import Offer
+
+class Command(BaseCommand):
+    help = 'Recompute the total and available code counters of every offer from its codes'
+
+    def handle(self, *args, **kwargs):
+        offers_count = Offer.refresh_code_counts()
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully reconciled code counters of {offers_count} offers'))
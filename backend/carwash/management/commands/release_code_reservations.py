@@ -0,0 +1,81 @@
+import time
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from carwash.cache import process_local_caches
+from carwash.models import CarWashCode, Payment
+
+stripe.api_key = settings.STRIPE_SECRET_KEY
+
+class Command(BaseCommand):
+    help = 'Cancel the pending payments (and their payment intents) older than CODE_RESERVATION_TTL and release their expired code reservations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forever', action='store_true', help='Keep sweeping every --interval seconds')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds between sweeps with --forever')
+
+    def handle(self, *args, **options):
+        local_caches = process_local_caches()
+        if options['forever'] and local_caches:
+            # A separate worker process would only invalidate its own copy
+            raise CommandError(
+                f'The {", ".join(local_caches)} caches are local to each process; '
+                'set SEARCH_CACHE_BACKEND to a shared backend (e.g. database) before running --forever'
+            )
+        while True:
+            close_old_connections()
+            payments_count, codes_count = self.sweep()
+            if not options['forever']:
+                break
+            if payments_count or codes_count:
+                self.stdout.write(f'{payments_count} payments cancelled, {codes_count} codes released')
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully cancelled {payments_count} payments and released {codes_count} codes'
+        ))
+
+    def sweep(self):
+        now = timezone.now()
+        expired_payments = Payment.objects.filter(
+            status='pending',
+            created_at__lt=now - timedelta(seconds=settings.CODE_RESERVATION_TTL),
+        )
+        payments_count = 0
+        for payment in expired_payments.iterator():
+            if self.cancel_payment_intent(payment.payment_intent_id):
+                payments_count += Payment.objects.filter(pk=payment.pk, status='pending').update(
+                    status='cancelled', carwash_code=None, updated_at=now
+                )
+            else:
+                # The buyer may still complete the payment: keep its code
+                # reserved for the webhook, see CarWashCode.assign_reservation
+                CarWashCode.objects.filter(
+                    pk=payment.carwash_code_id, reserved_by=payment, reserved_until__isnull=False
+                ).update(reserved_until=now + timedelta(seconds=settings.CODE_RESERVATION_TTL), updated_at=now)
+        codes_count = CarWashCode.release_reservations(expired_before=now)
+        return payments_count, codes_count
+
+    def cancel_payment_intent(self, payment_intent_id):
+        """
+        Cancels a payment intent so its code can no longer be paid for.
+        Returns False when it cannot be cancelled (it succeeded or is being
+        processed) or Stripe could not be reached.
+        """
+        try:
+            stripe.PaymentIntent.cancel(payment_intent_id)
+            return True
+        except stripe.error.InvalidRequestError:
+            try:
+                return stripe.PaymentIntent.retrieve(payment_intent_id).status == 'canceled'
+            except stripe.error.StripeError as e:
+                print(f"Error retrieving payment intent {payment_intent_id}: {e}", flush=True)
+                return False
+        except stripe.error.StripeError as e:
+            print(f"Error cancelling payment intent {payment_intent_id}: {e}", flush=True)
+            return False
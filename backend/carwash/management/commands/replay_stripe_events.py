@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from carwash.models import StripeEvent
+
+class Command(BaseCommand):
+    help = 'Queue Stripe webhook events to be processed again'
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_ids', nargs='*', help='Stripe event ids (evt_...)')
+        parser.add_argument('--failed', action='store_true', help='Replay every event that ran out of attempts')
+
+    def handle(self, *args, **options):
+        if not options['event_ids'] and not options['failed']:
+            raise CommandError('Give event ids or --failed')
+
+        events = StripeEvent.objects.none()
+        if options['event_ids']:
+            events = StripeEvent.objects.filter(event_id__in=options['event_ids'])
+            missing = set(options['event_ids']) - set(events.values_list('event_id', flat=True))
+            if missing:
+                raise CommandError(f'Unknown events: {", ".join(sorted(missing))}')
+        if options['failed']:
+            events = events | StripeEvent.objects.filter(status='failed')
+
+        events_count = StripeEvent.replay(events)
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully queued {events_count} events'))
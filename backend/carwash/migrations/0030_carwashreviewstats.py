@@ -0,0 +1,92 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:37
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+DIMENSIONS = (
+    'overall',
+    'wash_quality',
+    'price_value',
+    'facility_cleanliness',
+    'customer_service',
+    'amenities_extra',
+)
+
+
+def populate_review_stats(apps, schema_editor):
+    """
+    Computes the statistics of the existing reviews, as
+    CarWashReviewStats.rebuild does.
+    """
+    CarWash = apps.get_model('carwash', 'CarWash')
+    CarWashReview = apps.get_model('carwash', 'CarWashReview')
+    CarWashReviewStats = apps.get_model('carwash', 'CarWashReviewStats')
+
+    aggregates = {'total_reviews': Count('id')}
+    for dimension in DIMENSIONS:
+        aggregates[f'{dimension}_sum'] = Sum(f'{dimension}_rating')
+        for rating in range(1, 6):
+            aggregates[f'{dimension}_{rating}'] = Count('id', filter=Q(**{f'{dimension}_rating': rating}))
+
+    stats = []
+    car_washes = []
+    for row in CarWashReview.objects.values('car_wash_id').annotate(**aggregates).order_by():
+        for dimension in DIMENSIONS:
+            stats.append(CarWashReviewStats(
+                car_wash_id=row['car_wash_id'],
+                dimension=dimension,
+                total_reviews=row['total_reviews'],
+                rating_sum=row[f'{dimension}_sum'] or 0,
+                **{f'rating_{rating}': row[f'{dimension}_{rating}'] for rating in range(1, 6)},
+            ))
+        average = (row['overall_sum'] or 0) / row['total_reviews']
+        car_washes.append(CarWash(
+            id=row['car_wash_id'],
+            reviews_count=row['total_reviews'],
+            reviews_average=Decimal(str(average)).quantize(Decimal('0.01')),
+        ))
+
+    CarWashReviewStats.objects.bulk_create(stats, batch_size=1000)
+    CarWash.objects.update(reviews_count=0, reviews_average=0)
+    CarWash.objects.bulk_update(car_washes, ['reviews_count', 'reviews_average'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carwash', '0029_carwashupdaterequest_is_bounty_claim_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CarWashReviewStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('status', models.CharField(choices=[('ACTIVE', 'Active'), ('INACTIVE', 'Inactive'), ('PENDING', 'Pending'), ('EXPIRED', 'Expired'), ('NOT_STARTED', 'Not Started'), ('CANCELLED', 'Cancelled'), ('APPROVAL', 'Approval'), ('REQUEST', 'Request'), ('REVIEW', 'Review'), ('VALIDATION', 'Validation'), ('CLOSURE', 'Closure'), ('COMPLETED', 'Completed')], default='ACTIVE', max_length=100)),
+                ('dimension', models.CharField(choices=[('overall', 'Overall'), ('wash_quality', 'Wash Quality'), ('price_value', 'Price Value'), ('facility_cleanliness', 'Facility Cleanliness'), ('customer_service', 'Customer Service'), ('amenities_extra', 'Amenities Extra')], max_length=30)),
+                ('total_reviews', models.IntegerField(default=0)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('rating_1', models.IntegerField(default=0)),
+                ('rating_2', models.IntegerField(default=0)),
+                ('rating_3', models.IntegerField(default=0)),
+                ('rating_4', models.IntegerField(default=0)),
+                ('rating_5', models.IntegerField(default=0)),
+                ('car_wash', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='review_stats', to='carwash.carwash')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='created_by_%(class)s', to=settings.AUTH_USER_MODEL)),
+                ('updated_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='updated_by_%(class)s', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Car Wash Review Stats',
+                'verbose_name_plural': 'Car Wash Review Stats',
+                'unique_together': {('car_wash', 'dimension')},
+            },
+        ),
+        migrations.RunPython(populate_review_stats, migrations.RunPython.noop),
+    ]
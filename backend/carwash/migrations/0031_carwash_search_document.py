@@ -0,0 +1,72 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:41
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import django.db.models.functions.text
+from django.conf import settings
+from django.contrib.postgres.operations import TrigramExtension
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations, models
+
+
+SEARCH_DOCUMENT_FIELDS = (
+    'car_wash_name',
+    'street',
+    'city',
+    'state',
+    'state_code',
+    'postal_code',
+    'country',
+    'country_code',
+    'formatted_address',
+)
+
+
+def populate_search_columns(apps, schema_editor):
+    CarWash = apps.get_model('carwash', 'CarWash')
+
+    car_washes = []
+    for car_wash in CarWash.objects.only(*SEARCH_DOCUMENT_FIELDS).iterator():
+        values = [getattr(car_wash, field) for field in SEARCH_DOCUMENT_FIELDS]
+        car_wash.search_document = " ".join(str(value) for value in values if value)
+        car_washes.append(car_wash)
+    CarWash.objects.bulk_update(car_washes, ['search_document'], batch_size=1000)
+
+    CarWash.objects.update(
+        search_vector=(
+            SearchVector('car_wash_name', weight='A', config='simple')
+            + SearchVector('city', 'state', 'state_code', 'postal_code', weight='B', config='simple')
+            + SearchVector('street', 'country', 'country_code', 'formatted_address', weight='C', config='simple')
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carwash', '0030_carwashreviewstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='carwash',
+            name='search_document',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='carwash',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='carwash',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='carwash_search_vector_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='carwash',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('search_document'), name='gin_trgm_ops'), name='carwash_search_document_trgm'),
+        ),
+        migrations.RunPython(populate_search_columns, migrations.RunPython.noop),
+    ]
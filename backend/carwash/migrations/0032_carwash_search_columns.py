@@ -0,0 +1,91 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:43
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import (
+    BooleanField,
+    Case,
+    DecimalField,
+    Exists,
+    Min,
+    OuterRef,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
+
+
+def populate_search_columns(apps, schema_editor):
+    CarWash = apps.get_model('carwash', 'CarWash')
+    CarWashPackage = apps.get_model('carwash', 'CarWashPackage')
+    Offer = apps.get_model('carwash', 'Offer')
+
+    packages = CarWashPackage.objects.filter(car_wash=OuterRef('pk')).order_by().values('car_wash')
+
+    def min_package_price(packages):
+        return Coalesce(
+            Subquery(packages.annotate(min_price=Min('price')).values('min_price')),
+            Value(0, output_field=DecimalField()),
+        )
+
+    CarWash.objects.update(
+        min_price=min_package_price(packages),
+        min_price_automatic=min_package_price(packages.filter(category='automatic')),
+        min_price_selfservice=min_package_price(packages.filter(category='selfservice')),
+        has_active_offer_or_bounty=Case(
+            When(active_bounty=True, then=Value(True)),
+            When(
+                Exists(
+                    Offer.objects.filter(
+                        package__car_wash=OuterRef('pk'),
+                        status='ACTIVE',
+                        offer_type__in=['ONE_TIME', 'TIME_DEPENDENT'],
+                    )
+                ),
+                then=Value(True),
+            ),
+            default=Value(False),
+            output_field=BooleanField(),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carwash', '0031_carwash_search_document'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carwash',
+            name='has_active_offer_or_bounty',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='carwash',
+            name='min_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='carwash',
+            name='min_price_automatic',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='carwash',
+            name='min_price_selfservice',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddIndex(
+            model_name='carwash',
+            index=models.Index(fields=['min_price', 'car_wash_name'], name='carwash_min_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='carwash',
+            index=models.Index(fields=['has_active_offer_or_bounty', 'reviews_average'], name='carwash_recommended_idx'),
+        ),
+        migrations.RunPython(populate_search_columns, migrations.RunPython.noop),
+    ]
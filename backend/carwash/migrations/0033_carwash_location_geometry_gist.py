@@ -0,0 +1,21 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:46
+
+import carwash.models
+import django.contrib.postgres.indexes
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carwash', '0032_carwash_search_columns'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='carwash',
+            index=django.contrib.postgres.indexes.GistIndex(carwash.models.AsGeometry('location'), name='carwash_location_geometry_gist'),
+        ),
+    ]
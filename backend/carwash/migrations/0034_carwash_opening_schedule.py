@@ -0,0 +1,60 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:51
+
+import carwash.models
+import django.contrib.postgres.indexes
+from django.conf import settings
+from django.db import migrations
+
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def populate_opening_schedule(apps, schema_editor):
+    CarWash = apps.get_model('carwash', 'CarWash')
+
+    car_washes = []
+    for car_wash in CarWash.objects.only('id', 'open_24_hours').prefetch_related('operating_hours'):
+        if car_wash.open_24_hours:
+            car_wash.opening_schedule = f"{{[0,{MINUTES_PER_WEEK})}}"
+            car_washes.append(car_wash)
+            continue
+
+        ranges = []
+        for hours in car_wash.operating_hours.all():
+            if hours.is_closed or not hours.opening_time or not hours.closing_time:
+                continue
+            start = hours.day_of_week * MINUTES_PER_DAY + hours.opening_time.hour * 60 + hours.opening_time.minute
+            end = hours.day_of_week * MINUTES_PER_DAY + hours.closing_time.hour * 60 + hours.closing_time.minute
+            if end <= start:
+                end += MINUTES_PER_DAY
+            if end > MINUTES_PER_WEEK:
+                ranges.append((0, end - MINUTES_PER_WEEK))
+                end = MINUTES_PER_WEEK
+            ranges.append((start, end))
+
+        car_wash.opening_schedule = "{" + ",".join(f"[{start},{end})" for start, end in sorted(ranges)) + "}"
+        car_washes.append(car_wash)
+
+    CarWash.objects.bulk_update(car_washes, ['opening_schedule'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carwash', '0033_carwash_location_geometry_gist'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carwash',
+            name='opening_schedule',
+            field=carwash.models.IntegerMultiRangeField(default='{}', editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='carwash',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['opening_schedule'], name='carwash_opening_schedule_gist'),
+        ),
+        migrations.RunPython(populate_opening_schedule, migrations.RunPython.noop),
+    ]
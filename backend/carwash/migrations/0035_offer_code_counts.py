@@ -0,0 +1,47 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:04
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_code_counts(apps, schema_editor):
+    Offer = apps.get_model('carwash', 'Offer')
+    CarWashCode = apps.get_model('carwash', 'CarWashCode')
+
+    codes = CarWashCode.objects.filter(offer=OuterRef('pk')).order_by().values('offer')
+
+    def count_codes(codes):
+        return Coalesce(Subquery(codes.annotate(count=Count('id')).values('count')), 0)
+
+    Offer.objects.update(
+        total_codes=count_codes(codes),
+        available_codes=count_codes(codes.filter(user__isnull=True)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carwash', '0034_carwash_opening_schedule'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='offer',
+            name='available_codes',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='offer',
+            name='total_codes',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(condition=models.Q(('available_codes__gt', 0)), fields=['offer_type'], name='offer_available_type_idx'),
+        ),
+        migrations.RunPython(populate_code_counts, migrations.RunPython.noop),
+    ]
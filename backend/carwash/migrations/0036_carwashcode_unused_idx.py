@@ -0,0 +1,19 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carwash', '0035_offer_code_counts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='carwashcode',
+            index=models.Index(condition=models.Q(('user__isnull', True)), fields=['offer', 'id'], name='carwashcode_unused_idx'),
+        ),
+    ]
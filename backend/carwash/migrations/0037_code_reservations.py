@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carwash', '0036_carwashcode_unused_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='carwashcode',
+            name='carwashcode_unused_idx',
+        ),
+        migrations.AddField(
+            model_name='carwashcode',
+            name='reserved_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed'), ('refunded', 'Refunded'), ('cancelled', 'Cancelled')], default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='carwashcode',
+            index=models.Index(condition=models.Q(('reserved_until__isnull', True), ('user__isnull', True)), fields=['offer', 'id'], name='carwashcode_available_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='carwashcode',
+            index=models.Index(condition=models.Q(('reserved_until__isnull', False)), fields=['reserved_until'], name='carwashcode_reserved_idx'),
+        ),
+    ]
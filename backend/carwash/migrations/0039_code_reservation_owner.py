@@ -0,0 +1,19 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carwash', '0038_stripe_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carwashcode',
+            name='reserved_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='carwash.payment'),
+        ),
+    ]
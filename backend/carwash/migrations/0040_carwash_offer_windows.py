@@ -0,0 +1,84 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:24
+
+import carwash.models
+from django.db import migrations
+from django.db.models import (
+    BooleanField,
+    Case,
+    Exists,
+    F,
+    Func,
+    IntegerField,
+    OuterRef,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast, Coalesce, ExtractHour, ExtractMinute
+
+
+def populate_offer_windows(apps, schema_editor):
+    CarWash = apps.get_model('carwash', 'CarWash')
+    Offer = apps.get_model('carwash', 'Offer')
+
+    def minutes(field):
+        return Cast(ExtractHour(field) * 60 + ExtractMinute(field), IntegerField())
+
+    CarWash.objects.update(
+        has_active_offer_or_bounty=Case(
+            When(active_bounty=True, then=Value(True)),
+            When(
+                Exists(
+                    Offer.objects.filter(
+                        package__car_wash=OuterRef('pk'),
+                        status='ACTIVE',
+                        offer_type='ONE_TIME',
+                    )
+                ),
+                then=Value(True),
+            ),
+            default=Value(False),
+            output_field=BooleanField(),
+        ),
+        offer_windows=Coalesce(
+            Subquery(
+                Offer.objects.filter(
+                    package__car_wash=OuterRef('pk'),
+                    status='ACTIVE',
+                    offer_type='TIME_DEPENDENT',
+                    start_time__lte=F('end_time'),
+                )
+                .order_by()
+                .values('package__car_wash')
+                .annotate(
+                    windows=Func(
+                        Func(minutes('start_time'), minutes('end_time') + 1, function='int4range'),
+                        function='range_agg',
+                        output_field=carwash.models.IntegerMultiRangeField(),
+                    )
+                )
+                .values('windows')
+            ),
+            Func(function='int4multirange', output_field=carwash.models.IntegerMultiRangeField()),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carwash', '0039_code_reservation_owner'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='carwash',
+            name='carwash_recommended_idx',
+        ),
+        migrations.AddField(
+            model_name='carwash',
+            name='offer_windows',
+            field=carwash.models.IntegerMultiRangeField(default='{}', editable=False),
+        ),
+        migrations.RunPython(populate_offer_windows, migrations.RunPython.noop),
+    ]
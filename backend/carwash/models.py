@@ -1,13 +1,41 @@
-from django.db import models
+from decimal import Decimal
+from django.db import connection, models, transaction
+from django.db.models import (
+    Count,
+    Sum,
+    Min,
+    Avg,
+    Q,
+    F,
+    Func,
+    Lookup,
+    Value,
+    FloatField,
+    DecimalField,
+    BooleanField,
+    Case,
+    When,
+    Exists,
+    OuterRef,
+    Subquery,
+    ExpressionWrapper,
+    IntegerField,
+)
+from django.db.models.functions import Cast, Coalesce, ExtractHour, ExtractMinute
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.gis.db import models as gis_models
-from django.contrib.gis.geos import Point
+from django.contrib.gis.geos import Point, Polygon
 from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.measure import D
+from django.contrib.postgres.indexes import GinIndex, GistIndex, OpClass
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db.models.functions import Upper
 from django.contrib.auth.models import User
 
 from utilities.constants import IMAGE_TYPE_CHOICES
 from .managers import ActiveManager
 from utilities.mixins import CustomModelMixin
+from utilities.versions import change_versions
 from phonenumber_field.modelfields import PhoneNumberField
 from django.core.exceptions import ValidationError
 from django.utils import timezone
@@ -15,6 +43,79 @@ from django.conf import settings
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
 
+class KNNDistance(Func):
+    """
+    Distance between a geography column and a point using the PostGIS <->
+    operator. Ordering by it lets PostgreSQL walk the GiST index on the
+    column (nearest neighbour search) instead of sorting the whole table.
+    """
+    arg_joiner = " <-> "
+    template = "(%(expressions)s)"
+    output_field = FloatField()
+
+    def __init__(self, expression, point, **extra):
+        point = Value(point, output_field=gis_models.PointField(geography=True, srid=4326))
+        super().__init__(expression, point, **extra)
+
+
+class AsGeometry(Func):
+    """
+    Casts the geography location column to geometry, so planar operators
+    (bounding box overlap, grid snapping, tile envelopes) can be applied and
+    answered from the expression index on it.
+    """
+    template = "(%(expressions)s)::geometry"
+    output_field = gis_models.PointField(srid=4326)
+
+
+class SnapToGrid(Func):
+    function = "ST_SnapToGrid"
+    output_field = gis_models.PointField(srid=4326)
+
+
+class IntegerMultiRangeField(models.Field):
+    """
+    PostgreSQL int4multirange column, read and written in its text form,
+    e.g. '{[0,1440),[2880,4320)}'.
+    """
+    description = "Integer multirange"
+
+    def db_type(self, connection):
+        return "int4multirange"
+
+
+@IntegerMultiRangeField.register_lookup
+class MultiRangeContains(Lookup):
+    """
+    multirange @> integer, answered from a GiST index on the column.
+    """
+    lookup_name = "contains"
+
+    def get_prep_lookup(self):
+        return int(self.rhs)
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} @> ({rhs})::int4", lhs_params + rhs_params
+
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def minute_of_day(value):
+    return value.hour * 60 + value.minute
+
+
+def minute_of_week(value):
+    """
+    Minute of the week of a datetime, counted from Monday 00:00 like
+    CarWashOperatingHours.day_of_week.
+    """
+    return value.weekday() * MINUTES_PER_DAY + value.hour * 60 + value.minute
+
+
 class CarWash(CustomModelMixin):
     car_wash_name = models.CharField(max_length=255, db_index=True)
     street = models.CharField(max_length=255, null=True, blank=True)
@@ -43,6 +144,24 @@ class CarWash(CustomModelMixin):
 
     active_bounty = models.BooleanField(default=False, verbose_name="Active Bounty")
 
+    # Maintained from packages, offers and the bounty, used to sort and filter searches
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    min_price_automatic = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    min_price_selfservice = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    # Active bounty or ONE_TIME offer; TIME_DEPENDENT offers only count within
+    # offer_windows, see has_offer_now
+    has_active_offer_or_bounty = models.BooleanField(default=False, editable=False)
+    # Minutes of the day the active TIME_DEPENDENT offers run
+    offer_windows = IntegerMultiRangeField(default="{}", editable=False)
+
+    # Minutes of the week the car wash is open, maintained from open_24_hours
+    # and operating_hours, used by the openNow/openAt filters
+    opening_schedule = IntegerMultiRangeField(default="{}", editable=False)
+
+    # Maintained on save, used by the full-text and trigram location search
+    search_document = models.TextField(null=True, blank=True, editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+
     amenities = models.ManyToManyField(
         'Amenity', 
         through='AmenityCarWashMapping',
@@ -64,31 +183,288 @@ class CarWash(CustomModelMixin):
             return self.location.x
         return None
         
+    SEARCH_DOCUMENT_FIELDS = (
+        'car_wash_name',
+        'street',
+        'city',
+        'state',
+        'state_code',
+        'postal_code',
+        'country',
+        'country_code',
+        'formatted_address',
+    )
+
     def save(self, *args, **kwargs):
+        self.search_document = self.build_search_document()
+        self.opening_schedule = self.build_opening_schedule(
+            self.open_24_hours, self.operating_hours.all() if self.pk else []
+        )
         super().save(*args, **kwargs)
+        CarWash.objects.filter(pk=self.pk).update(search_vector=CarWash.search_vector_expression())
+        CarWash.refresh_search_columns([self.pk])
+
+    @classmethod
+    def refresh_search_columns(cls, car_wash_ids=None):
+        """
+        Recompute the minimum package prices, the active offer/bounty flag
+        and the offer windows of the given car washes (all of them when
+        car_wash_ids is None).
+        """
+        queryset = cls.objects.all()
+        if car_wash_ids is not None:
+            queryset = queryset.filter(id__in=car_wash_ids)
+
+        packages = CarWashPackage.objects.filter(car_wash=OuterRef("pk")).order_by().values("car_wash")
+
+        def min_package_price(packages):
+            return Coalesce(
+                Subquery(packages.annotate(min_price=Min("price")).values("min_price")),
+                Value(0, output_field=DecimalField()),
+            )
+
+        return queryset.update(
+            min_price=min_package_price(packages),
+            min_price_automatic=min_package_price(packages.filter(category="automatic")),
+            min_price_selfservice=min_package_price(packages.filter(category="selfservice")),
+            has_active_offer_or_bounty=Case(
+                When(active_bounty=True, then=Value(True)),
+                When(
+                    Exists(
+                        Offer.objects.filter(
+                            package__car_wash=OuterRef("pk"),
+                            status="ACTIVE",
+                            offer_type="ONE_TIME",
+                        )
+                    ),
+                    then=Value(True),
+                ),
+                default=Value(False),
+                output_field=BooleanField(),
+            ),
+            offer_windows=Coalesce(
+                Subquery(
+                    Offer.objects.filter(
+                        package__car_wash=OuterRef("pk"),
+                        status="ACTIVE",
+                        offer_type="TIME_DEPENDENT",
+                        # Like the former ranking, windows never wrap past midnight
+                        start_time__lte=F("end_time"),
+                    )
+                    .order_by()
+                    .values("package__car_wash")
+                    .annotate(
+                        windows=Func(
+                            Func(
+                                Cast(ExtractHour("start_time") * 60 + ExtractMinute("start_time"), IntegerField()),
+                                Cast(ExtractHour("end_time") * 60 + ExtractMinute("end_time") + 1, IntegerField()),
+                                function="int4range",
+                            ),
+                            function="range_agg",
+                            output_field=IntegerMultiRangeField(),
+                        )
+                    )
+                    .values("windows")
+                ),
+                Func(function="int4multirange", output_field=IntegerMultiRangeField()),
+            ),
+        )
+
+    @staticmethod
+    def has_offer_now(now=None):
+        """
+        Whether a car wash has an active bounty, ONE_TIME offer or a
+        TIME_DEPENDENT offer running at the time of day of now.
+        """
+        now = now or timezone.now()
+        return ExpressionWrapper(
+            Q(has_active_offer_or_bounty=True) | Q(offer_windows__contains=minute_of_day(now)),
+            output_field=BooleanField(),
+        )
+
+    @staticmethod
+    def build_opening_schedule(open_24_hours, operating_hours):
+        """
+        Opening schedule multirange of a car wash. Hours closing at or
+        before their opening time run past midnight into the next day.
+        """
+        if open_24_hours:
+            return f"{{[0,{MINUTES_PER_WEEK})}}"
+
+        ranges = []
+        for hours in operating_hours:
+            if hours.is_closed or not hours.opening_time or not hours.closing_time:
+                continue
+            start = hours.day_of_week * MINUTES_PER_DAY + hours.opening_time.hour * 60 + hours.opening_time.minute
+            end = hours.day_of_week * MINUTES_PER_DAY + hours.closing_time.hour * 60 + hours.closing_time.minute
+            if end <= start:
+                end += MINUTES_PER_DAY
+            # Sunday night wraps around to Monday morning
+            if end > MINUTES_PER_WEEK:
+                ranges.append((0, end - MINUTES_PER_WEEK))
+                end = MINUTES_PER_WEEK
+            ranges.append((start, end))
+
+        return "{" + ",".join(f"[{start},{end})" for start, end in sorted(ranges)) + "}"
+
+    @classmethod
+    def refresh_opening_schedules(cls, car_wash_ids=None):
+        """
+        Rebuild the opening schedule of the given car washes (all of them when
+        car_wash_ids is None) from their operating hours.
+        """
+        queryset = cls.objects.only("id", "open_24_hours").prefetch_related("operating_hours")
+        if car_wash_ids is not None:
+            queryset = queryset.filter(id__in=car_wash_ids)
+
+        car_washes = list(queryset)
+        for car_wash in car_washes:
+            car_wash.opening_schedule = cls.build_opening_schedule(
+                car_wash.open_24_hours, car_wash.operating_hours.all()
+            )
+        cls.objects.bulk_update(car_washes, ["opening_schedule"], batch_size=1000)
+
+    def build_search_document(self):
+        values = [getattr(self, field) for field in self.SEARCH_DOCUMENT_FIELDS]
+        return " ".join(str(value) for value in values if value)
+
+    @staticmethod
+    def search_vector_expression():
+        """
+        Weighted tsvector of the searchable columns: name first, then the
+        locality, then the remaining address parts.
+        """
+        return (
+            SearchVector('car_wash_name', weight='A', config='simple')
+            + SearchVector('city', 'state', 'state_code', 'postal_code', weight='B', config='simple')
+            + SearchVector('street', 'country', 'country_code', 'formatted_address', weight='C', config='simple')
+        )
         
     @classmethod
-    def get_nearest(cls, lat, lng, distance_km=None):
+    def get_nearest(cls, lat, lng, distance_miles=None, queryset=None, with_distance=True):
         """
         Find car washes nearest to a point.
-        Optional distance_km parameter to limit results within a radius.
+        Annotates distance (in miles, unless with_distance is False) and
+        knn_distance, and orders by the latter so the spatial index on
+        location is used.
+        Optional distance_miles parameter to limit results within a radius.
         """
         user_location = Point(float(lng), float(lat), srid=4326)
-        queryset = cls.objects.all()
-        
-        # Annotate with distance
-        queryset = queryset.annotate(
-            distance=Distance('location', user_location)
-        ).order_by('distance')
-        
-        # Filter by distance if specified
-        if distance_km:
+        if queryset is None:
+            queryset = cls.objects.all()
+
+        # ST_DWithin prefilter, answered from the spatial index
+        if distance_miles:
             queryset = queryset.filter(
-                distance__lte=distance_km * 1000  # Convert km to meters
+                location__dwithin=(user_location, D(mi=float(distance_miles)))
             )
-            
-        return queryset
-    
+
+        if with_distance:
+            queryset = queryset.annotate(
+                distance=Coalesce(
+                    Distance("location", user_location, output_field=FloatField())
+                    * Value(0.000621371, output_field=FloatField()),
+                    Value(0, output_field=FloatField()),
+                ),
+            )
+        queryset = queryset.annotate(knn_distance=KNNDistance("location", user_location))
+
+        return queryset.order_by("knn_distance", "id")
+
+    @classmethod
+    def filter_bbox(cls, queryset, min_lng, min_lat, max_lng, max_lat):
+        """
+        Car washes inside a longitude/latitude bounding box, answered from the
+        geometry index on location. Boxes crossing the antimeridian
+        (min_lng > max_lng) are split in two.
+        """
+        if min_lng > max_lng:
+            boxes = [(min_lng, min_lat, 180, max_lat), (-180, min_lat, max_lng, max_lat)]
+        else:
+            boxes = [(min_lng, min_lat, max_lng, max_lat)]
+
+        condition = Q()
+        for box in boxes:
+            envelope = Polygon.from_bbox(box)
+            envelope.srid = 4326
+            condition |= Q(location_geometry__bboverlaps=envelope)
+        return queryset.alias(location_geometry=AsGeometry("location")).filter(condition)
+
+    @classmethod
+    def get_map_points(cls, queryset):
+        """
+        Minimal per car wash rows for drawing map markers.
+        """
+        geometry = AsGeometry("location")
+        return queryset.annotate(
+            latitude=Func(geometry, function="ST_Y", output_field=FloatField()),
+            longitude=Func(geometry, function="ST_X", output_field=FloatField()),
+            has_offer=cls.has_offer_now(),
+        ).values(
+            "id",
+            "car_wash_name",
+            "latitude",
+            "longitude",
+            "verified",
+            "active_bounty",
+            "has_offer",
+            "min_price",
+        )
+
+    VECTOR_TILE_LAYER = "carwashes"
+
+    @classmethod
+    def get_vector_tile(cls, z, x, y):
+        """
+        Mapbox vector tile (ST_AsMVT) of the active car washes inside tile
+        z/x/y, with the attributes needed to style and label the markers.
+        """
+        sql = f"""
+            WITH bounds AS (
+                SELECT ST_TileEnvelope(%s, %s, %s) AS geom
+            ),
+            features AS (
+                SELECT
+                    ST_AsMVTGeom(ST_Transform(car_wash.location::geometry, 3857), bounds.geom) AS geom,
+                    car_wash.id,
+                    car_wash.car_wash_name AS name,
+                    car_wash.verified,
+                    car_wash.active_bounty,
+                    car_wash.has_active_offer_or_bounty OR car_wash.offer_windows @> %s::int4 AS has_offer,
+                    car_wash.min_price::float8 AS min_price
+                FROM {cls._meta.db_table} AS car_wash, bounds
+                WHERE car_wash.status = 'ACTIVE'
+                    AND (car_wash.location)::geometry && ST_Transform(bounds.geom, 4326)
+            )
+            SELECT ST_AsMVT(features.*, %s) FROM features
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [z, x, y, minute_of_day(timezone.now()), cls.VECTOR_TILE_LAYER])
+            tile = cursor.fetchone()[0]
+        return bytes(tile) if tile else b""
+
+    @classmethod
+    def get_map_clusters(cls, queryset, grid_size):
+        """
+        Groups car washes into clusters of a grid of grid_size degrees with
+        ST_SnapToGrid, in one aggregate query. Returns the cells with the
+        count and mean position of their car washes, and the car wash id of
+        single car wash cells.
+        """
+        geometry = AsGeometry("location")
+        return (
+            queryset.annotate(cell=SnapToGrid(geometry, Value(grid_size)))
+            .values("cell")
+            .annotate(
+                count=Count("id"),
+                latitude=Avg(Func(geometry, function="ST_Y", output_field=FloatField())),
+                longitude=Avg(Func(geometry, function="ST_X", output_field=FloatField())),
+                car_wash_id=Case(When(count=1, then=Min("id")), default=None),
+            )
+            .values("count", "latitude", "longitude", "car_wash_id")
+            .order_by()
+        )
+
     objects = models.Manager()
     active_objects = ActiveManager()
 
@@ -96,6 +472,11 @@ class CarWash(CustomModelMixin):
         indexes = [
             models.Index(fields=['automatic_car_wash', 'self_service_car_wash']),
             models.Index(fields=['open_24_hours']),
+            models.Index(fields=['min_price', 'car_wash_name'], name='carwash_min_price_idx'),
+            GinIndex(fields=['search_vector'], name='carwash_search_vector_gin'),
+            GinIndex(OpClass(Upper('search_document'), name='gin_trgm_ops'), name='carwash_search_document_trgm'),
+            GistIndex(AsGeometry('location'), name='carwash_location_geometry_gist'),
+            GistIndex(fields=['opening_schedule'], name='carwash_opening_schedule_gist'),
         ]
         verbose_name = "Car Wash"
         verbose_name_plural = "Car Washes"
@@ -259,11 +640,23 @@ class Offer(CustomModelMixin):
     
     # Geographical fields
     radius_miles = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+
+    # Maintained from codes, see update_code_counts; available codes are
+    # the ones neither assigned to a user nor reserved
+    total_codes = models.IntegerField(default=0, editable=False)
+    available_codes = models.IntegerField(default=0, editable=False)
     
     objects = models.Manager()
     active_objects = ActiveManager()
     
     class Meta:
+        indexes = [
+            models.Index(
+                fields=['offer_type'],
+                condition=models.Q(available_codes__gt=0),
+                name='offer_available_type_idx',
+            ),
+        ]
         constraints = [
             models.CheckConstraint(
                 check=(
@@ -290,12 +683,48 @@ class Offer(CustomModelMixin):
         self.full_clean()
         super().save(*args, **kwargs)
 
+    @classmethod
+    def update_code_counts(cls, offer_id, total=0, available=0):
+        """
+        Moves the code counters of an offer by the given amounts, in a
+        single UPDATE so concurrent changes cannot overwrite each other.
+        """
+        if total or available:
+            cls.objects.filter(pk=offer_id).update(
+                total_codes=F("total_codes") + total,
+                available_codes=F("available_codes") + available,
+            )
+            transaction.on_commit(lambda: change_versions.bump(cls))
+
+    @classmethod
+    def refresh_code_counts(cls, offer_ids=None):
+        """
+        Recompute the code counters of the given offers (all of them when
+        offer_ids is None) from their codes. Returns the number of offers.
+        """
+        queryset = cls.objects.all()
+        if offer_ids is not None:
+            queryset = queryset.filter(id__in=offer_ids)
+
+        codes = CarWashCode.objects.filter(offer=OuterRef("pk")).order_by().values("offer")
+
+        def count_codes(codes):
+            return Coalesce(Subquery(codes.annotate(count=Count("id")).values("count")), 0)
+
+        return queryset.update(
+            total_codes=count_codes(codes),
+            available_codes=count_codes(codes.filter(user__isnull=True, reserved_until__isnull=True)),
+        )
+
 
 class CarWashCode(CustomModelMixin):
     offer = models.ForeignKey(Offer, on_delete=models.CASCADE, related_name="codes")
     code = models.CharField(max_length=50)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="carwash_codes")
     used_at = models.DateTimeField(null=True, blank=True)
+    # Set while the code is held for a pending payment, see reserve
+    reserved_until = models.DateTimeField(null=True, blank=True)
+    reserved_by = models.ForeignKey('Payment', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
     
     objects = models.Manager()
     active_objects = ActiveManager()
@@ -308,10 +737,127 @@ class CarWashCode(CustomModelMixin):
                 name='unique_code_per_offer'
             )
         ]
+        indexes = [
+            # Available codes of an offer in allocation order, see allocate
+            models.Index(
+                fields=['offer', 'id'],
+                condition=models.Q(user__isnull=True, reserved_until__isnull=True),
+                name='carwashcode_available_idx',
+            ),
+            models.Index(
+                fields=['reserved_until'],
+                condition=models.Q(reserved_until__isnull=False),
+                name='carwashcode_reserved_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.code} - {self.offer.name}"
 
+    @classmethod
+    def _claim(cls, offer_id, assignments, params, code=None):
+        """
+        Applies the SQL assignments to an available code of an offer (the
+        given code, when code is set) and returns it, or None when there is
+        none left.
+
+        The code is picked and updated in a single UPDATE whose subquery
+        locks it with FOR UPDATE SKIP LOCKED, so concurrent claims neither
+        wait on each other nor get the same code.
+        """
+        params = [*params, timezone.now(), offer_id]
+        code_condition = ""
+        if code is not None:
+            code_condition = "AND code = %s"
+            params.append(code)
+
+        sql = f"""
+            UPDATE {cls._meta.db_table}
+            SET {assignments}, updated_at = %s
+            WHERE id = (
+                SELECT id FROM {cls._meta.db_table}
+                WHERE offer_id = %s AND user_id IS NULL AND reserved_until IS NULL {code_condition}
+                ORDER BY id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+        """
+        with transaction.atomic():
+            claimed = list(cls.objects.raw(sql, params))
+            if not claimed:
+                return None
+            Offer.update_code_counts(offer_id, available=-1)
+        return claimed[0]
+
+    @classmethod
+    def allocate(cls, offer_id, user, used_at=None, code=None):
+        """
+        Assigns an available code of an offer to a user, see _claim.
+        """
+        return cls._claim(offer_id, "user_id = %s, used_at = %s", [user.pk, used_at or timezone.now()], code)
+
+    @classmethod
+    def reserve(cls, offer_id, reserved_until):
+        """
+        Holds an available code of an offer for a pending payment until
+        reserved_until, see _claim and release_reservations.
+        """
+        return cls._claim(offer_id, "reserved_until = %s", [reserved_until])
+
+    @classmethod
+    def assign_reservation(cls, payment, used_at=None):
+        """
+        Assigns the code reserved for a payment to the user who paid for
+        it. Returns None when the reservation was released in the meantime,
+        even if the code was reserved again for another payment since.
+        """
+        if payment.carwash_code_id is None:
+            return None
+        assigned = cls.objects.filter(
+            pk=payment.carwash_code_id, reserved_by=payment, user__isnull=True, reserved_until__isnull=False
+        ).update(
+            user=payment.user,
+            used_at=used_at or timezone.now(),
+            reserved_until=None,
+            reserved_by=None,
+            updated_at=timezone.now(),
+        )
+        return cls.objects.get(pk=payment.carwash_code_id) if assigned else None
+
+    @classmethod
+    def release_reservations(cls, code_ids=None, expired_before=None):
+        """
+        Makes reserved codes available again: the given ones, or the ones
+        whose reservation ended before expired_before. Returns the number of
+        released codes.
+        """
+        conditions = ["user_id IS NULL", "reserved_until IS NOT NULL"]
+        params = [timezone.now()]
+        if code_ids is not None:
+            conditions.append("id = ANY(%s)")
+            params.append(list(code_ids))
+        if expired_before is not None:
+            conditions.append("reserved_until < %s")
+            params.append(expired_before)
+
+        sql = f"""
+            WITH released AS (
+                UPDATE {cls._meta.db_table}
+                SET reserved_until = NULL, reserved_by_id = NULL, updated_at = %s
+                WHERE {" AND ".join(conditions)}
+                RETURNING offer_id
+            )
+            SELECT offer_id, COUNT(*) FROM released GROUP BY offer_id
+        """
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                released = cursor.fetchall()
+            for offer_id, count in released:
+                Offer.update_code_counts(offer_id, available=count)
+        return sum(count for _, count in released)
+
 class CarWashReview(CustomModelMixin):
     """
         CarWash Review Model
@@ -350,6 +896,127 @@ class CarWashReview(CustomModelMixin):
     def __str__(self):
         return f"{self.car_wash.car_wash_name}"
 
+class CarWashReviewStats(CustomModelMixin):
+    """
+        Precomputed review statistics of a car wash for one rating dimension.
+        Updated incrementally whenever a review is created, updated or deleted
+        and rebuilt in bulk by the rebuild_review_stats management command.
+    """
+    DIMENSION_CHOICES = [
+        ('overall', 'Overall'),
+        ('wash_quality', 'Wash Quality'),
+        ('price_value', 'Price Value'),
+        ('facility_cleanliness', 'Facility Cleanliness'),
+        ('customer_service', 'Customer Service'),
+        ('amenities_extra', 'Amenities Extra'),
+    ]
+
+    car_wash = models.ForeignKey(CarWash, on_delete=models.CASCADE, related_name="review_stats")
+    dimension = models.CharField(max_length=30, choices=DIMENSION_CHOICES)
+    total_reviews = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    rating_1 = models.IntegerField(default=0)
+    rating_2 = models.IntegerField(default=0)
+    rating_3 = models.IntegerField(default=0)
+    rating_4 = models.IntegerField(default=0)
+    rating_5 = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('car_wash', 'dimension')
+        verbose_name = "Car Wash Review Stats"
+        verbose_name_plural = "Car Wash Review Stats"
+
+    def __str__(self):
+        return f"{self.car_wash.car_wash_name} - {self.dimension}"
+
+    @property
+    def average_rating(self):
+        if not self.total_reviews:
+            return None
+        return self.rating_sum / self.total_reviews
+
+    @classmethod
+    def add_review(cls, review):
+        cls._apply_review(review, 1)
+
+    @classmethod
+    def remove_review(cls, review):
+        cls._apply_review(review, -1)
+
+    @classmethod
+    def _apply_review(cls, review, sign):
+        with transaction.atomic():
+            cls.objects.bulk_create(
+                [cls(car_wash_id=review.car_wash_id, dimension=dimension) for dimension, _ in cls.DIMENSION_CHOICES],
+                ignore_conflicts=True,
+            )
+            for dimension, _ in cls.DIMENSION_CHOICES:
+                rating = getattr(review, f"{dimension}_rating")
+                changes = {
+                    "total_reviews": F("total_reviews") + sign,
+                    "rating_sum": F("rating_sum") + sign * rating,
+                    "updated_at": timezone.now(),
+                }
+                if 1 <= rating <= 5:
+                    changes[f"rating_{rating}"] = F(f"rating_{rating}") + sign
+                cls.objects.filter(car_wash_id=review.car_wash_id, dimension=dimension).update(**changes)
+
+            overall = cls.objects.get(car_wash_id=review.car_wash_id, dimension="overall")
+            CarWash.objects.filter(id=review.car_wash_id).update(
+                reviews_count=overall.total_reviews,
+                reviews_average=cls._round_average(overall.average_rating),
+            )
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Recompute the statistics of every car wash from its reviews.
+        Returns the number of car washes that have reviews.
+        """
+        aggregates = {"total_reviews": Count("id")}
+        for dimension, _ in cls.DIMENSION_CHOICES:
+            aggregates[f"{dimension}_sum"] = Sum(f"{dimension}_rating")
+            for rating in range(1, 6):
+                aggregates[f"{dimension}_{rating}"] = Count("id", filter=Q(**{f"{dimension}_rating": rating}))
+
+        with transaction.atomic():
+            rows = CarWashReview.objects.values("car_wash_id").annotate(**aggregates).order_by()
+            stats, car_washes = cls._build_rows(rows)
+
+            cls.objects.all().delete()
+            cls.objects.bulk_create(stats, batch_size=1000)
+            CarWash.objects.update(reviews_count=0, reviews_average=0)
+            CarWash.objects.bulk_update(car_washes, ["reviews_count", "reviews_average"], batch_size=1000)
+
+        return len(car_washes)
+
+    @classmethod
+    def _build_rows(cls, rows):
+        stats = []
+        car_washes = []
+        for row in rows:
+            for dimension, _ in cls.DIMENSION_CHOICES:
+                stats.append(cls(
+                    car_wash_id=row["car_wash_id"],
+                    dimension=dimension,
+                    total_reviews=row["total_reviews"],
+                    rating_sum=row[f"{dimension}_sum"] or 0,
+                    **{f"rating_{rating}": row[f"{dimension}_{rating}"] for rating in range(1, 6)},
+                ))
+            car_washes.append(CarWash(
+                id=row["car_wash_id"],
+                reviews_count=row["total_reviews"],
+                reviews_average=cls._round_average((row["overall_sum"] or 0) / row["total_reviews"]),
+            ))
+        return stats, car_washes
+
+    @staticmethod
+    def _round_average(average):
+        if average is None:
+            return Decimal("0")
+        return Decimal(str(average)).quantize(Decimal("0.01"))
+
+
 class CarWashReviewImage(CustomModelMixin):
     carwash_review = models.ForeignKey(CarWashReview, on_delete=models.CASCADE, related_name="images")
     image_url = models.URLField(max_length=500)
@@ -362,7 +1029,8 @@ class Payment(CustomModelMixin):
         ('pending', 'Pending'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
-        ('refunded', 'Refunded')
+        ('refunded', 'Refunded'),
+        ('cancelled', 'Cancelled')
     ]
 
     offer = models.ForeignKey('Offer', on_delete=models.CASCADE, related_name='payments')
@@ -386,7 +1054,93 @@ class Payment(CustomModelMixin):
 
     def __str__(self):
         return f"Payment {self.payment_intent_id} - {self.offer.name}"
-    
+
+
+class StripeEvent(CustomModelMixin):
+    """
+    Inbox of the verified Stripe webhook events, processed outside the
+    request by the process_stripe_events command. Stripe retries deliver
+    the same event id, which is recorded only once.
+    """
+    EVENT_STATUS = [
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=EVENT_STATUS, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['next_attempt_at'],
+                condition=models.Q(status='pending'),
+                name='stripeevent_pending_idx',
+            ),
+        ]
+
+    @classmethod
+    def record(cls, event):
+        """
+        Stores a Stripe event (as a dict) unless it was already received.
+        Returns True when it is new.
+        """
+        _, created = cls.objects.get_or_create(
+            event_id=event['id'],
+            defaults={'event_type': event['type'], 'payload': event},
+        )
+        return created
+
+    @classmethod
+    def due(cls):
+        return cls.objects.filter(status='pending', next_attempt_at__lte=timezone.now()).order_by('next_attempt_at', 'id')
+
+    def mark_processed(self):
+        self.status = 'processed'
+        self.attempts += 1
+        self.processed_at = timezone.now()
+        self.last_error = None
+        self.save(update_fields=['status', 'attempts', 'processed_at', 'last_error', 'updated_at'])
+
+    def mark_failed(self, error):
+        """
+        Schedules another attempt with an exponential backoff, or gives up
+        after STRIPE_EVENT_MAX_ATTEMPTS attempts.
+        """
+        self.attempts += 1
+        self.last_error = error
+        if self.attempts >= settings.STRIPE_EVENT_MAX_ATTEMPTS:
+            self.status = 'failed'
+        else:
+            delay = settings.STRIPE_EVENT_RETRY_DELAY * 2 ** (self.attempts - 1)
+            self.next_attempt_at = timezone.now() + timezone.timedelta(seconds=delay)
+        self.save(update_fields=['status', 'attempts', 'next_attempt_at', 'last_error', 'updated_at'])
+
+    @classmethod
+    def replay(cls, queryset):
+        """
+        Queues events to be processed again from a first attempt. Returns
+        the number of queued events.
+        """
+        return queryset.update(
+            status='pending',
+            attempts=0,
+            next_attempt_at=timezone.now(),
+            processed_at=None,
+            last_error=None,
+            updated_at=timezone.now(),
+        )
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id}"
+
 
 class CarWashUpdateRequest(CustomModelMixin):
     car_wash = models.ForeignKey(CarWash, on_delete=models.CASCADE, related_name="pending_updates", null=True, blank=True)
@@ -8,6 +8,7 @@ from .models import (
     CarWashImage,
     CarWashReview,
     CarWashReviewImage,
+    CarWashReviewStats,
     Payment,
     WashType,
     Amenity,
@@ -19,11 +20,16 @@ from .models import (
 from utilities.mixins import DynamicFieldsSerializerMixin
 from rest_framework_gis.fields import GeometryField
 from rest_framework.exceptions import PermissionDenied, AuthenticationFailed
-from django.db.models import Count, Avg, Q
+from django.db.models import Count, Avg, Q, Prefetch
+from django.db import transaction
+from copy import copy
+import json
+from rest_framework.utils.encoders import JSONEncoder
+from .cache import fragment_cache
 from . import utils
 
 
-class WashTypeSerializer(serializers.ModelSerializer):
+class WashTypeSerializer(DynamicFieldsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = WashType
         exclude = (
@@ -97,7 +103,7 @@ class OfferSerializer(DynamicFieldsSerializerMixin, serializers.ModelSerializer)
         fields = "__all__"
 
 
-class CarWashPackageSerializer(serializers.ModelSerializer):
+class CarWashPackageSerializer(DynamicFieldsSerializerMixin, serializers.ModelSerializer):
     wash_types = serializers.SerializerMethodField()
 
     class Meta:
@@ -105,7 +111,9 @@ class CarWashPackageSerializer(serializers.ModelSerializer):
         exclude = ("car_wash",)
 
     def get_wash_types(self, instance):
-        return WashTypeSerializer(instance.wash_types, many=True).data
+        return WashTypeSerializer(
+            instance.wash_types, many=True, fields=self.nested_fields.get("wash_types")
+        ).data
 
 
 class CarWashTypeSerializer(serializers.ModelSerializer):
@@ -114,7 +122,7 @@ class CarWashTypeSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class AmenitySerializer(serializers.ModelSerializer):
+class AmenitySerializer(DynamicFieldsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Amenity
         fields = "__all__"
@@ -142,6 +150,30 @@ class ReviewStatsSerializer(serializers.Serializer):
     rating_1 = serializers.IntegerField()
 
 
+EMPTY_REVIEWS_SUMMARY = {
+    "total_reviews": 0,
+    "average_rating": None,
+    "rating_5": 0,
+    "rating_4": 0,
+    "rating_3": 0,
+    "rating_2": 0,
+    "rating_1": 0,
+}
+
+# Columns derived from a car wash and its related rows for searching and
+# ranking, never part of its representation
+CAR_WASH_INTERNAL_FIELDS = (
+    "min_price",
+    "min_price_automatic",
+    "min_price_selfservice",
+    "has_active_offer_or_bounty",
+    "offer_windows",
+    "search_document",
+    "search_vector",
+    "opening_schedule",
+)
+
+
 class CarWashListSerializer(DynamicFieldsSerializerMixin, serializers.ModelSerializer):
     amenities = serializers.SerializerMethodField()
     location = serializers.SerializerMethodField()
@@ -153,41 +185,133 @@ class CarWashListSerializer(DynamicFieldsSerializerMixin, serializers.ModelSeria
 
     class Meta:
         model = CarWash
-        fields = "__all__"
+        exclude = CAR_WASH_INTERNAL_FIELDS
+
+    def to_representation(self, instance):
+        """
+        Splices the request dependent parts (distance and the request filtered
+        packages) into the cached fragment of the car wash when there is one.
+        """
+        fragment = self.context.get("fragments", {}).get(instance.pk)
+        if fragment is None:
+            return super().to_representation(instance)
+
+        data = {}
+        for field_name, field in self.fields.items():
+            if field_name == "distance":
+                if getattr(instance, "distance", None) is not None:
+                    data[field_name] = field.to_representation(instance.distance)
+            elif field_name == "packages":
+                data[field_name] = [
+                    package
+                    for package in fragment["packages"]
+                    if self.package_matches_request(
+                        package["category"],
+                        [wash_type["name"] for wash_type in package["wash_types"]],
+                    )
+                ]
+            else:
+                data[field_name] = fragment[field_name]
+        return data
+
+    @classmethod
+    def get_fragments(cls, car_washes):
+        """
+        Request independent representation of each car wash, from the
+        fragment cache or serialized (and cached) for the missing ones.
+        """
+        car_wash_ids = [car_wash.pk for car_wash in car_washes]
+        fragments = fragment_cache.get_many(car_wash_ids)
+
+        missing_ids = [car_wash_id for car_wash_id in car_wash_ids if car_wash_id not in fragments]
+        if missing_ids:
+            missing = cls.setup_eager_loading(CarWash.objects.filter(id__in=missing_ids))
+            rendered = {
+                car_wash.pk: json.loads(json.dumps(cls(car_wash, context={}).data, cls=JSONEncoder))
+                for car_wash in missing
+            }
+            fragment_cache.set_many(rendered)
+            fragments.update(rendered)
+        return fragments
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None, extra_columns=()):
+        """
+        Prefetch every related collection used by this serializer so a page
+        of car washes is loaded in a fixed number of queries.
+        With a nested field selection (see utilities.mixins.parse_fields)
+        only the selected columns (plus extra_columns) are loaded and only
+        the relations the selected fields need are prefetched.
+        """
+        prefetches = {
+            "amenities": "amenities",
+            "operating_hours": "operating_hours",
+            "images": "images",
+            "packages": Prefetch(
+                "packages",
+                queryset=CarWashPackage.objects.prefetch_related("wash_types"),
+            ),
+            "reviews_summary": Prefetch(
+                "review_stats",
+                queryset=CarWashReviewStats.objects.filter(dimension="overall"),
+                to_attr="overall_review_stats",
+            ),
+        }
+        if fields is None:
+            return queryset.prefetch_related(*prefetches.values())
+
+        columns = {field.name for field in CarWash._meta.concrete_fields} & set(fields)
+        return queryset.only(*columns, *extra_columns).prefetch_related(
+            *(prefetch for name, prefetch in prefetches.items() if name in fields)
+        )
 
     def get_amenities(self, instance):
         return AmenitySerializer(
-            instance.amenities, many=True, context={"car_wash": instance}
+            instance.amenities,
+            many=True,
+            context={"car_wash": instance},
+            fields=self.nested_fields.get("amenities"),
         ).data
 
     def get_packages(self, instance):
-        wash_type_names = self.context.get("request", {}).GET.get("washTypeName", None)
-        self_service_car_wash = self.context.get("request", {}).GET.get(
-            "selfServiceCarWash", None
-        )
-        automatic_car_wash = self.context.get("request", {}).GET.get(
-            "automaticCarWash", None
-        )
-
-        packages = instance.packages.all()
-
-        # Filter by wash type names if provided
-        if wash_type_names:
-            wash_type_names_list = wash_type_names.split(",")
-            packages = packages.filter(
-                wash_types__name__in=wash_type_names_list
-            ).distinct()
-
-        # Filter by package category based on filter parameters
-        if self_service_car_wash == "true":
-            packages = packages.filter(category="selfservice")
-        elif automatic_car_wash == "true":
-            packages = packages.filter(category="automatic")
+        # Filtered in memory so the prefetched packages are reused
+        packages = [
+            package
+            for package in instance.packages.all()
+            if self.package_matches_request(
+                package.category,
+                [wash_type.name for wash_type in package.wash_types.all()],
+            )
+        ]
 
         return CarWashPackageSerializer(
-            packages, many=True, context={"request": self.context.get("request")}
+            packages,
+            many=True,
+            context={"request": self.context.get("request")},
+            fields=self.nested_fields.get("packages"),
         ).data
 
+    def package_matches_request(self, category, wash_type_names):
+        """
+        Whether a package passes the washTypeName and selfServiceCarWash /
+        automaticCarWash filters of the request.
+        """
+        request = self.context.get("request")
+        if request is None:
+            return True
+
+        requested_wash_type_names = request.GET.get("washTypeName", None)
+        if requested_wash_type_names and not set(wash_type_names) & set(
+            requested_wash_type_names.split(",")
+        ):
+            return False
+
+        if request.GET.get("selfServiceCarWash", None) == "true":
+            return category == "selfservice"
+        if request.GET.get("automaticCarWash", None) == "true":
+            return category == "automatic"
+        return True
+
     def get_location(self, instance):
         if instance.location:
             return {
@@ -200,16 +324,11 @@ class CarWashListSerializer(DynamicFieldsSerializerMixin, serializers.ModelSeria
         return round(obj.distance, 1) if hasattr(obj, "distance") else None
 
     def get_reviews_summary(self, instance):
-        review_objects = instance.reviews.aggregate(
-            total_reviews=Count("id"),
-            average_rating=Avg("overall_rating"),
-            rating_5=Count("id", filter=Q(overall_rating=5)),
-            rating_4=Count("id", filter=Q(overall_rating=4)),
-            rating_3=Count("id", filter=Q(overall_rating=3)),
-            rating_2=Count("id", filter=Q(overall_rating=2)),
-            rating_1=Count("id", filter=Q(overall_rating=1)),
-        )
-        return ReviewStatsSerializer(review_objects).data
+        if hasattr(instance, "overall_review_stats"):
+            review_stats = next(iter(instance.overall_review_stats), None)
+        else:
+            review_stats = instance.review_stats.filter(dimension="overall").first()
+        return ReviewStatsSerializer(review_stats or EMPTY_REVIEWS_SUMMARY).data
 
 
 class CarWashOperatingHoursPostPatchSerializer(serializers.ModelSerializer):
@@ -263,7 +382,7 @@ class CarWashPostPatchSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = CarWash
-        fields = "__all__"
+        exclude = CAR_WASH_INTERNAL_FIELDS
 
     def update(self, instance, validated_data):
         self.handle_location(validated_data)
@@ -324,6 +443,9 @@ class CarWashPostPatchSerializer(serializers.ModelSerializer):
 
         instance.packages.filter(~Q(id__in=new_packages_ids)).delete()
 
+        # Packages updated in bulk above skip the post_save signal
+        CarWash.refresh_search_columns([instance.id])
+
     def create(self, validated_data):
         amenities = validated_data.pop("amenities", [])
         operating_hours = validated_data.pop("operating_hours", [])
@@ -344,6 +466,49 @@ class PreSignedUrlSerializer(serializers.Serializer):
     filename = serializers.CharField()
 
 
+class CarWashMapQuerySerializer(serializers.Serializer):
+    bbox = serializers.CharField(help_text="minLng,minLat,maxLng,maxLat")
+    zoom = serializers.IntegerField(min_value=0, max_value=22)
+
+    def validate_bbox(self, value):
+        try:
+            min_lng, min_lat, max_lng, max_lat = (float(part) for part in value.split(","))
+        except ValueError:
+            raise ValidationError("bbox must be minLng,minLat,maxLng,maxLat")
+
+        if not (-180 <= min_lng <= 180 and -180 <= max_lng <= 180):
+            raise ValidationError("bbox longitudes must be between -180 and 180")
+        if not (-90 <= min_lat <= max_lat <= 90):
+            raise ValidationError("bbox latitudes must be between -90 and 90, min before max")
+        return min_lng, min_lat, max_lng, max_lat
+
+
+class AutocompleteQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(min_length=1, max_length=100)
+    limit = serializers.IntegerField(min_value=1, max_value=20, default=10)
+    userLat = serializers.FloatField(min_value=-90, max_value=90, required=False)
+    userLng = serializers.FloatField(min_value=-180, max_value=180, required=False)
+
+
+class CarWashBatchQuerySerializer(serializers.Serializer):
+    MAX_IDS = 100
+
+    ids = serializers.CharField(help_text=f"Comma-separated car wash ids, at most {MAX_IDS}")
+
+    def validate_ids(self, value):
+        try:
+            ids = [int(part) for part in value.split(",") if part.strip()]
+        except ValueError:
+            raise ValidationError("ids must be comma-separated integers")
+
+        if not ids:
+            raise ValidationError("ids must contain at least one id")
+        if len(ids) > self.MAX_IDS:
+            raise ValidationError(f"ids must contain at most {self.MAX_IDS} ids")
+        # Duplicates are dropped, the first occurrence keeps its position
+        return list(dict.fromkeys(ids))
+
+
 class CarWashReviewPostPatchSerializer(serializers.ModelSerializer):
     images = CarWashReviewImagesPostPatchSerializer(many=True, required=False)
 
@@ -351,6 +516,7 @@ class CarWashReviewPostPatchSerializer(serializers.ModelSerializer):
         model = CarWashReview
         exclude = ["created_by", "updated_by", "status"]
 
+    @transaction.atomic
     def create(self, validated_data):
         images = validated_data.pop("images", [])
 
@@ -360,6 +526,23 @@ class CarWashReviewPostPatchSerializer(serializers.ModelSerializer):
         )
 
         self.handle_images(car_wash_review, images)
+        CarWashReviewStats.add_review(car_wash_review)
+
+        return car_wash_review
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        images = validated_data.pop("images", [])
+        # Concurrent updates of the review wait for each other, so each one
+        # removes the ratings the previous one added
+        instance = CarWashReview.objects.select_for_update().get(pk=instance.pk)
+        previous_review = copy(instance)
+
+        car_wash_review = super().update(instance, validated_data)
+
+        self.handle_images(car_wash_review, images)
+        CarWashReviewStats.remove_review(previous_review)
+        CarWashReviewStats.add_review(car_wash_review)
 
         return car_wash_review
 
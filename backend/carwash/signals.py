@@ -0,0 +1,164 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from utilities.versions import change_versions
+
+from .autocomplete import autocomplete_index
+from .cache import fragment_cache, search_cache, tile_cache
+from .spatial_index import car_wash_index
+from .models import (
+    Amenity,
+    AmenityCarWashMapping,
+    CarWash,
+    CarWashCode,
+    CarWashImage,
+    CarWashOperatingHours,
+    CarWashPackage,
+    CarWashReview,
+    Offer,
+    WashType,
+)
+
+
+def invalidate_location_caches(locations, car_wash_ids=()):
+    """
+    Invalidates the cached searches and vector tiles covering the locations,
+    and the serialized car washes, once the current transaction commits.
+    Also bumps the car wash change version behind conditional GETs and
+    refreshes this process' spatial index on its next query.
+    """
+
+    def invalidate():
+        search_cache.invalidate(*locations)
+        tile_cache.invalidate(*locations)
+        fragment_cache.invalidate(*car_wash_ids)
+        change_versions.bump(CarWash)
+        car_wash_index.mark_stale()
+
+    transaction.on_commit(invalidate)
+
+
+def invalidate_search_cache(car_wash_ids):
+    rows = list(CarWash.objects.filter(id__in=car_wash_ids).values_list("id", "location"))
+    invalidate_location_caches(
+        [location for _, location in rows], [car_wash_id for car_wash_id, _ in rows]
+    )
+
+
+@receiver(post_save, sender=CarWashPackage)
+@receiver(post_delete, sender=CarWashPackage)
+def refresh_car_wash_on_package_change(sender, instance, **kwargs):
+    CarWash.refresh_search_columns([instance.car_wash_id])
+
+
+@receiver(post_save, sender=Offer)
+@receiver(post_delete, sender=Offer)
+def refresh_car_wash_on_offer_change(sender, instance, **kwargs):
+    car_wash_ids = CarWashPackage.objects.filter(id=instance.package_id).values("car_wash_id")
+    CarWash.refresh_search_columns(car_wash_ids)
+    invalidate_search_cache(car_wash_ids)
+
+
+@receiver(post_save, sender=CarWashOperatingHours)
+@receiver(post_delete, sender=CarWashOperatingHours)
+def refresh_car_wash_on_operating_hours_change(sender, instance, **kwargs):
+    CarWash.refresh_opening_schedules([instance.car_wash_id])
+
+
+@receiver(pre_save, sender=CarWash)
+def remember_car_wash_location(sender, instance, **kwargs):
+    instance._previous_location = None
+    if instance.pk:
+        instance._previous_location = (
+            CarWash.objects.filter(pk=instance.pk).values_list("location", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=CarWash)
+@receiver(post_delete, sender=CarWash)
+def invalidate_search_cache_on_car_wash_change(sender, instance, **kwargs):
+    invalidate_location_caches(
+        [getattr(instance, "_previous_location", None), instance.location], [instance.pk]
+    )
+
+
+@receiver(post_save, sender=CarWash)
+@receiver(post_delete, sender=CarWash)
+def refresh_autocomplete_on_car_wash_change(sender, instance, **kwargs):
+    transaction.on_commit(autocomplete_index.mark_stale)
+
+
+@receiver(post_save, sender=CarWashPackage)
+@receiver(post_delete, sender=CarWashPackage)
+@receiver(post_save, sender=CarWashReview)
+@receiver(post_delete, sender=CarWashReview)
+@receiver(post_save, sender=CarWashOperatingHours)
+@receiver(post_delete, sender=CarWashOperatingHours)
+@receiver(post_save, sender=CarWashImage)
+@receiver(post_delete, sender=CarWashImage)
+@receiver(post_save, sender=AmenityCarWashMapping)
+@receiver(post_delete, sender=AmenityCarWashMapping)
+def invalidate_search_cache_on_related_change(sender, instance, **kwargs):
+    invalidate_search_cache([instance.car_wash_id])
+
+
+@receiver(m2m_changed, sender=CarWashPackage.wash_types.through)
+@receiver(m2m_changed, sender=AmenityCarWashMapping)
+def invalidate_search_cache_on_m2m_change(sender, instance, action, reverse, **kwargs):
+    if action.startswith("post_") and not reverse:
+        invalidate_search_cache([getattr(instance, "car_wash_id", instance.pk)])
+
+
+@receiver(post_save, sender=WashType)
+@receiver(post_delete, sender=WashType)
+@receiver(post_save, sender=Amenity)
+@receiver(post_delete, sender=Amenity)
+def invalidate_car_wash_fragments_on_shared_change(sender, instance, **kwargs):
+    transaction.on_commit(fragment_cache.invalidate_all)
+
+
+@receiver(post_save, sender=WashType)
+@receiver(post_delete, sender=WashType)
+@receiver(post_save, sender=Amenity)
+@receiver(post_delete, sender=Amenity)
+@receiver(post_save, sender=Offer)
+@receiver(post_delete, sender=Offer)
+@receiver(post_save, sender=CarWashCode)
+@receiver(post_delete, sender=CarWashCode)
+def bump_change_version(sender, instance, **kwargs):
+    transaction.on_commit(lambda: change_versions.bump(sender))
+
+
+@receiver(pre_save, sender=CarWashCode)
+def remember_car_wash_code_state(sender, instance, **kwargs):
+    instance._previous_state = None
+    if instance.pk:
+        previous = (
+            CarWashCode.objects.filter(pk=instance.pk)
+            .values_list("offer_id", "user_id", "reserved_until")
+            .first()
+        )
+        if previous:
+            offer_id, user_id, reserved_until = previous
+            instance._previous_state = (offer_id, user_id is None and reserved_until is None)
+
+
+def is_available(code):
+    return code.user_id is None and code.reserved_until is None
+
+
+@receiver(post_save, sender=CarWashCode)
+def count_saved_code(sender, instance, **kwargs):
+    previous = getattr(instance, "_previous_state", None)
+    if previous == (instance.offer_id, is_available(instance)):
+        return
+    if previous:
+        offer_id, available = previous
+        Offer.update_code_counts(offer_id, total=-1, available=-int(available))
+    Offer.update_code_counts(instance.offer_id, total=1, available=int(is_available(instance)))
+
+
+@receiver(post_delete, sender=CarWashCode)
+def count_deleted_code(sender, instance, **kwargs):
+    Offer.update_code_counts(instance.offer_id, total=-1, available=-int(is_available(instance)))
@@ -0,0 +1,243 @@
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import FloatField, Func, Max
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .models import AsGeometry, CarWash
+
+EARTH_RADIUS_MILES = 3958.7613
+# Spherical distances are within 0.5% of the spheroidal ones PostGIS
+# computes; radii used to prefilter PostGIS queries are widened by this
+SPHEROID_MARGIN = 1.01
+
+
+class SpatialIndex:
+    """
+    In-memory grid of points answering radius and k-nearest queries with
+    vectorized haversine distances. Points are sorted by grid cell, so the
+    candidates of a query are a few contiguous slices (one per cell row).
+    Distances are measured on a sphere, within 0.5% of the spheroidal
+    distances PostGIS computes for geography columns.
+
+    Instances are immutable: updated() returns a new index, which lets a
+    refreshed index replace the current one while other threads query it.
+    """
+
+    CELL_SIZE = 0.25  # degrees
+
+    def __init__(self, ids, lats, lngs):
+        self.rows = math.ceil(180 / self.CELL_SIZE)
+        self.columns = math.ceil(360 / self.CELL_SIZE)
+
+        cells = self._cells(lats, lngs)
+        order = np.argsort(cells, kind="stable")
+        self.ids = ids[order]
+        self.cells = cells[order]
+        self.lat = np.radians(lats[order])
+        self.lng = np.radians(lngs[order])
+        self.cos_lat = np.cos(self.lat)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Builds an index from (id, lat, lng) rows.
+        """
+        points = np.array(rows, dtype=np.float64).reshape(-1, 3)
+        return cls(points[:, 0].astype(np.int64), points[:, 1], points[:, 2])
+
+    def updated(self, rows, removed_ids=()):
+        """
+        Returns a new index with the (id, lat, lng) rows inserted or moved
+        and removed_ids dropped.
+        """
+        changes = self.from_rows(rows)
+        keep = ~np.isin(self.ids, np.concatenate([changes.ids, np.asarray(removed_ids, dtype=np.int64)]))
+        return type(self)(
+            np.concatenate([self.ids[keep], changes.ids]),
+            np.concatenate([np.degrees(self.lat[keep]), np.degrees(changes.lat)]),
+            np.concatenate([np.degrees(self.lng[keep]), np.degrees(changes.lng)]),
+        )
+
+    def _row(self, lat):
+        return np.clip(((np.asarray(lat) + 90) // self.CELL_SIZE).astype(np.int64), 0, self.rows - 1)
+
+    def _column(self, lng):
+        return np.clip(((np.asarray(lng) + 180) // self.CELL_SIZE).astype(np.int64), 0, self.columns - 1)
+
+    def _cells(self, lats, lngs):
+        return self._row(lats) * self.columns + self._column(lngs)
+
+    def _candidate_slices(self, lat, lng, miles):
+        """
+        Slices of the sorted points whose cells intersect the bounding box
+        of a circle.
+        """
+        angle = miles / EARTH_RADIUS_MILES
+        delta_lat = math.degrees(angle)
+        min_lat, max_lat = lat - delta_lat, lat + delta_lat
+
+        if min_lat <= -90 or max_lat >= 90 or angle >= math.pi / 2:
+            # The circle contains a pole, every longitude is in range
+            column_ranges = [(0, self.columns - 1)]
+        else:
+            delta_lng = math.degrees(math.asin(min(math.sin(angle) / math.cos(math.radians(lat)), 1)))
+            min_lng, max_lng = lng - delta_lng, lng + delta_lng
+            if max_lng - min_lng >= 360:
+                column_ranges = [(0, self.columns - 1)]
+            elif min_lng < -180:
+                column_ranges = [(0, int(self._column(max_lng))), (int(self._column(min_lng + 360)), self.columns - 1)]
+            elif max_lng > 180:
+                column_ranges = [(int(self._column(min_lng)), self.columns - 1), (0, int(self._column(max_lng - 360)))]
+            else:
+                column_ranges = [(int(self._column(min_lng)), int(self._column(max_lng)))]
+
+        slices = []
+        for row in range(int(self._row(max(min_lat, -90))), int(self._row(min(max_lat, 90))) + 1):
+            for first, last in column_ranges:
+                start, stop = np.searchsorted(
+                    self.cells, [row * self.columns + first, row * self.columns + last + 1]
+                )
+                if start < stop:
+                    slices.append(slice(start, stop))
+        return slices
+
+    def _distances(self, points, lat, lng):
+        """
+        Haversine distances in miles from (lat, lng), in radians, to a slice
+        of the points.
+        """
+        half_dlat = np.sin((self.lat[points] - lat) / 2)
+        half_dlng = np.sin((self.lng[points] - lng) / 2)
+        a = half_dlat * half_dlat + math.cos(lat) * self.cos_lat[points] * half_dlng * half_dlng
+        return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+    def within(self, lat, lng, miles):
+        """
+        Ids and distances (in miles) of the points within a radius of a
+        location, nearest first.
+        """
+        origin_lat, origin_lng = math.radians(lat), math.radians(lng)
+        ids, distances = [], []
+        for points in self._candidate_slices(lat, lng, miles):
+            slice_distances = self._distances(points, origin_lat, origin_lng)
+            inside = slice_distances <= miles
+            ids.append(self.ids[points][inside])
+            distances.append(slice_distances[inside])
+
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        ids, distances = np.concatenate(ids), np.concatenate(distances)
+        order = np.argsort(distances, kind="stable")
+        return ids[order], distances[order]
+
+    def nearest(self, lat, lng, k):
+        """
+        Ids and distances (in miles) of the k points nearest to a location.
+        The radius is doubled until it contains k points, which are then
+        guaranteed to be the k nearest.
+        """
+        miles = self.CELL_SIZE * 69
+        while True:
+            ids, distances = self.within(lat, lng, miles)
+            if len(ids) >= k or miles >= math.pi * EARTH_RADIUS_MILES:
+                return ids[:k], distances[:k]
+            miles *= 2
+
+
+class CarWashSpatialIndex:
+    """
+    Per-process SpatialIndex of the active car washes.
+
+    The index is refreshed lazily at most every CAR_WASH_SPATIAL_INDEX_REFRESH
+    seconds (or on the next query after mark_stale()) by reading the car
+    washes updated since the last refresh. Deleted rows and changes made
+    through queryset.update() do not move updated_at, so the index is also
+    rebuilt from scratch every CAR_WASH_SPATIAL_INDEX_REBUILD seconds.
+    """
+
+    # Rows updated in transactions that committed after a refresh may carry
+    # an updated_at older than the watermark; re-reading this window catches them
+    WATERMARK_OVERLAP = timedelta(minutes=1)
+
+    def __init__(self):
+        self.index = None
+        self.watermark = None
+        self.built_at = 0
+        self.refreshed_at = 0
+        self.stale = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def enabled():
+        return settings.CAR_WASH_SPATIAL_INDEX and np is not None
+
+    @staticmethod
+    def _rows(queryset):
+        geometry = AsGeometry("location")
+        return list(
+            queryset.filter(location__isnull=False).values_list(
+                "id",
+                Func(geometry, function="ST_Y", output_field=FloatField()),
+                Func(geometry, function="ST_X", output_field=FloatField()),
+            )
+        )
+
+    def mark_stale(self):
+        self.stale = True
+
+    def get(self):
+        """
+        Returns the up to date index.
+        """
+        now = time.monotonic()
+        if self.index is None or self.stale or now - self.refreshed_at >= settings.CAR_WASH_SPATIAL_INDEX_REFRESH:
+            with self._lock:
+                if self.index is None or now - self.built_at >= settings.CAR_WASH_SPATIAL_INDEX_REBUILD:
+                    self.build()
+                elif self.stale or now - self.refreshed_at >= settings.CAR_WASH_SPATIAL_INDEX_REFRESH:
+                    self.refresh()
+        return self.index
+
+    def build(self):
+        self.stale = False
+        watermark = CarWash.objects.aggregate(watermark=Max("updated_at"))["watermark"]
+        self.index = SpatialIndex.from_rows(self._rows(CarWash.active_objects.all()))
+        self.watermark = watermark
+        self.built_at = self.refreshed_at = time.monotonic()
+
+    def refresh(self):
+        self.stale = False
+        if self.watermark is None:
+            return self.build()
+
+        changed = list(
+            CarWash.objects.filter(updated_at__gte=self.watermark - self.WATERMARK_OVERLAP).values_list(
+                "id", "updated_at"
+            )
+        )
+        if changed:
+            changed_ids = [car_wash_id for car_wash_id, _ in changed]
+            rows = self._rows(CarWash.active_objects.filter(id__in=changed_ids))
+            self.index = self.index.updated(rows, removed_ids=changed_ids)
+            self.watermark = max(self.watermark, *(updated_at for _, updated_at in changed))
+        self.refreshed_at = time.monotonic()
+
+    def within(self, lat, lng, miles):
+        return self.get().within(float(lat), float(lng), float(miles))
+
+    def nearest(self, lat, lng, k):
+        return self.get().nearest(float(lat), float(lng), int(k))
+
+
+car_wash_index = CarWashSpatialIndex()
@@ -1,3 +1,339 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import time, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import stripe
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import Point
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .filters import ListCarWashFilter
+from .models import (
+    Amenity,
+    AmenityCarWashMapping,
+    CarWash,
+    CarWashCode,
+    CarWashImage,
+    CarWashOperatingHours,
+    CarWashPackage,
+    CarWashReview,
+    CarWashReviewStats,
+    Offer,
+    Payment,
+    WashType,
+)
+from .serializers import CAR_WASH_INTERNAL_FIELDS
+
+
+def create_car_wash(name, **kwargs):
+    return CarWash.objects.create(
+        car_wash_name=name,
+        automatic_car_wash=True,
+        self_service_car_wash=False,
+        open_24_hours=True,
+        **kwargs,
+    )
+
+
+class ListCarWashAPIViewTests(TestCase):
+    CAR_WASHES = 12
+
+    @classmethod
+    def setUpTestData(cls):
+        foam = WashType.objects.create(name="Foam", description="Foam", category="automatic", subclass="Clean")
+        vacuum = Amenity.objects.create(name="Vacuum", description="Vacuum", category="automatic")
+        for number in range(cls.CAR_WASHES):
+            car_wash = create_car_wash(f"Car wash {number}")
+            car_wash.amenities.add(vacuum)
+            CarWashImage.objects.create(car_wash=car_wash, image_type="Site", image_url="https://example.com/site.jpg")
+            for day in range(7):
+                CarWashOperatingHours.objects.create(
+                    car_wash=car_wash, day_of_week=day, opening_time=time(8), closing_time=time(20)
+                )
+            for category in ("automatic", "selfservice"):
+                package = CarWashPackage.objects.create(
+                    car_wash=car_wash, name=category, price=10, category=category
+                )
+                package.wash_types.add(foam)
+
+    def get_queries(self, params):
+        """
+        Runs a search with empty caches and returns its number of queries.
+        """
+        caches["search"].clear()
+        caches["fragments"].clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("list-car-wash"), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["data"][0]["results"]), params["page_size"])
+        return len(queries)
+
+    def assert_queries_independent_of_page_size(self, params=None):
+        params = params or {}
+        queries = self.get_queries({**params, "page_size": 2})
+        with self.assertNumQueries(queries):
+            self.get_queries({**params, "page_size": 10})
+
+    def test_queries_do_not_grow_with_page_size(self):
+        self.assert_queries_independent_of_page_size()
+
+    def test_queries_do_not_grow_with_page_size_with_fields(self):
+        self.assert_queries_independent_of_page_size(
+            {"fields": "id,car_wash_name,amenities,images,operating_hours,packages.wash_types,reviews_summary"}
+        )
+
+    def test_internal_columns_are_not_returned(self):
+        response = self.client.get(reverse("list-car-wash"), {"page_size": 1})
+
+        result = response.json()["data"][0]["results"][0]
+        self.assertFalse(set(CAR_WASH_INTERNAL_FIELDS) & set(result))
+
+
+class ListCarWashCursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.car_washes = []
+        for number in range(7):
+            car_wash = create_car_wash(
+                f"Car wash {number}",
+                location=Point(-97.74 + number / 100, 30.27, srid=4326),
+                reviews_average=number % 3,
+            )
+            if number % 2:
+                package = CarWashPackage.objects.create(car_wash=car_wash, name="Package", price=10)
+                Offer.objects.create(package=package, name="Offer", offer_price=5, offer_type="ONE_TIME")
+            cls.car_washes.append(car_wash)
+
+    def test_recommended_ordering_pages_through_every_car_wash(self):
+        params = {
+            "pagination": "cursor",
+            "sortBy": "recommended",
+            "userLat": 30.27,
+            "userLng": -97.74,
+            "page_size": 2,
+        }
+        response = self.client.get(reverse("list-car-wash"), params)
+        pages = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            page = response.json()["data"][0]
+            pages.append([car_wash["id"] for car_wash in page["results"]])
+            if not page["links"]["next"]:
+                break
+            response = self.client.get(page["links"]["next"])
+
+        ids = [car_wash_id for page in pages for car_wash_id in page]
+        self.assertCountEqual(ids, [car_wash.id for car_wash in self.car_washes])
+        # Car washes with an offer come first
+        with_offer = {car_wash.id for number, car_wash in enumerate(self.car_washes) if number % 2}
+        self.assertEqual(set(ids[:len(with_offer)]), with_offer)
+
+        response = self.client.get(page["links"]["previous"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([car_wash["id"] for car_wash in response.json()["data"][0]["results"]], pages[-2])
+
+
+class CarWashMapAPIViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for number in range(3):
+            create_car_wash(f"Car wash {number}", location=Point(-97.74 + number / 100, 30.27, srid=4326))
+
+    def test_search_ordering_is_ignored(self):
+        for sort_by in ("recommended", "distance_near_to_far"):
+            with self.subTest(sort_by=sort_by):
+                response = self.client.get(
+                    reverse("car-wash-map"),
+                    {"bbox": "-98,30,-97,31", "zoom": 14, "sortBy": sort_by},
+                )
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()["data"]["results"]), 3)
+
+
+class CarWashFacetsAPIViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for number in range(3):
+            create_car_wash(f"Car wash {number}", location=Point(-97.74 + number / 100, 30.27, srid=4326))
+
+    def test_search_ordering_is_ignored(self):
+        for params in ({}, {"userLat": 30.27, "userLng": -97.74, "distance": 10}):
+            for sort_by in ("recommended", "distance_near_to_far"):
+                with self.subTest(sort_by=sort_by, **params):
+                    caches["search"].clear()
+                    response = self.client.get(reverse("car-wash-facets"), {**params, "sortBy": sort_by})
+
+                    self.assertEqual(response.status_code, 200)
+
+
+class ListCarWashFilterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.foam = WashType.objects.create(name="Foam", description="Foam", category="automatic", subclass="Clean")
+        cls.vacuum = Amenity.objects.create(name="Vacuum", description="Vacuum", category="automatic")
+
+        # Two matching packages and offers, so a join would repeat the car wash
+        cls.matching = create_car_wash("Matching")
+        for number in range(2):
+            package = CarWashPackage.objects.create(car_wash=cls.matching, name=f"Package {number}", price=10)
+            package.wash_types.add(cls.foam)
+            Offer.objects.create(package=package, name=f"Offer {number}", offer_price=5, offer_type="ONE_TIME")
+        AmenityCarWashMapping.objects.create(car_wash=cls.matching, amenity=cls.vacuum)
+
+        # Matches the wash type and the amenity but has no offer
+        cls.without_offer = create_car_wash("Without offer")
+        CarWashPackage.objects.create(car_wash=cls.without_offer, name="Package", price=10).wash_types.add(cls.foam)
+        AmenityCarWashMapping.objects.create(car_wash=cls.without_offer, amenity=cls.vacuum)
+
+    def filter(self, data):
+        filterset = ListCarWashFilter(data, queryset=CarWash.active_objects.all())
+        self.assertTrue(filterset.is_valid(), filterset.errors)
+        return filterset.qs
+
+    def test_related_filters_use_exists_without_distinct(self):
+        queryset = self.filter({"offers": "ONE_TIME", "washTypeName": "Foam", "amenityName": "Vacuum"})
+
+        sql = str(queryset.query).upper()
+        self.assertNotIn("DISTINCT", sql)
+        self.assertEqual(sql.count("EXISTS"), 3)
+        self.assertEqual(list(queryset), [self.matching])
+
+    def test_related_filter_matches_any_value(self):
+        queryset = self.filter({"washTypeName": "Foam,Wax"}).order_by("id")
+
+        self.assertNotIn("DISTINCT", str(queryset.query).upper())
+        self.assertEqual(list(queryset), [self.matching, self.without_offer])
+
+
+class CarWashCodeAllocationTests(TransactionTestCase):
+    """
+    Allocates codes from concurrent connections, which only contend for
+    rows outside of a test transaction.
+    """
+
+    CODES = 50
+    CLAIMS = 80
+    WORKERS = 16
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="claimer")
+        package = CarWashPackage.objects.create(car_wash=create_car_wash("Codes"), name="Package", price=10)
+        self.offer = Offer.objects.create(package=package, name="Offer", offer_price=5, offer_type="ONE_TIME")
+        CarWashCode.objects.bulk_create(
+            [CarWashCode(offer=self.offer, code=f"CODE-{number}") for number in range(self.CODES)]
+        )
+        Offer.refresh_code_counts([self.offer.id])
+
+    def test_concurrent_allocations_hand_out_each_code_once(self):
+        def claim(_):
+            try:
+                code = CarWashCode.allocate(self.offer.id, self.user)
+                return code.pk if code else None
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            allocated = [code_id for code_id in executor.map(claim, range(self.CLAIMS)) if code_id]
+
+        self.assertEqual(len(allocated), len(set(allocated)))
+        self.assertEqual(len(allocated), min(self.CLAIMS, self.CODES))
+
+        codes = CarWashCode.objects.filter(offer=self.offer)
+        self.assertEqual(set(codes.filter(user=self.user).values_list("id", flat=True)), set(allocated))
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.total_codes, codes.count())
+        self.assertEqual(self.offer.available_codes, codes.filter(user__isnull=True, reserved_until__isnull=True).count())
+
+
+class CarWashReviewStatsConcurrencyTests(TransactionTestCase):
+    RATINGS = ("overall", "wash_quality", "price_value", "facility_cleanliness", "customer_service", "amenities_extra")
+
+    def setUp(self):
+        self.review = CarWashReview.objects.create(
+            car_wash=create_car_wash("Reviewed"),
+            comment="Review",
+            **{f"{rating}_rating": 3 for rating in self.RATINGS},
+        )
+        CarWashReviewStats.add_review(self.review)
+
+    def test_concurrent_updates_keep_the_statistics(self):
+        url = reverse("get-patch-delete-car-wash-review", kwargs={"id": self.review.id})
+
+        def update(number):
+            try:
+                response = self.client_class().patch(
+                    url, {"overall_rating": number % 5 + 1}, content_type="application/json"
+                )
+                return response.status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            self.assertEqual(set(executor.map(update, range(40))), {200})
+
+        self.review.refresh_from_db()
+        stats = CarWashReviewStats.objects.get(car_wash=self.review.car_wash, dimension="overall")
+        self.assertEqual(stats.total_reviews, 1)
+        self.assertEqual(stats.rating_sum, self.review.overall_rating)
+        self.assertEqual(
+            [getattr(stats, f"rating_{rating}") for rating in range(1, 6)],
+            [int(rating == self.review.overall_rating) for rating in range(1, 6)],
+        )
+
+
+class ReleaseCodeReservationsTests(TestCase):
+    def setUp(self):
+        package = CarWashPackage.objects.create(car_wash=create_car_wash("Codes"), name="Package", price=10)
+        self.offer = Offer.objects.create(package=package, name="Offer", offer_price=5, offer_type="ONE_TIME")
+        CarWashCode.objects.create(offer=self.offer, code="CODE")
+        Offer.refresh_code_counts([self.offer.id])
+
+        # A checkout abandoned after its reservation expired
+        self.code = CarWashCode.reserve(self.offer.id, timezone.now() - timedelta(seconds=1))
+        self.payment = Payment.objects.create(
+            offer=self.offer, carwash_code=self.code, payment_intent_id="pi_abandoned", amount=5
+        )
+        CarWashCode.objects.filter(pk=self.code.pk).update(reserved_by=self.payment)
+        Payment.objects.filter(pk=self.payment.pk).update(
+            created_at=timezone.now() - timedelta(seconds=settings.CODE_RESERVATION_TTL + 1)
+        )
+
+    def sweep(self):
+        call_command("release_code_reservations", stdout=StringIO())
+        self.payment.refresh_from_db()
+        self.code.refresh_from_db()
+        self.offer.refresh_from_db()
+
+    @mock.patch("stripe.PaymentIntent.cancel")
+    def test_cancels_the_payment_intent_and_releases_its_code(self, cancel):
+        self.sweep()
+
+        cancel.assert_called_once_with("pi_abandoned")
+        self.assertEqual(self.payment.status, "cancelled")
+        self.assertIsNone(self.payment.carwash_code)
+        self.assertIsNone(self.code.reserved_until)
+        self.assertEqual(self.offer.available_codes, 1)
+
+    @mock.patch("stripe.PaymentIntent.retrieve", return_value=mock.Mock(status="succeeded"))
+    @mock.patch(
+        "stripe.PaymentIntent.cancel",
+        side_effect=stripe.error.InvalidRequestError("The payment intent has succeeded", None),
+    )
+    def test_keeps_the_code_of_a_payment_intent_that_succeeded(self, cancel, retrieve):
+        self.sweep()
+
+        self.assertEqual(self.payment.status, "pending")
+        self.assertEqual(self.payment.carwash_code, self.code)
+        self.assertEqual(self.code.reserved_by, self.payment)
+        self.assertGreater(self.code.reserved_until, timezone.now())
+        self.assertEqual(self.offer.available_codes, 0)
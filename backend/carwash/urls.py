@@ -8,8 +8,14 @@ from .views import (
     AmenityListAPIView,
     CarWashCreateView,
     CarWashRetrieveView,
+    CarWashBatchRetrieveView,
     CarWashUpdateView,
     ListCarWashAPIView,
+    SearchCacheStatsAPIView,
+    CarWashMapAPIView,
+    AutocompleteAPIView,
+    CarWashFacetsAPIView,
+    CarWashVectorTileAPIView,
     S3APIView,
     CarWashReviewCreateView,
     CarWashReviewRetrieveUpdateDestroyView,
@@ -24,10 +30,20 @@ from .views import (
 )
 
 urlpatterns = [
+    path("get/", CarWashBatchRetrieveView.as_view(), name="get-car-washes"),
     path("get/<int:id>/", CarWashRetrieveView.as_view(), name="get-car-wash"),
     path("update/<int:id>/", CarWashUpdateView.as_view(), name="update-car-wash"),
     path("create/", CarWashCreateView.as_view(), name="create-car-wash"),
     path("search/", ListCarWashAPIView.as_view(), name="list-car-wash"),
+    path("search/facets/", CarWashFacetsAPIView.as_view(), name="car-wash-facets"),
+    path("map/", CarWashMapAPIView.as_view(), name="car-wash-map"),
+    path("autocomplete/", AutocompleteAPIView.as_view(), name="car-wash-autocomplete"),
+    path(
+        "tiles/<int:z>/<int:x>/<int:y>.mvt",
+        CarWashVectorTileAPIView.as_view(),
+        name="car-wash-vector-tile",
+    ),
+    path("search/cache-stats/", SearchCacheStatsAPIView.as_view(), name="search-cache-stats"),
     path("amenities/", AmenityListAPIView.as_view(), name="amenity-list"),
     path("wash-types/", WashTypeListAPIView.as_view(), name="washtype-list"),
     path("get-s3-presigned-url/", S3APIView().as_view(), name="get-s3-presigned-url"),
@@ -13,6 +13,7 @@ from .models import (
     CarWash,
     CarWashPackage,
     CarWashReview,
+    CarWashReviewStats,
     CarWashUpdateRequest,
     WashType,
     Amenity,
@@ -28,6 +29,9 @@ from .serializers import (
     CarWashUpdateRequestSerializer,
     PaymentStatusSerializer,
     PreSignedUrlSerializer,
+    CarWashMapQuerySerializer,
+    CarWashBatchQuerySerializer,
+    AutocompleteQuerySerializer,
     WashTypeSerializer,
     AmenitySerializer,
     OfferSerializer,
@@ -38,47 +42,70 @@ from .serializers import (
     CreatePaymentIntentSerializer,
     UserPaymentHistorySerializer,
 )
-from django.db.models import Q, Count
-from datetime import datetime
+from django.db.models import Q
 from django.contrib.gis.geos import Point
 from django.contrib.gis.db.models.functions import Distance
 from django.contrib.gis.measure import D
 from rest_framework.generics import ListAPIView
 from rest_framework.views import APIView
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from utilities.utils import ResponseInfo, CustomResponsePagination, SupabaseSingleton
-from utilities.mixins import DynamicFieldsViewMixin
+from utilities.mixins import (
+    ConditionalGetViewMixin,
+    DynamicFieldsViewMixin,
+    CursorPaginationViewMixin,
+    StreamingListViewMixin,
+)
 from .filters import (
     DynamicSearchFilter,
     ListCarWashFilter,
     ListCarWashReviewFilter,
     ListCarWashCodeFilter,
     ListOfferFilter,
+    UnorderedFilterBackend,
+    get_facet_counts,
+    without_ordering,
 )
 from django_filters.rest_framework import DjangoFilterBackend
+from .cache import search_cache, tile_cache, VectorTileCache
+from .spatial_index import SPHEROID_MARGIN, car_wash_index
+from .autocomplete import autocomplete_index
 from django.db.models.functions import Coalesce
 from django.db.models import FloatField, Value
 from django.db import transaction
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from rest_framework.exceptions import ValidationError as DRFValidationError
+from rest_framework.exceptions import ValidationError as DRFValidationError, NotFound
 from django.db.models import Case, When, BooleanField, F
 from django.utils import timezone
+from datetime import timedelta
 from . import utils
 import stripe
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
 
-class WashTypeListAPIView(generics.ListAPIView):
+class WashTypeListAPIView(ConditionalGetViewMixin, generics.ListAPIView):
     queryset = WashType.objects.all()
     serializer_class = WashTypeSerializer
+    version_models = (WashType,)
+
+    def get(self, request, *args, **kwargs):
+        if (not_modified := self.get_not_modified_response()) is not None:
+            return not_modified
+        return super().get(request, *args, **kwargs)
 
 
-class AmenityListAPIView(generics.ListAPIView):
+class AmenityListAPIView(ConditionalGetViewMixin, generics.ListAPIView):
     queryset = Amenity.objects.all()
     serializer_class = AmenitySerializer
+    version_models = (Amenity,)
+
+    def get(self, request, *args, **kwargs):
+        if (not_modified := self.get_not_modified_response()) is not None:
+            return not_modified
+        return super().get(request, *args, **kwargs)
 
 
 # Swagger documentation for Car Wash Create View with custom request body
@@ -114,11 +141,32 @@ class CarWashCreateView(generics.CreateAPIView):
             serializer.save()
 
 
-class CarWashRetrieveView(generics.RetrieveAPIView):
+class CarWashRetrieveView(ConditionalGetViewMixin, DynamicFieldsViewMixin, generics.RetrieveAPIView):
     permission_classes = [AllowAny]
     lookup_field = "id"
     serializer_class = CarWashListSerializer
     queryset = CarWash.objects.all()
+    # Wash types and amenities are nested in the car wash representation
+    version_models = (CarWash, WashType, Amenity)
+
+    def get_queryset(self):
+        fields = self.get_requested_fields()
+        if fields is None:
+            # The representation comes from the fragment cache, see retrieve
+            return super().get_queryset().only("id")
+        return CarWashListSerializer.setup_eager_loading(super().get_queryset(), fields)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["fragments"] = getattr(self, "fragments", {})
+        return context
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        if self.get_requested_fields() is None:
+            self.fragments = CarWashListSerializer.get_fragments([instance])
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
 
     @extend_schema(
         summary="Retrieve Car Wash",
@@ -126,9 +174,83 @@ class CarWashRetrieveView(generics.RetrieveAPIView):
         responses={200: CarWashListSerializer},
     )
     def get(self, request, *args, **kwargs):
+        if (not_modified := self.get_not_modified_response()) is not None:
+            return not_modified
         return super().get(request, *args, **kwargs)
 
 
+class CarWashBatchRetrieveView(ConditionalGetViewMixin, DynamicFieldsViewMixin, generics.GenericAPIView):
+    """
+    Several car washes by id in one request, in the order they were asked
+    for. Ids without a car wash are reported in not_found.
+    """
+
+    permission_classes = [AllowAny]
+    serializer_class = CarWashListSerializer
+    queryset = CarWash.objects.all()
+    version_models = (CarWash, WashType, Amenity)
+
+    def __init__(self, **kwargs):
+        """
+        Constructor method for formatting web response to return.
+        """
+        self.response_format = ResponseInfo().response
+        super(CarWashBatchRetrieveView, self).__init__(**kwargs)
+
+    def get_queryset(self):
+        fields = self.get_requested_fields()
+        if fields is None:
+            # The representations come from the fragment cache, see get
+            return super().get_queryset().only("id")
+        return CarWashListSerializer.setup_eager_loading(super().get_queryset(), fields)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["fragments"] = getattr(self, "fragments", {})
+        return context
+
+    @extend_schema(
+        summary="Retrieve Car Washes",
+        description=(
+            "Retrieve up to 100 car washes by id, in the order of the ids. "
+            "Ids that do not exist are listed in not_found."
+        ),
+        parameters=[
+            CarWashBatchQuerySerializer,
+            OpenApiParameter(
+                name="fields",
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description="Comma-separated list of fields to include in the response",
+                required=False,
+            ),
+        ],
+        responses={200: CarWashListSerializer(many=True)},
+    )
+    def get(self, request, *args, **kwargs):
+        if (not_modified := self.get_not_modified_response()) is not None:
+            return not_modified
+
+        serializer = CarWashBatchQuerySerializer(data=request.GET)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data["ids"]
+
+        car_washes = {car_wash.pk: car_wash for car_wash in self.get_queryset().filter(id__in=ids)}
+        found = [car_washes[car_wash_id] for car_wash_id in ids if car_wash_id in car_washes]
+        if self.get_requested_fields() is None:
+            self.fragments = CarWashListSerializer.get_fragments(found)
+
+        self.response_format["data"] = {
+            "results": self.get_serializer(found, many=True).data,
+            "not_found": [car_wash_id for car_wash_id in ids if car_wash_id not in car_washes],
+        }
+        self.response_format["error"] = None
+        self.response_format["status_code"] = status.HTTP_200_OK
+        self.response_format["message"] = ["Success"]
+
+        return Response(self.response_format)
+
+
 class CarWashUpdateView(generics.UpdateAPIView):
     permission_classes = [IsAuthenticated]
     lookup_field = "id"
@@ -197,8 +319,10 @@ class CarWashUpdateView(generics.UpdateAPIView):
             serializer_data.save()
 
 
-class ListCarWashAPIView(DynamicFieldsViewMixin, ListAPIView):
-    queryset = CarWash.active_objects.all().distinct()
+class ListCarWashAPIView(
+    StreamingListViewMixin, CursorPaginationViewMixin, DynamicFieldsViewMixin, ListAPIView
+):
+    queryset = CarWash.active_objects.all()
     permission_classes = (AllowAny,)
     serializer_class = CarWashListSerializer
     pagination_class = CustomResponsePagination
@@ -218,35 +342,329 @@ class ListCarWashAPIView(DynamicFieldsViewMixin, ListAPIView):
         Method for getting paginated queryset.
         """
         pagination = self.request.GET.get("pagination", "True")
-        if pagination == "True" or pagination == "true":
+        if pagination == "True" or pagination == "true" or pagination == "cursor":
             return super().paginate_queryset(queryset)
         return None
 
+    def get_user_location(self):
+        """
+        Returns the userLat/userLng of the search, snapped to the center of
+        its cache tile for searches served through the search cache.
+        """
+        user_location = getattr(self, "user_location", None)
+        if user_location:
+            return user_location
+        return self.request.GET.get("userLat"), self.request.GET.get("userLng")
+
     def get_queryset(self):
-        queryset = super().get_queryset()
-        user_lat = self.request.GET.get("userLat")
-        user_lng = self.request.GET.get("userLng")
+        fields = self.get_requested_fields()
+        if fields is None:
+            # Full representations come from the fragment cache, see get_search_data
+            queryset = super().get_queryset().only("id", "location")
+        else:
+            # location is always loaded, the search cache tracks result tiles with it
+            queryset = CarWashListSerializer.setup_eager_loading(
+                super().get_queryset(), fields, extra_columns=("location",)
+            )
+        user_lat, user_lng = self.get_user_location()
 
         if user_lat and user_lng:
-            reference_point = Point(float(user_lng), float(user_lat), srid=4326)
-            queryset = queryset.annotate(
-                distance=Coalesce(
-                    Distance("location", reference_point, output_field=FloatField())
-                    * Value(0.000621371, output_field=FloatField()),
-                    Value(0, output_field=FloatField()),
-                )
+            distance = self.request.GET.get("distance")
+            nearby_ids = self.get_nearby_ids(user_lat, user_lng, distance)
+            if nearby_ids is not None:
+                # ST_DWithin below still decides on these candidates
+                queryset = queryset.filter(id__in=nearby_ids)
+
+            queryset = CarWash.get_nearest(
+                user_lat,
+                user_lng,
+                distance_miles=distance,
+                queryset=queryset,
+                with_distance=fields is None or "distance" in fields,
             )
         return queryset
 
+    def get_nearby_ids(self, user_lat, user_lng, distance):
+        """
+        Ids of the candidate car washes of the search radius, from the
+        in-process spatial index. Its spherical distances are widened by
+        SPHEROID_MARGIN so no car wash within the spheroidal ST_DWithin
+        radius is missed. None when the index is disabled or the radius holds
+        too many car washes to pass as a list.
+        """
+        if not distance or not car_wash_index.enabled():
+            return None
+        ids, _ = car_wash_index.within(user_lat, user_lng, float(distance) * SPHEROID_MARGIN)
+        if len(ids) > settings.CAR_WASH_SPATIAL_INDEX_MAX_IDS:
+            return None
+        return ids.tolist()
+
     def get_serializer_context(self):
         context = super().get_serializer_context()
-        context.update({"request": self.request})
+        context.update({"request": self.request, "fragments": getattr(self, "fragments", {})})
         return context
 
+    def get_stream_serializer(self, chunk):
+        if self.get_requested_fields() is None:
+            self.fragments = CarWashListSerializer.get_fragments(chunk)
+        return super().get_stream_serializer(chunk)
+
     def get(self, request, *args, **kwargs):
-        serializer = super().list(request, *args, **kwargs)
+        if self.is_streaming():
+            return self.stream_response()
 
-        self.response_format["data"] = serializer.data
+        if request.user.is_authenticated:
+            data, _ = self.get_search_data()
+            return self.get_search_response(data)
+
+        tile = None
+        user_lat = request.GET.get("userLat")
+        user_lng = request.GET.get("userLng")
+        if user_lat and user_lng:
+            try:
+                tile, snapped_lat, snapped_lng = search_cache.snap_location(user_lat, user_lng)
+            except ValueError:
+                data, _ = self.get_search_data()
+                return self.get_search_response(data)
+            self.user_location = (snapped_lat, snapped_lng)
+
+        cache_key = search_cache.get_key(request.GET, tile)
+        data = search_cache.get(cache_key)
+        if data is not None:
+            return self.get_search_response(data, headers={"X-Cache": "HIT"})
+
+        data, car_washes = self.get_search_data()
+        search_cache.set(
+            cache_key,
+            data,
+            tile,
+            [car_wash.location for car_wash in car_washes],
+            radius=request.GET.get("distance"),
+        )
+        return self.get_search_response(data, headers={"X-Cache": "MISS"})
+
+    def get_search_data(self):
+        """
+        Returns the serialized search results along with the car washes
+        they were built from.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        car_washes = list(page if page is not None else queryset)
+        if self.get_requested_fields() is None:
+            self.fragments = CarWashListSerializer.get_fragments(car_washes)
+        serializer = self.get_serializer(car_washes, many=True)
+        if page is not None:
+            return self.get_paginated_response(serializer.data).data, car_washes
+        return serializer.data, car_washes
+
+    def get_search_response(self, data, headers=None):
+        self.response_format["data"] = data
+        self.response_format["error"] = None
+        self.response_format["status_code"] = status.HTTP_200_OK
+        self.response_format["message"] = ["Success"]
+
+        return Response(self.response_format, headers=headers)
+
+
+class CarWashFacetsAPIView(generics.GenericAPIView):
+    queryset = CarWash.active_objects.all()
+    permission_classes = (AllowAny,)
+    # Facet counts have no order
+    filter_backends = [DynamicSearchFilter, UnorderedFilterBackend]
+    filterset_class = ListCarWashFilter
+
+    def __init__(self, **kwargs):
+        """
+        Constructor method for formatting web response to return.
+        """
+        self.response_format = ResponseInfo().response
+        super(CarWashFacetsAPIView, self).__init__(**kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user_lat, user_lng = getattr(self, "user_location", None) or (
+            self.request.GET.get("userLat"),
+            self.request.GET.get("userLng"),
+        )
+        distance = self.request.GET.get("distance")
+
+        if user_lat and user_lng and distance:
+            queryset = CarWash.get_nearest(
+                user_lat, user_lng, distance_miles=distance, queryset=queryset
+            )
+        return queryset
+
+    @extend_schema(
+        summary="Car Wash Search Facets",
+        description=(
+            "Number of car washes per wash type, package category, amenity, "
+            "amenity category, offer type, verified, open24Hours and "
+            "active_bounty value among the results of a car wash search. "
+            "Accepts the same filters as the car wash search."
+        ),
+        responses={200},
+    )
+    def get(self, request, *args, **kwargs):
+        tile = None
+        user_lat = request.GET.get("userLat")
+        user_lng = request.GET.get("userLng")
+        if user_lat and user_lng and request.GET.get("distance"):
+            try:
+                tile, snapped_lat, snapped_lng = search_cache.snap_location(user_lat, user_lng)
+                self.user_location = (snapped_lat, snapped_lng)
+            except ValueError:
+                pass
+
+        # Facets span many tiles, so any change invalidates them
+        cache_key = search_cache.get_key(without_ordering(request.GET), tile, namespace="facets")
+        data = search_cache.get(cache_key)
+        headers = {"X-Cache": "HIT"}
+        if data is None:
+            data = get_facet_counts(self.filter_queryset(self.get_queryset()))
+            search_cache.set(cache_key, data, None, [])
+            headers["X-Cache"] = "MISS"
+
+        self.response_format["data"] = data
+        self.response_format["error"] = None
+        self.response_format["status_code"] = status.HTTP_200_OK
+        self.response_format["message"] = ["Success"]
+
+        return Response(self.response_format, headers=headers)
+
+
+class SearchCacheStatsAPIView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def __init__(self, **kwargs):
+        """
+        Constructor method for formatting web response to return.
+        """
+        self.response_format = ResponseInfo().response
+        super(SearchCacheStatsAPIView, self).__init__(**kwargs)
+
+    @extend_schema(
+        summary="Search Cache Stats",
+        description="Hit and miss counters of the anonymous car wash search cache",
+        responses={200},
+    )
+    def get(self, request, *args, **kwargs):
+        self.response_format["data"] = search_cache.stats()
+        self.response_format["error"] = None
+        self.response_format["status_code"] = status.HTTP_200_OK
+        self.response_format["message"] = ["Success"]
+
+        return Response(self.response_format)
+
+
+class CarWashMapAPIView(APIView):
+    """
+    Car washes inside a map viewport. Below CLUSTER_MAX_ZOOM they are
+    grouped into grid clusters, otherwise returned as lightweight points.
+    """
+
+    permission_classes = (AllowAny,)
+    CLUSTER_MAX_ZOOM = 12
+    CLUSTER_CELLS_PER_TILE = 8
+
+    def __init__(self, **kwargs):
+        """
+        Constructor method for formatting web response to return.
+        """
+        self.response_format = ResponseInfo().response
+        super(CarWashMapAPIView, self).__init__(**kwargs)
+
+    def get_queryset(self):
+        # Map points have no order
+        filterset = ListCarWashFilter(
+            without_ordering(self.request.GET), queryset=CarWash.active_objects.all(), request=self.request
+        )
+        if not filterset.is_valid():
+            raise DRFValidationError(filterset.errors)
+
+        # Semi-join on the filtered ids, so joins made by the filters
+        # cannot duplicate car washes in the clusters
+        return CarWash.objects.filter(id__in=filterset.qs.order_by().values("id"))
+
+    @extend_schema(
+        summary="Car Wash Map",
+        description=(
+            "Car washes inside a bounding box, as grid clusters with counts at "
+            "low zoom levels and as points otherwise. Accepts the same filters "
+            "as the car wash search."
+        ),
+        parameters=[
+            CarWashMapQuerySerializer,
+            OpenApiParameter("verified", OpenApiTypes.BOOL, required=False),
+            OpenApiParameter("washTypeName", OpenApiTypes.STR, required=False),
+            OpenApiParameter("amenityName", OpenApiTypes.STR, required=False),
+        ],
+        responses={200},
+    )
+    def get(self, request, *args, **kwargs):
+        serializer = CarWashMapQuerySerializer(data=request.GET)
+        serializer.is_valid(raise_exception=True)
+        zoom = serializer.validated_data["zoom"]
+
+        queryset = CarWash.filter_bbox(self.get_queryset(), *serializer.validated_data["bbox"])
+
+        if zoom <= self.CLUSTER_MAX_ZOOM:
+            grid_size = 360 / (2**zoom * self.CLUSTER_CELLS_PER_TILE)
+            data = {
+                "type": "clusters",
+                "results": list(CarWash.get_map_clusters(queryset, grid_size)),
+            }
+        else:
+            data = {
+                "type": "points",
+                "results": list(CarWash.get_map_points(queryset)),
+            }
+        data["zoom"] = zoom
+
+        self.response_format["data"] = data
+        self.response_format["error"] = None
+        self.response_format["status_code"] = status.HTTP_200_OK
+        self.response_format["message"] = ["Success"]
+
+        return Response(self.response_format)
+
+
+class AutocompleteAPIView(APIView):
+    """
+    Typeahead suggestions of car wash names, cities, states and postal
+    codes, answered from the in-process autocomplete index.
+    """
+
+    permission_classes = (AllowAny,)
+
+    def __init__(self, **kwargs):
+        """
+        Constructor method for formatting web response to return.
+        """
+        self.response_format = ResponseInfo().response
+        super(AutocompleteAPIView, self).__init__(**kwargs)
+
+    @extend_schema(
+        summary="Autocomplete",
+        description=(
+            "Car wash names, cities, states and postal codes with a word "
+            "starting with q. Ranked by popularity, or by proximity when "
+            "userLat and userLng are given."
+        ),
+        parameters=[AutocompleteQuerySerializer],
+        responses={200},
+    )
+    def get(self, request, *args, **kwargs):
+        serializer = AutocompleteQuerySerializer(data=request.GET)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        self.response_format["data"] = autocomplete_index.search(
+            params["q"],
+            limit=params["limit"],
+            lat=params.get("userLat"),
+            lng=params.get("userLng"),
+        )
         self.response_format["error"] = None
         self.response_format["status_code"] = status.HTTP_200_OK
         self.response_format["message"] = ["Success"]
@@ -254,6 +672,34 @@ class ListCarWashAPIView(DynamicFieldsViewMixin, ListAPIView):
         return Response(self.response_format)
 
 
+class CarWashVectorTileAPIView(APIView):
+    permission_classes = (AllowAny,)
+
+    @extend_schema(
+        summary="Car Wash Vector Tile",
+        description=(
+            "Mapbox vector tile of car wash locations, in a 'carwashes' layer "
+            "with id, name, verified, active_bounty, has_offer and min_price."
+        ),
+        responses={(200, "application/vnd.mapbox-vector-tile"): OpenApiTypes.BINARY},
+    )
+    def get(self, request, z, x, y, *args, **kwargs):
+        if z > VectorTileCache.MAX_ZOOM or x >= 2**z or y >= 2**z:
+            raise NotFound("Tile does not exist")
+
+        tile = tile_cache.get(z, x, y)
+        cache_status = "HIT"
+        if tile is None:
+            tile = CarWash.get_vector_tile(z, x, y)
+            tile_cache.set(z, x, y, tile)
+            cache_status = "MISS"
+
+        response = HttpResponse(tile, content_type="application/vnd.mapbox-vector-tile")
+        response["Cache-Control"] = f"public, max-age={settings.SEARCH_CACHE_TIMEOUT}"
+        response["X-Cache"] = cache_status
+        return response
+
+
 class S3APIView(APIView):
     permission_classes = (AllowAny,)
 
@@ -337,11 +783,23 @@ class CarWashReviewRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIVi
     def patch(self, request, *args, **kwargs):
         return super().patch(request, *args, **kwargs)
 
-
-class ListCarWashReviewAPIView(DynamicFieldsViewMixin, ListAPIView):
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        # A concurrent deletion already removed its ratings
+        instance = CarWashReview.objects.select_for_update().filter(pk=instance.pk).first()
+        if instance is None:
+            return
+        CarWashReviewStats.remove_review(instance)
+        instance.delete()
+
+
+class ListCarWashReviewAPIView(
+    CursorPaginationViewMixin, DynamicFieldsViewMixin, ListAPIView
+):
     permission_classes = (AllowAny,)
     serializer_class = CarWashReviewListSerializer
     pagination_class = CustomResponsePagination
+    cursor_ordering = ("-created_at",)
     filter_backends = [DynamicSearchFilter, DjangoFilterBackend]
     filterset_class = ListCarWashReviewFilter
 
@@ -358,7 +816,7 @@ class ListCarWashReviewAPIView(DynamicFieldsViewMixin, ListAPIView):
         Method for getting paginated queryset.
         """
         pagination = self.request.GET.get("pagination", "True")
-        if pagination == "True" or pagination == "true":
+        if pagination == "True" or pagination == "true" or pagination == "cursor":
             return super().paginate_queryset(queryset)
         return None
 
@@ -487,12 +945,10 @@ class CarWashCodeMarkAsUsedView(generics.CreateAPIView):
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-            serializer.validated_data["user"] = request.user
-            serializer.validated_data["used_at"] = datetime.now()
+            # Another request may have claimed the code in the meantime
+            if CarWashCode.allocate(offer.id, request.user, code=code.code) is None:
+                return Response({"error": "Invalid code"}, status=status.HTTP_404_NOT_FOUND)
 
-            serializer.validated_data["code"] = code
-
-            serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         return Response(
@@ -500,7 +956,7 @@ class CarWashCodeMarkAsUsedView(generics.CreateAPIView):
         )
 
 
-class ListCarWashCodeAPIView(DynamicFieldsViewMixin, ListAPIView):
+class ListCarWashCodeAPIView(StreamingListViewMixin, DynamicFieldsViewMixin, ListAPIView):
     permission_classes = (AllowAny,)
     serializer_class = CarWashCodeSerializer
     pagination_class = CustomResponsePagination
@@ -574,10 +1030,20 @@ class ListCarWashCodeAPIView(DynamicFieldsViewMixin, ListAPIView):
                 description="Comma-separated list of fields to include in the response",
                 required=False,
             ),
+            OpenApiParameter(
+                name="stream",
+                type=OpenApiTypes.BOOL,
+                location=OpenApiParameter.QUERY,
+                description="Stream every result as newline delimited JSON instead of a paginated list",
+                required=False,
+            ),
         ],
         responses={200: CarWashCodeSerializer},
     )
     def get(self, request, *args, **kwargs):
+        if self.is_streaming():
+            return self.stream_response()
+
         serializer = super().list(request, *args, **kwargs)
 
         self.response_format["data"] = serializer.data
@@ -614,7 +1080,7 @@ class ListFreeCarWashCodeAPIView(DynamicFieldsViewMixin, ListAPIView):
             offer__package_id=package_id,
             offer__offer_type="ONE_TIME",
             user__isnull=True,
-        ).distinct()
+        )
 
     @extend_schema(
         summary="List Free Car Wash Codes",
@@ -667,7 +1133,14 @@ class ListFreeCarWashCodeAPIView(DynamicFieldsViewMixin, ListAPIView):
         return Response(self.response_format)
 
 
-class ListOfferAPIView(DynamicFieldsViewMixin, ListAPIView):
+class ListOfferAPIView(
+    ConditionalGetViewMixin, StreamingListViewMixin, DynamicFieldsViewMixin, ListAPIView
+):
+    stream_select_related = ("package__car_wash",)
+    version_models = (Offer, CarWashCode, CarWash)
+    # Time dependent offers come and go with the clock
+    version_interval = 60
+    vary_on_user = True
     permission_classes = (AllowAny,)
     serializer_class = OfferSerializer
     pagination_class = CustomResponsePagination
@@ -715,8 +1188,8 @@ class ListOfferAPIView(DynamicFieldsViewMixin, ListAPIView):
 
                 if hasattr(package, "offer"):
                     offer = package.offer
-                    codes_count = offer.codes.count()
-                    unused_codes_count = offer.codes.filter(user__isnull=True).count()
+                    codes_count = offer.total_codes
+                    unused_codes_count = offer.available_codes
 
                     debug_info["offer"] = {
                         "id": offer.id,
@@ -841,10 +1314,8 @@ class ListOfferAPIView(DynamicFieldsViewMixin, ListAPIView):
 
                     if hasattr(package, "offer"):
                         offer = package.offer
-                        codes_count = offer.codes.count()
-                        unused_codes_count = offer.codes.filter(
-                            user__isnull=True
-                        ).count()
+                        codes_count = offer.total_codes
+                        unused_codes_count = offer.available_codes
 
                         package_debug["offer"] = {
                             "id": offer.id,
@@ -885,10 +1356,8 @@ class ListOfferAPIView(DynamicFieldsViewMixin, ListAPIView):
 
         if not self.request.headers.get("Authorization"):
             # Return offers with codes that are not used by the user
-            queryset = queryset.annotate(
-                codes_count=Count("codes", filter=~Q(codes__user__isnull=False))
-            ).filter(
-                ~Q(codes_count=0), offer_type__in=["TIME_DEPENDENT", "GEOGRAPHICAL"]
+            queryset = queryset.filter(
+                available_codes__gt=0, offer_type__in=["TIME_DEPENDENT", "GEOGRAPHICAL"]
             )
 
             # Handle time dependent offers
@@ -923,12 +1392,10 @@ class ListOfferAPIView(DynamicFieldsViewMixin, ListAPIView):
             else:
                 queryset = queryset.filter(offer_type__in=["TIME_DEPENDENT"])
 
-            return queryset.distinct().order_by("id")
+            return queryset.order_by("id")
         else:
             # Filter out offers that has codes not used by the user
-            queryset = queryset.annotate(
-                codes_count=Count("codes", filter=~Q(codes__user__isnull=False))
-            ).filter(~Q(codes_count=0))
+            queryset = queryset.filter(available_codes__gt=0)
 
             # Filter out one-time offers that have been used by the user
             queryset = queryset.exclude(
@@ -969,7 +1436,7 @@ class ListOfferAPIView(DynamicFieldsViewMixin, ListAPIView):
                     offer_type__in=["TIME_DEPENDENT", "ONE_TIME"]
                 )
 
-            return queryset.distinct().order_by("id")
+            return queryset.order_by("id")
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -1009,10 +1476,23 @@ class ListOfferAPIView(DynamicFieldsViewMixin, ListAPIView):
                 description="Comma-separated list of fields to include in the response",
                 required=False,
             ),
+            OpenApiParameter(
+                name="stream",
+                type=OpenApiTypes.BOOL,
+                location=OpenApiParameter.QUERY,
+                description="Stream every result as newline delimited JSON instead of a paginated list",
+                required=False,
+            ),
         ],
         responses={200: OfferSerializer},
     )
     def get(self, request, *args, **kwargs):
+        if (not_modified := self.get_not_modified_response()) is not None:
+            return not_modified
+
+        if self.is_streaming():
+            return self.stream_response()
+
         serializer = super().list(request, *args, **kwargs)
 
         self.response_format["data"] = serializer.data
@@ -1034,6 +1514,7 @@ class CreatePaymentIntentView(APIView):
             200: OpenApiResponse(description="Payment intent created successfully"),
             400: OpenApiResponse(description="Invalid request"),
             404: OpenApiResponse(description="Offer not found"),
+            409: OpenApiResponse(description="No codes left for the offer"),
         },
     )
     def post(self, request, *args, **kwargs):
@@ -1042,7 +1523,26 @@ class CreatePaymentIntentView(APIView):
 
         try:
             offer = Offer.objects.get(id=serializer.validated_data["offer_id"])
+        except Offer.DoesNotExist:
+            return Response(
+                {"error": "Offer not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        # Hold a code for the payment, released by release_code_reservations
+        # when the payment is not completed in time
+        code = None
+        if offer.available_codes > 0:
+            code = CarWashCode.reserve(
+                offer.id,
+                timezone.now() + timedelta(seconds=settings.CODE_RESERVATION_TTL),
+            )
+        if code is None:
+            return Response(
+                {"error": "No codes left for this offer"},
+                status=status.HTTP_409_CONFLICT,
+            )
 
+        try:
             # Create payment intent
             intent = stripe.PaymentIntent.create(
                 amount=int(offer.offer_price * 100),
@@ -1054,25 +1554,25 @@ class CreatePaymentIntentView(APIView):
                     "car_wash_id": offer.package.car_wash.id,
                 },
             )
+        except stripe.error.StripeError as e:
+            CarWashCode.release_reservations([code.id])
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Save payment information
+        # Save payment information
+        with transaction.atomic():
             payment = Payment.objects.create(
                 offer=offer,
+                carwash_code=code,
                 payment_intent_id=intent.id,
                 amount=offer.offer_price,
                 user=request.user,
             )
+            # The reservation belongs to this payment, see assign_reservation
+            CarWashCode.objects.filter(pk=code.pk, reserved_until__isnull=False).update(reserved_by=payment)
 
-            return Response(
-                {"clientSecret": intent.client_secret, "payment_id": payment.id}
-            )
-
-        except Offer.DoesNotExist:
-            return Response(
-                {"error": "Offer not found"}, status=status.HTTP_404_NOT_FOUND
-            )
-        except stripe.error.StripeError as e:
-            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {"clientSecret": intent.client_secret, "payment_id": payment.id}
+        )
 
 
 class CheckPaymentStatusView(generics.RetrieveAPIView):
@@ -1119,7 +1619,9 @@ class CheckPaymentStatusView(generics.RetrieveAPIView):
         return super().get(request, *args, **kwargs)
 
 
-class UserPaymentHistoryView(DynamicFieldsViewMixin, ListAPIView):
+class UserPaymentHistoryView(
+    CursorPaginationViewMixin, DynamicFieldsViewMixin, ListAPIView
+):
     permission_classes = [IsAuthenticated]
     serializer_class = UserPaymentHistorySerializer
     pagination_class = CustomResponsePagination
@@ -1137,7 +1639,7 @@ class UserPaymentHistoryView(DynamicFieldsViewMixin, ListAPIView):
         Method for getting paginated queryset.
         """
         pagination = self.request.GET.get("pagination", "False")
-        if pagination == "True" or pagination == "true":
+        if pagination == "True" or pagination == "true" or pagination == "cursor":
             return super().paginate_queryset(queryset)
         return None
 
@@ -1163,9 +1665,24 @@ class UserPaymentHistoryView(DynamicFieldsViewMixin, ListAPIView):
             ),
             OpenApiParameter(
                 name="pagination",
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description="Enable/disable pagination (default: False), or 'cursor' for cursor pagination",
+                required=False,
+                default=False,
+            ),
+            OpenApiParameter(
+                name="cursor",
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description="Opaque cursor from the next/previous links when pagination=cursor",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="count",
                 type=OpenApiTypes.BOOL,
                 location=OpenApiParameter.QUERY,
-                description="Enable/disable pagination (default: False)",
+                description="Include the total count when pagination=cursor (default: False)",
                 required=False,
                 default=False,
             ),
@@ -1,10 +1,11 @@
 import stripe
 from django.conf import settings
+from django.db import transaction
 from rest_framework.views import APIView
 from django.http import HttpResponse
 from rest_framework.permissions import AllowAny
 from drf_spectacular.utils import extend_schema, OpenApiResponse 
-from .models import CarWashCode, Payment
+from .models import CarWashCode, Payment, StripeEvent
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
 
@@ -15,9 +16,9 @@ class StripeWebhookView(APIView):
 
     @extend_schema(
         summary="Stripe Webhook Handler",
-        description="Handles Stripe payment webhook events",
+        description="Verifies Stripe payment webhook events and queues them for processing",
         responses={
-            200: OpenApiResponse(description="Webhook processed successfully"),
+            200: OpenApiResponse(description="Webhook event received"),
             400: OpenApiResponse(description="Invalid webhook payload")
         }
     )
@@ -29,19 +30,6 @@ class StripeWebhookView(APIView):
             event = stripe.Webhook.construct_event(
                 payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
             )
-
-            # Handle the event
-            event_dict = event.to_dict()
-            if event_dict['type'] == 'payment_intent.succeeded':
-                payment_intent = event_dict['data']['object']
-                handle_successful_payment(payment_intent)
-            
-            elif event_dict['type'] == 'payment_intent.payment_failed':
-                payment_intent = event_dict['data']['object']
-                handle_failed_payment(payment_intent)
-
-            return HttpResponse(status=200)
-
         except ValueError as e:
             print(f"Invalid payload: {e}")
             return HttpResponse(status=400)
@@ -49,73 +37,116 @@ class StripeWebhookView(APIView):
             print(f"Invalid signature: {e}")
             return HttpResponse(status=400)
 
+        # Processed by the process_stripe_events command
+        event_dict = event.to_dict()
+        if event_dict['type'] in EVENT_HANDLERS:
+            StripeEvent.record(event_dict)
+
+        return HttpResponse(status=200)
+
+def process_event(event):
+    """
+    Runs the handler of a StripeEvent. Handlers raise to have the event
+    retried and must be safe to run again for an event they completed.
+    """
+    EVENT_HANDLERS[event.event_type](event.payload['data']['object'])
+
+def process_pending_events(batch_size=100):
+    """
+    Processes up to batch_size due events of the inbox and returns the
+    number of processed and failed ones.
+
+    Each event is handled in its own transaction while its row is locked
+    with SKIP LOCKED, so several workers can drain the inbox and a failed
+    handler leaves no partial changes behind.
+    """
+    processed = failed = 0
+    for _ in range(batch_size):
+        with transaction.atomic():
+            event = StripeEvent.due().select_for_update(skip_locked=True).first()
+            if event is None:
+                break
+            try:
+                with transaction.atomic():
+                    process_event(event)
+            except Exception as e:
+                print(f"Error processing Stripe event {event.event_id}: {e}", flush=True)
+                event.mark_failed(f"{type(e).__name__}: {e}")
+                failed += 1
+            else:
+                event.mark_processed()
+                processed += 1
+    return processed, failed
+
 def handle_successful_payment(payment_intent):
     """Handle successful payment logic"""
-    try:
-        payment_object = Payment.objects.get(
-            payment_intent_id=payment_intent["id"]
-        )
+    payment_object = Payment.objects.select_for_update().get(
+        payment_intent_id=payment_intent["id"]
+    )
+    if payment_object.status == 'completed':
+        # Already handled, e.g. when the event is replayed
+        return
 
-        codes = CarWashCode.objects.filter(
-            offer=payment_object.offer,
-            user__isnull=True
-        )
-        
-        if not codes.exists():
-            print("No available codes for this offer", flush=True)
-        
-        code = codes.first()
-        
-        # Update payment status
-        payment_object.carwash_code = code
-        payment_object.status = 'completed'
-        payment_object.save()
-
-        # Mark the code as used
-        code.user = payment_object.user
-        code.used_at = payment_object.created_at
-        code.save()
-
-        car_wash = payment_object.offer.package.car_wash
-        # Send email to user with the code
-        html_message = render_to_string(
-            'wash_code_purchase.html',
-            {
-                "car_wash_name": car_wash.car_wash_name,
-                "car_wash_address": f"{car_wash.formatted_address}, {car_wash.city}, {car_wash.state} {car_wash.state_code}",
-                "car_wash_lat": car_wash.location.y if car_wash.location else None,
-                "car_wash_lng": car_wash.location.x if car_wash.location else None,
-                "radar_publishable_key": settings.RADAR_PUBLISHABLE_KEY,
-                "car_wash_image_url": car_wash.image_url,
-                "wash_code": code.code,
-            }
-        )
-        send_mail(
-            subject="🎉 Your WashBuddy Deal is Ready!",
-            message="Your WashBuddy Deal is Ready! Redeem your code now!",
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[payment_object.user.email],
-            html_message=html_message,
-            fail_silently=False,
+    # Hand out the code reserved for the payment, or any available
+    # one when the reservation expired before the payment completed
+    code = CarWashCode.assign_reservation(payment_object, used_at=payment_object.created_at)
+    if code is None:
+        code = CarWashCode.allocate(
+            payment_object.offer_id,
+            payment_object.user,
+            used_at=payment_object.created_at,
         )
+    if code is None:
+        raise ValueError("No available codes for this offer")
+
+    # Update payment status
+    payment_object.carwash_code = code
+    payment_object.status = 'completed'
+    payment_object.save()
 
-    except Exception as e:
-        print(f"Error processing payment: {e}", flush=True)
+    car_wash = payment_object.offer.package.car_wash
+    # Send email to user with the code; a failure rolls the code back and
+    # the event is retried
+    html_message = render_to_string(
+        'wash_code_purchase.html',
+        {
+            "car_wash_name": car_wash.car_wash_name,
+            "car_wash_address": f"{car_wash.formatted_address}, {car_wash.city}, {car_wash.state} {car_wash.state_code}",
+            "car_wash_lat": car_wash.location.y if car_wash.location else None,
+            "car_wash_lng": car_wash.location.x if car_wash.location else None,
+            "radar_publishable_key": settings.RADAR_PUBLISHABLE_KEY,
+            "car_wash_image_url": car_wash.image_url,
+            "wash_code": code.code,
+        }
+    )
+    send_mail(
+        subject="🎉 Your WashBuddy Deal is Ready!",
+        message="Your WashBuddy Deal is Ready! Redeem your code now!",
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        recipient_list=[payment_object.user.email],
+        html_message=html_message,
+        fail_silently=False,
+    )
 
 def handle_failed_payment(payment_intent):
     """Handle failed payment logic"""
-    try:
-        payment_object = Payment.objects.get(
-            payment_intent_id=payment_intent["id"]
-        )
-        error_message = None
-        if payment_intent.last_payment_error:
-            error_message = payment_intent['last_payment_error'].get('message', 'Payment failed')
-        
-        # Update payment status
-        payment_object.status = 'failed'
-        payment_object.error_message = error_message
-        payment_object.save()
-
-    except Exception as e:
-        print(f"Error processing failed payment: {e}")
\ No newline at end of file
+    payment_object = Payment.objects.select_for_update().get(
+        payment_intent_id=payment_intent["id"]
+    )
+    if payment_object.status == 'completed':
+        # A retry of the payment succeeded in the meantime
+        return
+
+    error_message = None
+    if payment_intent.get('last_payment_error'):
+        error_message = payment_intent['last_payment_error'].get('message', 'Payment failed')
+
+    # Update payment status
+    payment_object.status = 'failed'
+    payment_object.error_message = error_message
+    payment_object.save()
+
+EVENT_HANDLERS = {
+    'payment_intent.succeeded': handle_successful_payment,
+    'payment_intent.payment_failed': handle_failed_payment,
+}
@@ -1,25 +1,192 @@
+import hashlib
+import time
+from itertools import islice
+
+from django.conf import settings
 from django.db import models
+from django.http import StreamingHttpResponse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
 
 from .constants import DEFAULT_STATUS_CHOICES
+from .renderers import NDJSONRenderer
+from .utils import CustomCursorPagination
+from .versions import change_versions
 
-class DynamicFieldsViewMixin(object):
-    def get_serializer(self, *args, **kwargs):
-        serializer_class = self.get_serializer_class()
+def parse_fields(value):
+    """
+    Parses a ?fields= value into a nested selection, e.g.
+    "id,packages.price,packages.wash_types.name" becomes
+    {"id": {}, "packages": {"price": {}, "wash_types": {"name": {}}}}.
+    An empty selection stands for the whole field.
+    """
+    selection = {}
+    for path in value.split(","):
+        if not path.strip():
+            continue
+        node = selection
+        for name in path.strip().split("."):
+            node = node.setdefault(name, {})
+    return selection
+
+
+def restrict_fields(serializer, fields):
+    """
+    Drops the fields of a serializer that are not part of a nested selection
+    and restricts its nested serializers to their sub-selections. Returns the
+    sub-selections of the remaining fields that are not serializers (e.g.
+    SerializerMethodFields building their own serializers).
+    """
+    for field_name in set(serializer.fields.keys()) - set(fields):
+        serializer.fields.pop(field_name)
+
+    nested_fields = {}
+    for field_name, nested in fields.items():
+        if not nested or field_name not in serializer.fields:
+            continue
+        field = serializer.fields[field_name]
+        field = getattr(field, "child", field)
+        if hasattr(field, "fields"):
+            restrict_fields(field, nested)
+        else:
+            nested_fields[field_name] = nested
+    return nested_fields
 
-        fields = None
+
+class DynamicFieldsViewMixin(object):
+    def get_requested_fields(self):
+        """
+        Nested field selection of the ?fields= parameter, None for all fields.
+        """
         if self.request.method == "GET":
             query_fields = self.request.query_params.get("fields", None)
 
             if query_fields:
-                fields = tuple(query_fields.split(","))
+                return parse_fields(query_fields)
+        return None
+
+    def get_serializer(self, *args, **kwargs):
+        serializer_class = self.get_serializer_class()
 
         kwargs["context"] = self.get_serializer_context()
-        kwargs["fields"] = fields
+        kwargs["fields"] = self.get_requested_fields()
 
         return serializer_class(*args, **kwargs)
     
 
+class CursorPaginationViewMixin(object):
+    """
+    Switches the view to keyset pagination when called with pagination=cursor.
+    cursor_ordering is used when the filtered queryset is not ordered.
+    """
+
+    cursor_pagination_class = CustomCursorPagination
+    cursor_ordering = ("id",)
+
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator"):
+            if self.request.GET.get("pagination") == "cursor":
+                self._paginator = self.cursor_pagination_class()
+            elif self.pagination_class is None:
+                self._paginator = None
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+
+class StreamingListViewMixin(object):
+    """
+    Streams the filtered queryset as newline delimited JSON when called with
+    stream=true or format=ndjson (or Accept: application/x-ndjson), reading it
+    in chunks of stream_chunk_size so memory use does not grow with the
+    number of rows. Prefetches run once per chunk.
+    """
+
+    stream_chunk_size = 500
+    stream_select_related = ()
+
+    def get_renderers(self):
+        return super().get_renderers() + [NDJSONRenderer()]
+
+    def is_streaming(self):
+        return (
+            self.request.GET.get("stream") in ("true", "True")
+            or self.request.accepted_renderer.format == NDJSONRenderer.format
+        )
+
+    def get_stream_serializer(self, chunk):
+        return self.get_serializer(chunk, many=True)
+
+    def stream_rows(self, queryset):
+        rows = queryset.iterator(chunk_size=self.stream_chunk_size)
+        while chunk := list(islice(rows, self.stream_chunk_size)):
+            for row in self.get_stream_serializer(chunk).data:
+                yield NDJSONRenderer.render_row(row)
+
+    def stream_response(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.stream_select_related:
+            queryset = queryset.select_related(*self.stream_select_related)
+        return StreamingHttpResponse(
+            self.stream_rows(queryset), content_type=NDJSONRenderer.media_type
+        )
+
+
+class ConditionalGetViewMixin(object):
+    """
+    ETag / Last-Modified validators derived from the change counters of
+    version_models, so get() can answer If-None-Match / If-Modified-Since
+    with a 304 through get_not_modified_response() before running any query.
+    Cache-Control comes from settings.CACHE_CONTROL_POLICIES, keyed by the
+    URL name of the view.
+
+    Responses that also depend on the clock set version_interval (seconds);
+    they are treated as modified at the start of every interval.
+    """
+
+    version_models = ()
+    version_interval = None
+    vary_on_user = False
+
+    def get_etag_parts(self):
+        parts = [self.request.get_full_path(), self.request.accepted_renderer.format]
+        if self.vary_on_user:
+            parts.append(self.request.user.pk)
+        return parts
+
+    def get_validators(self):
+        if not hasattr(self, "_validators"):
+            counters, last_modified = change_versions.get(*self.version_models)
+            parts = counters + self.get_etag_parts()
+            if self.version_interval:
+                interval_start = int(time.time()) // self.version_interval * self.version_interval
+                last_modified = max(last_modified, interval_start)
+                parts.append(interval_start)
+            etag = quote_etag(hashlib.md5("|".join(str(part) for part in parts).encode()).hexdigest())
+            self._validators = (etag, last_modified)
+        return self._validators
+
+    def get_not_modified_response(self):
+        etag, last_modified = self.get_validators()
+        return get_conditional_response(self.request, etag=etag, last_modified=last_modified)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method in ("GET", "HEAD") and response.status_code in (200, 304):
+            etag, last_modified = self.get_validators()
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(last_modified)
+            url_name = request.resolver_match.url_name if request.resolver_match else None
+            policy = settings.CACHE_CONTROL_POLICIES.get(url_name)
+            if policy:
+                response["Cache-Control"] = policy
+            if self.vary_on_user:
+                patch_vary_headers(response, ["Authorization"])
+        return response
+
+
 class DynamicFieldsSerializerMixin(object):
     def __init__(self, *args, **kwargs):
         # Don't pass the 'fields' arg up to the superclass
@@ -28,12 +195,14 @@ class DynamicFieldsSerializerMixin(object):
         # Instantiate the superclass normally
         super(DynamicFieldsSerializerMixin, self).__init__(*args, **kwargs)
 
+        # Sub-selections of the fields this serializer builds itself
+        self.nested_fields = {}
+
         if fields is not None:
             # Drop any fields that are not specified in the `fields` argument.
-            allowed = set(fields)
-            existing = set(self.fields.keys())
-            for field_name in existing - allowed:
-                self.fields.pop(field_name)
+            if not isinstance(fields, dict):
+                fields = dict.fromkeys(fields, {})
+            self.nested_fields = restrict_fields(self, fields)
 
 
 class CustomModelMixin(models.Model):
@@ -0,0 +1,93 @@
+import datetime
+import decimal
+
+import orjson
+from django.contrib.gis.geos import GEOSGeometry
+from phonenumber_field.phonenumber import PhoneNumber
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def encode_default(obj):
+    """
+    Encodes the types the JSON and MessagePack encoders have no native
+    representation for, the same way DRF's JSONEncoder does.
+    """
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, GEOSGeometry):
+        return orjson.loads(obj.geojson)
+    if isinstance(obj, PhoneNumber):
+        return str(obj)
+    if isinstance(obj, datetime.datetime):
+        representation = obj.isoformat()
+        if representation.endswith("+00:00"):
+            representation = representation[:-6] + "Z"
+        return representation
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    return JSONEncoder().default(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer producing the same documents through orjson. Falls back to
+    JSONRenderer when an indented response is requested.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        return orjson.dumps(
+            data,
+            default=encode_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z,
+        )
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    MessagePack rendering, negotiated with Accept: application/msgpack.
+    Needs the optional msgpack package.
+    """
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=encode_default, datetime=False)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Newline delimited JSON, one document per list item. Views using
+    StreamingListViewMixin stream these lines instead of rendering a list.
+    """
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        rows = data if isinstance(data, list) else [data]
+        return b"".join(self.render_row(row) for row in rows)
+
+    @staticmethod
+    def render_row(row):
+        return orjson.dumps(row, default=encode_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z) + b"\n"
@@ -3,6 +3,16 @@ from rest_framework import (
     pagination,
 )
 from rest_framework.response import Response
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from datetime import datetime
+import base64
+import hashlib
+import json
+import math
 import threading
 from supabase import create_client
 
@@ -41,6 +51,187 @@ class CustomResponsePagination(pagination.PageNumberPagination):
             ]
         )
 
+class CustomCursorPagination(pagination.BasePagination):
+    """
+    Keyset pagination. The opaque cursor holds the sort key values (with an
+    id tiebreak) of the row at the edge of the current page, so the next page
+    is fetched with a WHERE clause on the sort key instead of an OFFSET.
+    The total count is only computed when requested and is cached.
+    """
+
+    page_size = 10
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    count_cache_timeout = 60
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset, view)
+        self.count = self.get_count(queryset, request)
+
+        cursor = self.decode_cursor(request)
+        is_reverse = cursor is not None and cursor["direction"] == "previous"
+
+        ordering = self.ordering
+        if is_reverse:
+            ordering = [self.reverse_field(field) for field in ordering]
+
+        queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            queryset = queryset.filter(self.get_keyset_filter(ordering, cursor["values"]))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if is_reverse:
+            results.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(
+            [
+                {
+                    "links": {
+                        "total_pages": (
+                            math.ceil(self.count / self.page_size)
+                            if self.count is not None
+                            else None
+                        ),
+                        "next": self.get_next_link(),
+                        "previous": self.get_previous_link(),
+                        "current": self.request.query_params.get(self.cursor_query_param),
+                    },
+                    "count": self.count,
+                    "results": data,
+                    "status_code": status.HTTP_200_OK,
+                }
+            ]
+        )
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return page_size
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def get_ordering(self, queryset, view):
+        """
+        Sort key of the queryset (or the view's cursor_ordering when it is
+        unordered), always ending with an id tiebreak.
+        """
+        ordering = list(queryset.query.order_by) or list(getattr(view, "cursor_ordering", ["id"]))
+        for field in ordering:
+            assert isinstance(field, str), (
+                "Cursor pagination only supports ordering by field names."
+            )
+
+        if not any(field.lstrip("-") in ("id", "pk") for field in ordering):
+            ordering.append("-id" if ordering[-1].startswith("-") else "id")
+        return ordering
+
+    def get_count(self, queryset, request):
+        if request.query_params.get(self.count_query_param) not in ("True", "true"):
+            return None
+
+        sql, params = queryset.query.sql_with_params()
+        key = "cursor-pagination-count:" + hashlib.md5(
+            (sql + repr([str(param) for param in params])).encode()
+        ).hexdigest()
+
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, self.count_cache_timeout)
+        return count
+
+    def get_keyset_filter(self, ordering, values):
+        """
+        Rows strictly after the cursor in the given ordering:
+        (f1 after v1) OR (f1 = v1 AND f2 after v2) OR ...
+        PostgreSQL sorts NULLs last ascending and first descending.
+        """
+        if len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        keyset_filter = Q(pk__in=[])
+        equal_filter = Q()
+        for field, value in zip(ordering, values):
+            descending = field.startswith("-")
+            name = field.lstrip("-")
+
+            if value is None:
+                after = Q(**{f"{name}__isnull": False}) if descending else Q(pk__in=[])
+                equal = Q(**{f"{name}__isnull": True})
+            else:
+                if descending:
+                    after = Q(**{f"{name}__lt": value})
+                else:
+                    after = Q(**{f"{name}__gt": value}) | Q(**{f"{name}__isnull": True})
+                equal = Q(**{name: value})
+
+            keyset_filter |= equal_filter & after
+            equal_filter &= equal
+        return keyset_filter
+
+    def reverse_field(self, field):
+        return field[1:] if field.startswith("-") else f"-{field}"
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor("next", self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor("previous", self.page[0])
+
+    def encode_cursor(self, direction, instance):
+        values = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip("-"))
+            # Keep microseconds, DjangoJSONEncoder would truncate them
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            values.append(value)
+        cursor = json.dumps(
+            {"d": direction, "v": values}, cls=DjangoJSONEncoder, separators=(",", ":")
+        )
+        encoded = base64.urlsafe_b64encode(cursor.encode()).decode()
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            direction = cursor["d"]
+            values = cursor["v"]
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if direction not in ("next", "previous") or not isinstance(values, list):
+            raise NotFound(self.invalid_cursor_message)
+        return {"direction": direction, "values": values}
+
+
 class SupabaseSingleton:
     _instance = None
     _lock = threading.Lock()
@@ -0,0 +1,64 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class ChangeVersionRegistry:
+    """
+    Per-model change counters and modification times, used to answer
+    conditional GETs without querying the tables themselves.
+
+    The counters live in CHANGE_VERSIONS_CACHE, shared by every process so
+    they all hand out the same ETags and see each other's changes.
+    Counters start at the current time in milliseconds rather than at zero,
+    so an evicted or flushed counter never repeats a version (and an ETag)
+    handed out before.
+    """
+
+    @property
+    def cache(self):
+        return caches[settings.CHANGE_VERSIONS_CACHE]
+
+    def _key(self, model):
+        return f"versions:{model._meta.label_lower}"
+
+    @staticmethod
+    def _now_ms():
+        return time.time_ns() // 1_000_000
+
+    def get(self, *models):
+        """
+        Returns the counters of the models and the time (in seconds since
+        the epoch) the most recently changed of them was modified.
+        """
+        keys = [self._key(model) for model in models]
+        # One round trip to the (shared, possibly remote) cache
+        values = self.cache.get_many([f"{key}:{name}" for key in keys for name in ("counter", "modified")])
+
+        counters = []
+        last_modified = 0
+        for key in keys:
+            counter = values.get(f"{key}:counter")
+            if counter is None:
+                counter = self.cache.get_or_set(f"{key}:counter", self._now_ms, timeout=None)
+            modified = values.get(f"{key}:modified")
+            if modified is None:
+                modified = self.cache.get_or_set(f"{key}:modified", lambda: counter // 1000, timeout=None)
+            counters.append(counter)
+            last_modified = max(last_modified, modified)
+        return counters, last_modified
+
+    def bump(self, *models):
+        modified = int(time.time())
+        for model in models:
+            key = self._key(model)
+            self.cache.add(f"{key}:counter", self._now_ms(), timeout=None)
+            try:
+                self.cache.incr(f"{key}:counter")
+            except ValueError:
+                self.cache.set(f"{key}:counter", self._now_ms(), timeout=None)
+            self.cache.set(f"{key}:modified", modified, timeout=None)
+
+
+change_versions = ChangeVersionRegistry()
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 import environ
+import importlib.util
 import os
 from pathlib import Path
 import dj_database_url
@@ -62,6 +63,7 @@ INSTALLED_APPS = [
     'admin_dashboard',
     'rest_framework',
     'django.contrib.gis',
+    'django.contrib.postgres',
     'carwash',
     'account',
     'import_export',
@@ -116,8 +118,16 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'account.authentication.SupabaseJWTAuthentication',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'utilities.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
+# MessagePack responses (Accept: application/msgpack) when msgpack is installed
+if importlib.util.find_spec('msgpack'):
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].insert(1, 'utilities.renderers.MessagePackRenderer')
+
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
@@ -196,8 +206,96 @@ SUPABASE_URL = os.getenv('SUPABASE_URL')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
 
+# Retries of the Stripe webhook events processed by process_stripe_events;
+# the delay (seconds) doubles after every failed attempt
+STRIPE_EVENT_MAX_ATTEMPTS = int(os.getenv('STRIPE_EVENT_MAX_ATTEMPTS', 8))
+STRIPE_EVENT_RETRY_DELAY = int(os.getenv('STRIPE_EVENT_RETRY_DELAY', 30))
+
 FRONTEND_BASE_URL = os.getenv('FRONTEND_BASE_URL')
 
+# Seconds a car wash code stays reserved for a pending payment
+CODE_RESERVATION_TTL = int(os.getenv('CODE_RESERVATION_TTL', 900))
+
+# Response cache for anonymous car wash searches. SEARCH_CACHE_BACKEND is
+# "locmem", "file", "database" or the dotted path of any Django cache
+# backend. locmem is local to each process: deployments running the Stripe
+# worker or the reservation sweeper as separate processes need a shared
+# backend, as their changes invalidate it (LOCATION is then the table name,
+# created by createcachetable).
+SEARCH_CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'database': 'django.core.cache.backends.db.DatabaseCache',
+}
+SEARCH_CACHE_BACKEND = os.getenv('SEARCH_CACHE_BACKEND', 'locmem')
+SEARCH_CACHE_LOCATION = os.getenv('SEARCH_CACHE_LOCATION', 'washbuddy-search')
+SEARCH_CACHE_TIMEOUT = int(os.getenv('SEARCH_CACHE_TIMEOUT', 300))
+SEARCH_CACHE_GEOHASH_PRECISION = int(os.getenv('SEARCH_CACHE_GEOHASH_PRECISION', 6))
+# Entries kept by the locmem, file and database backends before they cull; the other
+# backends manage their own memory and reject the option
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', 10000))
+SEARCH_CACHE_OPTIONS = (
+    {'MAX_ENTRIES': SEARCH_CACHE_MAX_ENTRIES} if SEARCH_CACHE_BACKEND in SEARCH_CACHE_BACKENDS else {}
+)
+# Serialized car washes are invalidated on change, so they can live longer.
+# They are kept apart from the search responses (one entry per car wash),
+# in a cache of the same backend
+CAR_WASH_FRAGMENT_CACHE_TIMEOUT = int(os.getenv('CAR_WASH_FRAGMENT_CACHE_TIMEOUT', 3600))
+CAR_WASH_FRAGMENT_CACHE_LOCATION = os.getenv('CAR_WASH_FRAGMENT_CACHE_LOCATION', 'washbuddy-fragments')
+CAR_WASH_FRAGMENT_CACHE_MAX_ENTRIES = int(os.getenv('CAR_WASH_FRAGMENT_CACHE_MAX_ENTRIES', 200000))
+
+# In-process NumPy index answering the search radius (needs numpy). Larger
+# result sets than CAR_WASH_SPATIAL_INDEX_MAX_IDS go through ST_DWithin.
+CAR_WASH_SPATIAL_INDEX = env.bool('CAR_WASH_SPATIAL_INDEX', default=False)
+CAR_WASH_SPATIAL_INDEX_REFRESH = int(os.getenv('CAR_WASH_SPATIAL_INDEX_REFRESH', 30))
+CAR_WASH_SPATIAL_INDEX_REBUILD = int(os.getenv('CAR_WASH_SPATIAL_INDEX_REBUILD', 3600))
+CAR_WASH_SPATIAL_INDEX_MAX_IDS = int(os.getenv('CAR_WASH_SPATIAL_INDEX_MAX_IDS', 5000))
+
+# Seconds between rebuilds of the in-process autocomplete index
+AUTOCOMPLETE_INDEX_REFRESH = int(os.getenv('AUTOCOMPLETE_INDEX_REFRESH', 300))
+
+# Cache holding the per-model change counters behind ETag / Last-Modified.
+# It has to be shared by every process (gunicorn workers, fly.io machines
+# and the worker processes), or each of them hands out its own ETags and
+# misses the changes made by the others: by default a table of the database
+# (see createcachetable).
+CHANGE_VERSIONS_CACHE = os.getenv('CHANGE_VERSIONS_CACHE', 'versions')
+CHANGE_VERSIONS_CACHE_LOCATION = os.getenv('CHANGE_VERSIONS_CACHE_LOCATION', 'washbuddy_versions')
+
+# Cache-Control of the endpoints answering conditional GETs, keyed by URL name
+CACHE_CONTROL_POLICIES = {
+    'washtype-list': os.getenv('CACHE_CONTROL_WASH_TYPES', 'public, max-age=3600'),
+    'amenity-list': os.getenv('CACHE_CONTROL_AMENITIES', 'public, max-age=3600'),
+    'get-car-wash': os.getenv('CACHE_CONTROL_CAR_WASH', 'public, max-age=60'),
+    'get-car-washes': os.getenv('CACHE_CONTROL_CAR_WASH', 'public, max-age=60'),
+    'offers-list': os.getenv('CACHE_CONTROL_OFFERS', 'private, no-cache'),
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'search': {
+        'BACKEND': SEARCH_CACHE_BACKENDS.get(SEARCH_CACHE_BACKEND, SEARCH_CACHE_BACKEND),
+        'LOCATION': SEARCH_CACHE_LOCATION,
+        'TIMEOUT': SEARCH_CACHE_TIMEOUT,
+        'OPTIONS': SEARCH_CACHE_OPTIONS,
+    },
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': CHANGE_VERSIONS_CACHE_LOCATION,
+        'TIMEOUT': None,
+    },
+    'fragments': {
+        'BACKEND': SEARCH_CACHE_BACKENDS.get(SEARCH_CACHE_BACKEND, SEARCH_CACHE_BACKEND),
+        'LOCATION': CAR_WASH_FRAGMENT_CACHE_LOCATION,
+        'TIMEOUT': CAR_WASH_FRAGMENT_CACHE_TIMEOUT,
+        'OPTIONS': (
+            {'MAX_ENTRIES': CAR_WASH_FRAGMENT_CACHE_MAX_ENTRIES} if SEARCH_CACHE_BACKEND in SEARCH_CACHE_BACKENDS else {}
+        ),
+    },
+}
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'WashBuddy API',
     'VERSION': '1.0.0',